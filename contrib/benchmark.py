@@ -0,0 +1,422 @@
+#!/usr/bin/env python2
+# - coding: utf-8 -
+# This file is part of Project Hamster.
+# Released under the terms of GNU General Public License v3 or later
+
+"""Storage benchmarks. Run from the source tree:
+
+    python2 contrib/benchmark.py [benchmark ...]
+
+Every benchmark works on a throwaway database filled with synthetic facts,
+so your own data is never touched. Without arguments all benchmarks run."""
+
+import sys, os
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+import itertools
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import datetime as dt
+
+from hamster.lib import i18n
+i18n.setup_i18n()
+
+from hamster import db, socketapi, direct
+
+
+# what sqlite gives us out of the box - rollback journal, fsync on every commit
+LEGACY_PROFILE = dict(journal_mode = "delete", synchronous = "full",
+                      mmap_size = 0, cache_size = -2000, busy_timeout = 0,
+                      statement_cache = 100)
+
+
+def make_storage(profile = None):
+    """storage on a fresh copy of the default database"""
+    database_dir = tempfile.mkdtemp(prefix="hamster-benchmark-")
+    storage = db.Storage("Unsorted", database_dir, profile)
+    storage.benchmark_dir = database_dir
+    return storage
+
+def drop_storage(storage):
+    storage.connection.close()
+    shutil.rmtree(storage.benchmark_dir)
+
+
+def fill(storage, count, start = dt.datetime(2005, 1, 3, 9, 0)):
+    """insert `count` back to back facts of 50 minutes each, straight into
+    the tables so that filling does not dominate the run"""
+    random.seed(count)
+    categories = ["category %d" % i for i in range(10)]
+    category_ids = [storage.add_category(name) for name in categories]
+    activity_ids = [storage.add_activity("activity %d" % i, random.choice(category_ids))
+                    for i in range(100)]
+    tag_ids = [tag["id"] for tag in storage.get_tag_ids(["tag%d" % i for i in range(20)])]
+
+    facts, fact_tags = [], []
+    start_time = start
+    for fact_id in range(1, count + 1):
+        end_time = start_time + dt.timedelta(minutes = 50)
+        facts.append((fact_id, random.choice(activity_ids), start_time, end_time,
+                      random.choice(["", "", "some notes"])))
+        for tag_id in random.sample(tag_ids, random.randint(0, 3)):
+            fact_tags.append((fact_id, tag_id))
+        start_time = end_time + dt.timedelta(minutes = 10)
+
+    storage.start_transaction()
+    storage.executemany("""INSERT INTO facts(id, activity_id, start_time, end_time, description)
+                                VALUES (?, ?, ?, ?, ?)""", facts)
+    storage.executemany("INSERT INTO fact_tags(fact_id, tag_id) VALUES (?, ?)", fact_tags)
+    storage.end_transaction()
+    return start, start_time
+
+
+def timed(label, func, repeat = 3):
+    """run func `repeat` times and report the best run"""
+    best, res = None, None
+    for i in range(repeat):
+        started = time.time()
+        res = func()
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print "    %-40s %8.3fs" % (label, best)
+    return res
+
+
+
+def legacy_fetch(storage, start, end):
+    """the tag-multiplied join, regrouped in python - as get_facts used to do it"""
+    query = """
+               SELECT a.id AS id,
+                      a.start_time AS start_time,
+                      a.end_time AS end_time,
+                      a.description as description,
+                      b.name AS name, b.id as activity_id,
+                      coalesce(c.name, ?) as category,
+                      e.name as tag,
+                      a.exported AS exported
+                 FROM facts a
+            LEFT JOIN activities b ON a.activity_id = b.id
+            LEFT JOIN categories c ON b.category_id = c.id
+            LEFT JOIN fact_tags d ON d.fact_id = a.id
+            LEFT JOIN tags e ON e.id = d.tag_id
+                WHERE (a.end_time >= ? OR a.end_time IS NULL) AND a.start_time <= ?
+             ORDER BY a.start_time, e.name
+    """
+    facts = storage.fetchall(query, ("Unsorted", start, end))
+
+    grouped_facts = []
+    keys = ["id", "start_time", "end_time", "description", "name",
+            "activity_id", "category", "tag", "exported"]
+    for fact_id, fact_tags in itertools.groupby(facts, lambda f: f["id"]):
+        fact_tags = list(fact_tags)
+        grouped_fact = dict([(key, fact_tags[0][key]) for key in keys])
+        grouped_fact["tags"] = [ft["tag"] for ft in fact_tags if ft["tag"]]
+        grouped_facts.append(grouped_fact)
+    return grouped_facts
+
+
+def benchmark_get_facts(count = 100000):
+    """tag aggregation in sql versus the joined rows regrouped in python"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+    print "%d facts, %s - %s" % (count, start.date(), end.date())
+
+    old = timed("joined rows + groupby", lambda: legacy_fetch(storage, start, end))
+    new = timed("get_facts (group_concat, records)",
+                lambda: storage.get_facts(start.date(), end.date(), "", 0, True))
+    print "    %d vs %d facts returned" % (len(old), len(new))
+
+    drop_storage(storage)
+
+
+def benchmark_add_fact(count = 500):
+    """add_fact bursts with the legacy and the configured connection profile"""
+    start = dt.datetime(2012, 6, 4, 9, 0)
+    for label, profile in (("legacy profile", LEGACY_PROFILE),
+                           ("configured profile", None)):
+        storage = make_storage(profile)
+        def burst():
+            storage.execute("DELETE FROM facts")
+            for i in range(count):
+                fact_start = start + dt.timedelta(minutes = 30 * i)
+                storage.add_fact("activity %d@burst, note #tag%d" % (i % 20, i % 5),
+                                 fact_start, fact_start + dt.timedelta(minutes = 25))
+
+        journal = storage.fetchone("PRAGMA journal_mode")[0]
+        timed("%s (%s), %d facts" % (label, journal, count), burst)
+        drop_storage(storage)
+
+
+def benchmark_totals(count = 100000):
+    """category totals summed from facts versus read from the daily totals"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+    print "%d facts, %s - %s" % (count, start.date(), end.date())
+
+    def summed():
+        totals = {}
+        for fact in storage.get_facts(start.date(), end.date(), "", 0, True):
+            totals[fact["category"]] = totals.get(fact["category"], dt.timedelta()) + fact["delta"]
+        return totals
+
+    old = timed("get_facts + sum per category", summed)
+    new = timed("get_totals by category",
+                lambda: storage.get_totals(start.date(), end.date(), ["category"]))
+    print "    totals match: %s" % (old == dict((total["category"], total["duration"]) for total in new))
+
+    drop_storage(storage)
+
+
+def benchmark_histogram(count = 100000):
+    """time per month and per tag with a filter, as the charts draw them"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+
+    def summed():
+        months, tags = {}, {}
+        for fact in storage.get_facts(start.date(), end.date(), "", 0, True):
+            month = fact["date"].replace(day = 1)
+            months[month] = months.get(month, dt.timedelta()) + fact["delta"]
+            if "tag1" in fact["tags"] or "tag2" in fact["tags"]:
+                for tag in fact["tags"]:
+                    tags[tag] = tags.get(tag, dt.timedelta()) + fact["delta"]
+        return sorted(months.items()), tags
+
+    def aggregated():
+        months = storage.get_histogram(start.date(), end.date(), "month")
+        tags = storage.get_totals(start.date(), end.date(), ["tag"], {"tag": ["tag1", "tag2"]})
+        return months, dict((total["tag"], total["duration"]) for total in tags)
+
+    old = timed("get_facts + sums", summed)
+    new = timed("get_histogram + get_totals", aggregated)
+    print "    results match: %s" % (old == new)
+
+    drop_storage(storage)
+
+
+def benchmark_cache(count = 20000, reads = 1000):
+    """the same day read over and over, as the tray and the applet do"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+    day = start.date() + dt.timedelta(days = 30)
+
+    def reread():
+        for i in range(reads):
+            storage.get_facts(day, None, "", 0, True)
+
+    cache_size = db.QUERY_CACHE_SIZE
+    db.QUERY_CACHE_SIZE = 0
+    timed("%d reads, no cache" % reads, reread)
+    db.QUERY_CACHE_SIZE = cache_size
+    timed("%d reads, cached" % reads, reread)
+    print "    %s" % storage.query_cache_stats()
+
+    drop_storage(storage)
+
+
+def benchmark_signals(count = 200):
+    """an export marking its facts exported, one update_fact each - how many
+    refreshes the windows listening for facts-changed get"""
+    storage = make_storage()
+    fill(storage, count)
+    facts = storage.get_facts(dt.date(2005, 1, 1), dt.date(2006, 1, 1), "", 0, True)
+    signals = []
+    storage.facts_changed = lambda: signals.append(time.time())
+
+    # a main loop of sorts, running the timers that are due between the calls
+    timers = []
+    storage.call_later = lambda seconds, func: timers.append((time.time() + seconds, func))
+    def run_due():
+        for timer in sorted(timers):
+            if timer[0] <= time.time():
+                timers.remove(timer)
+                timer[1]()
+
+    for window in (0, 0.2):
+        storage.signal_window = window
+        del signals[:]
+        started = time.time()
+        for fact in facts:
+            fact_text = "%s@%s" % (fact["name"], fact["category"])
+            storage.update_fact(fact["id"], fact_text, fact["start_time"], fact["end_time"],
+                                exported = True)
+            run_due()
+        while timers:
+            time.sleep(0.01)
+            run_due()
+        print "    window %.1fs: %d updates, %d facts-changed signals, last %.3fs after the start" % \
+              (window, count, len(signals), signals[-1] - started)
+
+    drop_storage(storage)
+
+
+def dbus_marshal(facts):
+    """what hamster-service does to hand facts out over d-bus - the
+    conversion and the serialization of the reply, minus the bus itself"""
+    import dbus, dbus.lowlevel
+    from calendar import timegm
+    reply = dbus.lowlevel.SignalMessage("/org/gnome/Hamster", "org.gnome.Hamster", "GetFacts")
+    reply.append([(fact['id'],
+                   timegm(fact['start_time'].timetuple()),
+                   timegm(fact['end_time'].timetuple()) if fact['end_time'] else 0,
+                   fact['description'] or '',
+                   fact['name'] or '',
+                   fact['activity_id'] or 0,
+                   fact['category'] or '',
+                   dbus.Array(fact['tags'], signature = 's'),
+                   timegm(fact['date'].timetuple()),
+                   fact['delta'].days * 24 * 60 * 60 + fact['delta'].seconds,
+                   fact['exported']) for fact in facts],
+                 signature = "a(iiissisasiib)")
+    return reply.get_args_list()[0]
+
+def benchmark_socket(count = 100000):
+    """facts streamed over the json socket versus marshalled for d-bus"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+
+    path = os.path.join(storage.benchmark_dir, "hamster.sock")
+    server = socketapi.Server(storage, path, lambda func: func())
+    server.start()
+    client = socketapi.Client(path)
+
+    def streamed():
+        return sum(1 for fact in client.facts(start.date(), end.date()))
+
+    try:
+        import dbus
+    except ImportError:
+        print "    no dbus module, skipping the d-bus side"
+    else:
+        facts = timed("get_facts + d-bus marshalling",
+                      lambda: dbus_marshal(storage.get_facts(start.date(), end.date(), "", 0, True)))
+        print "    %d facts" % len(facts)
+
+    facts = timed("get_facts streamed over the socket", streamed)
+    print "    %d facts" % facts
+
+    client.close()
+    server.stop()
+    drop_storage(storage)
+
+
+STARTUP = """
+import sys, time
+started = time.time()
+sys.path.insert(0, %(src)r)
+from hamster.lib import i18n
+i18n.setup_i18n()
+from hamster import db
+imported = time.time()
+storage = db.Storage("Unsorted", %(database_dir)r)
+storage.get_todays_facts()
+ready = time.time()
+heavy = [name for name in ("gtk", "pango", "beaker", "requests", "jira", "evolution")
+         if name in sys.modules]
+print imported - started, ready - imported, " ".join(heavy) or "-"
+"""
+
+def benchmark_direct(count = 100000):
+    """a report over all the facts read straight from the file, next to the
+    storage that writes, as hamster-cli --direct does it"""
+    storage = make_storage()
+    start, end = fill(storage, count)
+
+    def report():
+        reader = direct.Storage(storage.benchmark_dir)
+        facts = reader.get_facts(start, end)
+        totals = reader.get_totals(start, end, ["category"])
+        return len(facts), len(totals)
+
+    try:
+        import dbus
+    except ImportError:
+        print "    no dbus module, skipping the d-bus side"
+    else:
+        timed("get_facts + d-bus marshalling",
+              lambda: dbus_marshal(storage.get_facts(start.date(), end.date(), "", 0, True)))
+
+    facts, totals = timed("open read-only, get_facts and get_totals", report)
+    print "    %d facts, %d categories" % (facts, totals)
+    drop_storage(storage)
+
+
+def benchmark_export(count = 1000000):
+    """csv and json lines exports of all the facts, read a window of days at
+    a time and written as they come, as hamster-cli --direct export does"""
+    try:
+        from hamster import reports
+    except ImportError, e:
+        print "    can not import the reports (%s), skipping" % e
+        return
+
+    import resource
+    storage = make_storage()
+    start, end = fill(storage, count)
+    reader = direct.Storage(storage.benchmark_dir)
+    filled_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    for export_format in ("csv", "jsonl"):
+        path = os.path.join(storage.benchmark_dir, "export." + export_format)
+        started = time.time()
+        reports.simple(reader.iter_facts(start, end), start.date(), end.date(), export_format, path)
+        elapsed = time.time() - started
+        print "    %-6s %8.3fs %8d facts/s %6.1f MB written" % (export_format, elapsed, count / elapsed,
+                                                             os.path.getsize(path) / 1024.0 / 1024)
+    print "    peak memory %.1f MB after filling, %.1f MB after the exports" % \
+          (filled_memory / 1024.0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+    drop_storage(storage)
+
+
+def benchmark_startup(repeat = 5):
+    """import of the storage and the first read in a fresh interpreter, as
+    the service does it"""
+    storage = make_storage()
+    fill(storage, 10000)
+    storage.connection.close()
+
+    code = STARTUP % {"src": os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "src")),
+                      "database_dir": storage.benchmark_dir}
+    runs = []
+    for i in range(repeat):
+        process = subprocess.Popen([sys.executable, "-c", code],
+                                   stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        out, err = process.communicate()
+        if process.returncode:
+            print "    failed: %s" % err.strip().splitlines()[-1]
+            break
+        imported, ready, heavy = out.strip().splitlines()[-1].split(" ", 2)
+        runs.append((float(imported), float(ready), heavy))
+
+    if runs:
+        imported, ready, heavy = min(runs)
+        print "    %-40s %8.3fs" % ("import hamster.db", imported)
+        print "    %-40s %8.3fs" % ("open storage + today's facts", ready)
+        print "    heavy modules loaded: %s" % heavy
+
+    drop_storage(storage)
+
+
+BENCHMARKS = [
+    ("get_facts", benchmark_get_facts),
+    ("add_fact", benchmark_add_fact),
+    ("totals", benchmark_totals),
+    ("histogram", benchmark_histogram),
+    ("cache", benchmark_cache),
+    ("signals", benchmark_signals),
+    ("socket", benchmark_socket),
+    ("direct", benchmark_direct),
+    ("export", benchmark_export),
+    ("startup", benchmark_startup),
+]
+
+if __name__ == "__main__":
+    chosen = sys.argv[1:]
+    for name, benchmark in BENCHMARKS:
+        if not chosen or name in chosen:
+            print "%s: %s" % (name, benchmark.__doc__)
+            benchmark()
+            print
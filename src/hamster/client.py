@@ -19,11 +19,16 @@
 # along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import logging
+import copy
 import datetime as dt
 from calendar import timegm
+from collections import OrderedDict
+from functools import partial
 import dbus, dbus.mainloop.glib
 import gobject
-from lib import Fact
+from lib import Fact, columnar
+from storage import date_windows
 from lib import trophies
 
 
@@ -44,11 +49,76 @@ def from_dbus_fact(fact):
             id = fact[0]
             )
 
+# how many distinct fact queries the opt-in cache holds on to
+FACTS_CACHE_SIZE = 16
+
+# days in a reply of read_facts_columnar - a year of facts comes in a few
+# hundred kilobytes
+COLUMNS_WINDOW_DAYS = 366
+
+def to_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
+
+
+class ReadRequest(object):
+    """Handle of a read made with one of the *_async methods of Storage.
+       Once cancelled, or superseded by a newer read, its callbacks are not
+       called.
+    """
+    def __init__(self, method, args, convert, callback, error_callback, cache_key = None):
+        self.method, self.args, self.convert = method, args, convert
+        self.callback, self.error_callback = callback, error_callback
+        self.cache_key = cache_key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ColumnsRead(object):
+    """Handle of read_facts_columnar. The windows are asked for one after
+       the other, each once the previous one is in. Once cancelled, no more
+       are asked for and the callbacks are not called.
+    """
+    def __init__(self, storage, callback, windows, search_terms, asc_by_date, error_callback):
+        self.storage, self.callback, self.error_callback = storage, callback, error_callback
+        self.windows = list(windows)
+        self.search_terms, self.asc_by_date = search_terms, asc_by_date
+        self.request = None
+        self.cancelled = False
+        self._read_next()
+
+    def _read_next(self):
+        window_start, window_end = self.windows.pop(0)
+        self.request = self.storage.get_facts_columnar_async(self._on_window, window_start, window_end,
+                                                             self.search_terms, self.asc_by_date,
+                                                             self._on_error)
+
+    def _on_window(self, columns):
+        last = not self.windows
+        if not last:
+            self._read_next()
+        self.callback(columns, last)
+
+    def _on_error(self, error):
+        if self.error_callback:
+            self.error_callback(error)
+        else:
+            logging.warn("GetFactsColumnar failed: %s" % error)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.request:
+            self.request.cancel()
+
+
 class Storage(gobject.GObject):
     """Hamster client class, communicating to hamster storage daemon via d-bus.
        Subscribe to the `tags-changed`, `facts-changed` and `activities-changed`
        signals to be notified when an appropriate factoid of interest has been
-       changed.
+       changed. When the service tells which facts and dates were affected,
+       `facts-changed-detailed` comes with them right before `facts-changed`,
+       so listeners of both can leave that `facts-changed` be.
 
        In storage a distinguishment is made between the classificator of
        activities and the event in tracking log.
@@ -56,23 +126,49 @@ class Storage(gobject.GObject):
        we use term 'activity'.
        The relationship is - one activity can be used in several facts.
        The rest is hopefully obvious. But if not, please file bug reports!
+
+       With cache_facts on, results of get_facts and get_todays_facts are
+       kept until the service signals a change, and handed out as copies.
+       It is off by default, as one-off readers would only pay for it - the
+       windows of the app share configuration.runtime.storage, which has it
+       on.
+
+       Every read method has an *_async variant that takes the callback
+       (and optionally error_callback) and returns a ReadRequest instead of
+       waiting for the service. A newer read of the same method for the same
+       callback supersedes the previous one, so only the latest result is
+       delivered and reads requested in the meantime are never sent.
     """
     __gsignals__ = {
         "tags-changed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
         "facts-changed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
+        # ids, first and last date affected, kind
+        "facts-changed-detailed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE,
+                                   (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT,
+                                    gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT)),
         "activities-changed": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
         "toggle-called": (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, ()),
     }
 
-    def __init__(self):
+    def __init__(self, cache_facts = False):
         gobject.GObject.__init__(self)
 
+        # converted facts by query - callers get copies of them
+        self._facts_cache = OrderedDict() if cache_facts else None
+        self._fact_changes = None # details of the change being signalled
+        self._facts_generation = 0 # bumped on every invalidation
+
+        # async reads by (method, callback) - the one waiting for the reply
+        # and the latest one waiting for its turn
+        self._reads_in_flight, self._reads_queued = {}, {}
+
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         self.bus = dbus.SessionBus()
         self._connection = None # will be initiated on demand
 
         self.bus.add_signal_receiver(self._on_tags_changed, 'TagsChanged', 'org.gnome.Hamster')
         self.bus.add_signal_receiver(self._on_facts_changed, 'FactsChanged', 'org.gnome.Hamster')
+        self.bus.add_signal_receiver(self._on_facts_changed_detailed, 'FactsChangedDetailed', 'org.gnome.Hamster')
         self.bus.add_signal_receiver(self._on_activities_changed, 'ActivitiesChanged', 'org.gnome.Hamster')
         self.bus.add_signal_receiver(self._on_toggle_called, 'ToggleCalled', 'org.gnome.Hamster')
 
@@ -92,16 +188,154 @@ class Storage(gobject.GObject):
 
     def _on_dbus_connection_change(self, name, old, new):
         self._connection = None
+        self._invalidate_facts()
 
     def _on_tags_changed(self):
+        self._invalidate_facts()
         self.emit("tags-changed")
 
+    def _on_facts_changed_detailed(self, ids, min_date, max_date, kind):
+        # FactsChanged comes right after
+        self._fact_changes = ([int(id) for id in ids],
+                              dt.datetime.utcfromtimestamp(min_date).date() if min_date else None,
+                              dt.datetime.utcfromtimestamp(max_date).date() if max_date else None,
+                              str(kind))
+
     def _on_facts_changed(self):
+        changes, self._fact_changes = self._fact_changes, None
+
+        if changes and changes[1]:
+            self._invalidate_facts(changes[1], changes[2])
+        else:
+            self._invalidate_facts()
+
+        if changes:
+            self.emit("facts-changed-detailed", *changes)
         self.emit("facts-changed")
 
     def _on_activities_changed(self):
+        self._invalidate_facts()
         self.emit("activities-changed")
 
+    def _invalidate_facts(self, start_date = None, end_date = None):
+        """forget cached facts of the given dates, or all of them"""
+        self._facts_generation += 1
+        if not self._facts_cache:
+            return
+
+        if start_date is None:
+            self._facts_cache.clear()
+            return
+
+        end_date = end_date or start_date
+        for key in list(self._facts_cache):
+            date, key_end_date = key[:2]
+            if date <= end_date and start_date <= (key_end_date or date):
+                del self._facts_cache[key]
+
+    def _fetch_facts(self, key, fetch):
+        """facts from the cache if we have them, else converted from what
+        fetch gets from the service"""
+        if self._facts_cache is None:
+            return self._from_dbus_facts(fetch())
+
+        if key not in self._facts_cache:
+            self._cache_facts(key, self._from_dbus_facts(fetch()))
+        return self._copy_facts(self._facts_cache[key])
+
+    def _cache_facts(self, key, facts):
+        self._facts_cache[key] = facts
+        if len(self._facts_cache) > FACTS_CACHE_SIZE:
+            self._facts_cache.popitem(last = False)
+
+    def _read_async(self, callback, error_callback, method, args, convert, cache_key = None):
+        """call the d-bus method without waiting for the reply, which is
+        converted and handed to the callback. if a read of the same method
+        for the same callback is still on its way, the new one waits for it
+        to come back and replaces any other read waiting"""
+        request = ReadRequest(method, args, convert, callback, error_callback, cache_key)
+
+        channel = (method, callback)
+        owner = getattr(callback, "__self__", None)
+        if owner is not None:
+            # bound methods are made anew on every lookup, and the owner
+            # is kept alive by the request
+            channel = (method, id(owner), callback.__name__)
+
+        for superseded in (self._reads_in_flight.get(channel), self._reads_queued.pop(channel, None)):
+            if superseded:
+                superseded.cancel()
+
+        if channel in self._reads_in_flight:
+            self._reads_queued[channel] = request
+        else:
+            self._send_read(channel, request)
+        return request
+
+    def _send_read(self, channel, request):
+        self._reads_in_flight[channel] = request
+        request.generation = self._facts_generation
+
+        if self._facts_cache and request.cache_key in self._facts_cache:
+            gobject.idle_add(self._on_read_done, channel, request,
+                             self._facts_cache[request.cache_key], None, True)
+            return
+
+        try:
+            getattr(self.conn, request.method)(*request.args,
+                # methods with several return values reply with them as a tuple
+                reply_handler = lambda *result: self._on_read_done(channel, request,
+                                                                   result if len(result) > 1 else result[0],
+                                                                   None),
+                error_handler = lambda error: self._on_read_done(channel, request, None, error))
+        except dbus.DBusException as error:
+            gobject.idle_add(self._on_read_done, channel, request, None, error)
+
+    def _on_read_done(self, channel, request, result, error, cached = False):
+        if self._reads_in_flight.get(channel) is request:
+            del self._reads_in_flight[channel]
+            queued = self._reads_queued.pop(channel, None)
+            if queued and not queued.cancelled:
+                self._send_read(channel, queued)
+
+        if request.cancelled:
+            return False
+
+        if error is not None:
+            if request.error_callback:
+                request.error_callback(error)
+            else:
+                logging.warn("%s failed: %s" % (request.method, error))
+            return False
+
+        if not cached:
+            result = request.convert(result)
+            if request.cache_key is not None and self._facts_cache is not None \
+               and request.generation == self._facts_generation:
+                self._cache_facts(request.cache_key, result)
+
+        if request.cache_key is not None and self._facts_cache is not None:
+            result = self._copy_facts(result)
+
+        request.callback(result)
+        return False
+
+    def _from_dbus_facts(self, facts):
+        return [from_dbus_fact(fact) for fact in facts]
+
+    def _copy_facts(self, facts):
+        """copies of cached facts, for the callers to keep and change"""
+        now = dt.datetime.now().replace(microsecond = 0)
+        copies = []
+        for fact in facts:
+            fact = copy.copy(fact)
+            fact.tags = list(fact.tags)
+            # ongoing facts go on after they were cached
+            if not fact.end_time and (dt.date.today() - fact.start_time.date()) <= dt.timedelta(days=1):
+                fact.delta = now - fact.start_time
+            copies.append(fact)
+        return copies
+
     def _on_toggle_called(self):
         self.emit("toggle-called")
 
@@ -113,7 +347,22 @@ class Storage(gobject.GObject):
         """returns facts of the current date, respecting hamster midnight
            hamster midnight is stored in gconf, and presented in minutes
         """
-        return [from_dbus_fact(fact) for fact in self.conn.GetTodaysFacts()]
+        if self._facts_cache is None:
+            return [from_dbus_fact(fact) for fact in self.conn.GetTodaysFacts()]
+
+        return self.get_facts(self._today())
+
+    def get_todays_facts_async(self, callback, error_callback = None):
+        """get_todays_facts that hands the facts to the callback"""
+        if self._facts_cache is None:
+            return self._read_async(callback, error_callback, "GetTodaysFacts", (),
+                                    lambda facts: [from_dbus_fact(fact) for fact in facts])
+        return self.get_facts_async(callback, self._today(), error_callback = error_callback)
+
+    def _today(self):
+        from configuration import conf
+        day_start = conf.get("day_start_minutes")
+        return (dt.datetime.now() - dt.timedelta(minutes = day_start)).date()
 
     def get_facts(self, date, end_date = None, search_terms = "", limit = None, asc_by_date = True):
         """Returns facts for the time span matching the optional filter criteria.
@@ -121,17 +370,146 @@ class Storage(gobject.GObject):
            to boolean AND.
            Filter is applied to tags, categories, activity names and description
         """
+        key, args = self._facts_args(date, end_date, search_terms, limit, asc_by_date)
+        return self._fetch_facts(key, lambda: self.conn.GetFacts(*args))
+
+    def get_facts_async(self, callback, date, end_date = None, search_terms = "",
+                        limit = None, asc_by_date = True, error_callback = None):
+        """get_facts that hands the facts to the callback"""
+        key, args = self._facts_args(date, end_date, search_terms, limit, asc_by_date)
+        return self._read_async(callback, error_callback, "GetFacts", args,
+                                self._from_dbus_facts, cache_key = key)
+
+    def _facts_args(self, date, end_date, search_terms, limit, asc_by_date):
+        """cache key and d-bus arguments of GetFacts"""
+        key = (to_date(date), to_date(end_date), search_terms, limit, asc_by_date)
+
         date = timegm(date.timetuple())
         limit = limit or 0
         end_date = end_date or 0
         if end_date:
             end_date = timegm(end_date.timetuple())
 
-        return [from_dbus_fact(fact) for fact in self.conn.GetFacts(date,
-                                                                    end_date,
-                                                                    search_terms,
-                                                                    limit,
-                                                                    asc_by_date)]
+        return key, (date, end_date, search_terms, limit, asc_by_date)
+
+    def iter_facts(self, date, end_date = None, search_terms = "", asc_by_date = True):
+        """Same as get_facts, except that the facts are fetched a window of
+           days at a time as they are consumed, so that long ranges do not
+           end up in one huge message.
+        """
+        for window_start, window_end in date_windows(to_date(date), to_date(end_date), asc_by_date):
+            facts = self.conn.GetFacts(timegm(window_start.timetuple()),
+                                       timegm(window_end.timetuple()),
+                                       search_terms, 0, asc_by_date)
+            for fact in facts:
+                yield from_dbus_fact(fact)
+
+    def get_facts_columnar(self, date, end_date = None, search_terms = "", asc_by_date = True):
+        """Same as get_facts, except that the facts come as a
+           columnar.FactColumns - a list per field instead of fact objects,
+           for stats and charts over long ranges.
+        """
+        return self._from_dbus_columns(self.conn.GetFactsColumnar(*self._columnar_args(date, end_date,
+                                                                                        search_terms,
+                                                                                        asc_by_date)))
+
+    def get_facts_columnar_async(self, callback, date, end_date = None, search_terms = "",
+                                 asc_by_date = True, error_callback = None):
+        """get_facts_columnar that hands the columns to the callback"""
+        return self._read_async(callback, error_callback, "GetFactsColumnar",
+                                self._columnar_args(date, end_date, search_terms, asc_by_date),
+                                self._from_dbus_columns)
+
+    def read_facts_columnar(self, callback, date, end_date = None, search_terms = "",
+                            asc_by_date = True, error_callback = None):
+        """get_facts_columnar_async for long spans, read COLUMNS_WINDOW_DAYS
+           at a time so that no single reply holds all of it. callback gets
+           the columns of each window, in the order of the dates, and
+           whether it was the last one. Returns a ColumnsRead.
+        """
+        windows = date_windows(to_date(date), to_date(end_date), asc_by_date, COLUMNS_WINDOW_DAYS)
+        return ColumnsRead(self, callback, windows, search_terms, asc_by_date, error_callback)
+
+    def _columnar_args(self, date, end_date, search_terms, asc_by_date):
+        date = timegm(date.timetuple())
+        end_date = timegm(end_date.timetuple()) if end_date else 0
+        return (date, end_date, search_terms, asc_by_date)
+
+    def _from_dbus_columns(self, columns):
+        return columnar.FactColumns(*[list(column) for column in columns])
+
+    def get_totals(self, date, end_date = None, group_by = (), filters = None):
+        """Returns totals of the facts within the dates, grouped by any of
+           "date", "activity", "category" and "tag" - a list of dicts with
+           the group values, duration (timedelta) and number of facts.
+           Facts without tags go under the None tag.
+           Filters is a dict that can hold lists of "category", "activity"
+           and "tag" names a fact should have one of (None for no tags), and
+           "search" terms as in get_facts.
+        """
+        totals = self.conn.GetTotals(*self._totals_args(date, end_date, group_by, filters))
+        return self._from_dbus_totals(group_by, totals)
+
+    def get_totals_async(self, callback, date, end_date = None, group_by = (),
+                         filters = None, error_callback = None):
+        """get_totals that hands the totals to the callback"""
+        return self._read_async(callback, error_callback, "GetTotals",
+                                self._totals_args(date, end_date, group_by, filters),
+                                partial(self._from_dbus_totals, group_by))
+
+    def _totals_args(self, date, end_date, group_by, filters):
+        date = timegm(date.timetuple())
+        end_date = timegm(end_date.timetuple()) if end_date else 0
+
+        dbus_filters = {}
+        for key, values in (filters or {}).items():
+            if key == "search":
+                values = [values]
+            dbus_filters[key] = [value or "" for value in values]
+
+        return date, end_date, list(group_by), dbus.Dictionary(dbus_filters, signature = "sas")
+
+    def _from_dbus_totals(self, group_by, totals):
+        res = []
+        for total in totals:
+            values = {"date": dt.datetime.utcfromtimestamp(total[0]).date() if total[0] else None,
+                      "activity": total[1],
+                      "category": total[2],
+                      "tag": total[3] or None}
+            total_dict = dict((group, values[group]) for group in group_by)
+            total_dict["duration"] = dt.timedelta(seconds = total[4])
+            total_dict["facts"] = total[5]
+            res.append(total_dict)
+        return res
+
+    def get_histogram(self, date, end_date = None, bucket = "day"):
+        """Returns time tracked within the dates by the "hour" of the clock,
+           or by hamster "day" or "month" - a sorted list of (start,
+           duration) tuples for the buckets that have anything in them.
+           Start is a datetime for hours and a date otherwise.
+        """
+        histogram = self.conn.GetHistogram(*self._histogram_args(date, end_date, bucket))
+        return self._from_dbus_histogram(bucket, histogram)
+
+    def get_histogram_async(self, callback, date, end_date = None, bucket = "day", error_callback = None):
+        """get_histogram that hands the buckets to the callback"""
+        return self._read_async(callback, error_callback, "GetHistogram",
+                                self._histogram_args(date, end_date, bucket),
+                                partial(self._from_dbus_histogram, bucket))
+
+    def _histogram_args(self, date, end_date, bucket):
+        date = timegm(date.timetuple())
+        end_date = timegm(end_date.timetuple()) if end_date else 0
+        return date, end_date, bucket
+
+    def _from_dbus_histogram(self, bucket, histogram):
+        res = []
+        for start, duration in histogram:
+            start = dt.datetime.utcfromtimestamp(start)
+            if bucket != "hour":
+                start = start.date()
+            res.append((start, dt.timedelta(seconds = duration)))
+        return res
 
     def get_activities(self, search = ""):
         """returns list of activities name matching search criteria.
@@ -140,6 +518,11 @@ class Storage(gobject.GObject):
         """
         return self._to_dict(('name', 'category'), self.conn.GetActivities(search))
 
+    def get_activities_async(self, callback, search = "", error_callback = None):
+        """get_activities that hands the activities to the callback"""
+        return self._read_async(callback, error_callback, "GetActivities", (search,),
+                                partial(self._to_dict, ('name', 'category')))
+
     def get_ext_activities(self, search = ""):
         """returns list of activities name matching search criteria.
            results are sorted by most recent usage.
@@ -147,14 +530,29 @@ class Storage(gobject.GObject):
         """
         return self._to_dict(('name', 'category'), self.conn.GetExtActivities(search))
 
+    def get_ext_activities_async(self, callback, search = "", error_callback = None):
+        """get_ext_activities that hands the activities to the callback"""
+        return self._read_async(callback, error_callback, "GetExtActivities", (search,),
+                                partial(self._to_dict, ('name', 'category')))
+
     def get_categories(self):
         """returns list of categories"""
         return self._to_dict(('id', 'name'), self.conn.GetCategories())
 
+    def get_categories_async(self, callback, error_callback = None):
+        """get_categories that hands the categories to the callback"""
+        return self._read_async(callback, error_callback, "GetCategories", (),
+                                partial(self._to_dict, ('id', 'name')))
+
     def get_tags(self, only_autocomplete = False):
         """returns list of all tags. by default only those that have been set for autocomplete"""
         return self._to_dict(('id', 'name', 'autocomplete'), self.conn.GetTags(only_autocomplete))
 
+    def get_tags_async(self, callback, only_autocomplete = False, error_callback = None):
+        """get_tags that hands the tags to the callback"""
+        return self._read_async(callback, error_callback, "GetTags", (only_autocomplete,),
+                                partial(self._to_dict, ('id', 'name', 'autocomplete')))
+
 
     def get_tag_ids(self, tags):
         """find tag IDs by name. tags should be a list of labels
@@ -174,6 +572,10 @@ class Storage(gobject.GObject):
         """returns fact by it's ID"""
         return from_dbus_fact(self.conn.GetFact(id))
 
+    def get_fact_async(self, callback, id, error_callback = None):
+        """get_fact that hands the fact to the callback"""
+        return self._read_async(callback, error_callback, "GetFact", (id,), from_dbus_fact)
+
     def add_fact(self, fact, temporary_activity = False):
         """Add fact. activity name can use the
         `[-]start_time[-end_time] activity@category, description #tag1 #tag2`
@@ -192,6 +594,7 @@ class Storage(gobject.GObject):
         if end_timestamp:
             end_timestamp = timegm(end_timestamp.timetuple())
 
+        self._invalidate_facts()
         new_id = self.conn.AddFact(serialized,
                                    start_timestamp,
                                    end_timestamp,
@@ -203,14 +606,31 @@ class Storage(gobject.GObject):
             trophies.checker.check_fact_based(fact)
         return new_id
 
+    def add_facts(self, facts):
+        """Add many facts at once, eg. when importing from another tracker.
+        Overlaps are resolved once over the whole batch and a single
+        `facts-changed` signal follows. Returns ids of the new facts"""
+        batch = []
+        for fact in facts:
+            start_timestamp = timegm(fact.start_time.timetuple()) if fact.start_time else 0
+            end_timestamp = timegm(fact.end_time.timetuple()) if fact.end_time else 0
+            batch.append((fact.serialized_name(), start_timestamp, end_timestamp))
+
+        if not batch:
+            return []
+        self._invalidate_facts()
+        return self.conn.AddFacts(batch)
+
     def stop_tracking(self, end_time = None):
         """Stop tracking current activity. end_time can be passed in if the
         activity should have other end time than the current moment"""
         end_time = timegm((end_time or dt.datetime.now()).timetuple())
+        self._invalidate_facts()
         return self.conn.StopTracking(end_time)
 
     def remove_fact(self, fact_id):
         "delete fact from database"
+        self._invalidate_facts()
         self.conn.RemoveFact(fact_id)
 
     def update_fact(self, fact_id, fact, temporary_activity = False, exported = False):
@@ -226,6 +646,7 @@ class Storage(gobject.GObject):
         if end_time:
             end_time = timegm(end_time.timetuple())
 
+        self._invalidate_facts()
         new_id =  self.conn.UpdateFact(fact_id,
                                        fact.serialized_name(),
                                        start_time,
@@ -243,10 +664,19 @@ class Storage(gobject.GObject):
         category_id = category_id or -1
         return self._to_dict(('id', 'name', 'category_id', 'category'), self.conn.GetCategoryActivities(category_id))
 
+    def get_category_activities_async(self, callback, category_id = None, error_callback = None):
+        """get_category_activities that hands the activities to the callback"""
+        return self._read_async(callback, error_callback, "GetCategoryActivities", (category_id or -1,),
+                                partial(self._to_dict, ('id', 'name', 'category_id', 'category')))
+
     def get_category_id(self, category_name):
         """returns category id by name"""
         return self.conn.GetCategoryId(category_name)
 
+    def get_category_id_async(self, callback, category_name, error_callback = None):
+        """get_category_id that hands the id to the callback"""
+        return self._read_async(callback, error_callback, "GetCategoryId", (category_name,), int)
+
     def get_activity_by_name(self, activity, category_id = None, resurrect = True):
         """returns activity dict by name and optionally filtering by category.
            if activity is found but is marked as deleted, it will be resurrected
@@ -255,24 +685,60 @@ class Storage(gobject.GObject):
         category_id = category_id or 0
         return self.conn.GetActivityByName(activity, category_id, resurrect)
 
+    def get_activity_by_name_async(self, callback, activity, category_id = None,
+                                   resurrect = True, error_callback = None):
+        """get_activity_by_name that hands the activity to the callback"""
+        return self._read_async(callback, error_callback, "GetActivityByName",
+                                (activity, category_id or 0, resurrect), lambda activity: activity)
+
     # category and activity manipulations (normally just via preferences)
     def remove_activity(self, id):
+        self._invalidate_facts()
         self.conn.RemoveActivity(id)
 
     def remove_category(self, id):
+        self._invalidate_facts()
         self.conn.RemoveCategory(id)
 
     def change_category(self, id, category_id):
+        self._invalidate_facts()
         return self.conn.ChangeCategory(id, category_id)
 
     def update_activity(self, id, name, category_id):
+        self._invalidate_facts()
         return self.conn.UpdateActivity(id, name, category_id)
 
     def add_activity(self, name, category_id = -1):
         return self.conn.AddActivity(name, category_id)
 
     def update_category(self, id, name):
+        self._invalidate_facts()
         return self.conn.UpdateCategory(id, name)
 
     def add_category(self, name):
         return self.conn.AddCategory(name)
+
+    # maintenance
+    def reindex(self):
+        """rebuild the full text search index. the index is kept up to date
+        on its own, so this is needed only if it has gone out of sync"""
+        self.conn.Reindex()
+
+    def get_metrics(self):
+        """call counts and latencies of what the service has been doing, and
+        the latest slow queries. returns (timings, slow queries) as lists of
+        dicts, the timings with the calls per hamster.lib.metrics.BUCKETS"""
+        timings, slow_queries = self.conn.GetMetrics()
+        timings = [{"name": unicode(name), "count": int(count), "total": float(total),
+                    "max": float(max_seconds), "buckets": [int(calls) for calls in buckets]}
+                   for name, count, total, max_seconds, buckets in timings]
+        return timings, self._to_dict(('statement', 'seconds', 'params', 'plan'), slow_queries)
+
+    def repair_overlaps(self, start_time = None, end_time = None):
+        """resolve overlapping facts in one pass, the later fact wins.
+        without the span the whole database is checked.
+        returns number of facts that were changed"""
+        start_time = timegm(start_time.timetuple()) if start_time else 0
+        end_time = timegm(end_time.timetuple()) if end_time else 0
+        self._invalidate_facts()
+        return self.conn.RepairOverlaps(start_time, end_time)
@@ -28,7 +28,7 @@ from external import ActivitiesSource
 from client import Storage
 from xdg.BaseDirectory import xdg_data_home
 import logging
-import gobject, gtk
+import gobject
 
 log = logging.getLogger("configuration")
 
@@ -47,7 +47,7 @@ class RuntimeStore(Singleton):
     last_etag = None
     data_dir = ""
     home_data_dir = ""
-    storage = None
+    _storage = None
     conf = None
     external = None
     external_need_update = True
@@ -66,11 +66,17 @@ class RuntimeStore(Singleton):
 
         self.data_dir = os.path.realpath(self.data_dir)
 
-
-        self.storage = Storage()
-
         self.home_data_dir = os.path.realpath(os.path.join(xdg_data_home, "hamster-time-tracker"))
         
+    @property
+    def storage(self):
+        # connected on first use - the service imports us, but talks to
+        # the database itself. the windows share it and read the same days
+        # over and over, so it keeps the facts until they change
+        if not self._storage:
+            self._storage = Storage(cache_facts = True)
+        return self._storage
+
     def get_external(self):
         if self.external_need_update:
             self.refresh_external(conf)
@@ -111,6 +117,7 @@ class OneWindow(object):
             self.dialogs[params].show()
             window.present()
         else:
+            import gtk
             if parent:
                 dialog = self.get_dialog_class()(parent, **kwargs)
 
@@ -166,6 +173,7 @@ dialogs = Dialogs()
 
 
 def load_ui_file(name):
+    import gtk
     ui = gtk.Builder()
     ui.add_from_file(os.path.join(runtime.data_dir, name))
     return ui
@@ -210,6 +218,15 @@ class GConfStore(gobject.GObject, Singleton):
         'redmine_user'                  :   "",          #
         'redmine_pass'                  :   "",          #
         'redmine_query'                 :   "",
+        'db_journal_mode'             :   "wal",       # sqlite journal mode of the database
+        'db_synchronous'              :   "normal",    # sqlite fsync policy (off, normal, full, extra)
+        'db_mmap_size'                :   67108864,    # bytes of the database to memory-map (64MB)
+        'db_cache_size'               :   -8 * 1024,   # page cache, negative values are in KiB
+        'db_busy_timeout'             :   5000,        # milliseconds to wait for a locked database
+        'db_statement_cache'          :   256,         # prepared statements kept per connection
+        'socket_api'                  :   False,       # Serve the storage api as json on a unix socket
+        'socket_path'                 :   "",          # Where the socket goes, $XDG_RUNTIME_DIR/hamster.sock if empty
+        'change_signal_window'        :   200,         # milliseconds to gather changes for before signalling them
 #         from jira.client import JIRA
 #         jira = JIRA(options={'server':'https://jira.unity.pl'}, basic_auth=('gsobczyk', 'secret!'))
 
@@ -34,11 +34,10 @@ except ImportError:
 
 import os, time
 import datetime
+import threading
+from collections import OrderedDict
 import storage
 from shutil import copy as copyfile
-from configuration import conf
-from external import ActivitiesSource
-import itertools
 import datetime as dt
 try:
     import gio
@@ -46,21 +45,347 @@ except ImportError:
     print "Could not import gio - requires pygobject. File monitoring will be disabled"
     gio = None
 
-from lib import Fact
+from lib import Fact, overlaps, metrics
 try:
     from lib import trophies
 except:
     trophies = None
 
+# data_version tells us of the commits of other connections, and the
+# hourly histogram cuts facts with a recursive query
+MIN_SQLITE_VERSION = (3, 8, 4)
+
+def check_sqlite_version():
+    """fails with a message saying what is needed rather than with the
+    first query sqlite does not understand"""
+    if sqlite.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise sqlite.NotSupportedError("hamster needs sqlite %s or newer, found %s" %
+                                       (".".join(str(part) for part in MIN_SQLITE_VERSION),
+                                        sqlite.sqlite_version))
+
+# tag names of a fact are concatenated in the query so that we get back one
+# row per fact. the unit separator does not make it into tag names
+TAG_SEPARATOR = u"\x1f"
+TAGS_SUBQUERY = """(SELECT group_concat(name, ?)
+                      FROM (SELECT e.name AS name
+                              FROM fact_tags d
+                              JOIN tags e ON e.id = d.tag_id
+                             WHERE d.fact_id = a.id
+                          ORDER BY e.name))"""
+
+
+# the full text index is maintained by sqlite itself - any write to facts,
+# activities, categories or tags refreshes the affected index rows
+FACT_INDEX_SOURCE = """SELECT b.name, c.name
+                         FROM activities b
+                    LEFT JOIN categories c ON b.category_id = c.id
+                        WHERE b.id = %s"""
+FACT_INDEX_TAGS = """(SELECT group_concat(e.name, ' ')
+                        FROM fact_tags d
+                        JOIN tags e ON e.id = d.tag_id
+                       WHERE d.fact_id = %s)"""
+FACT_INDEX_TRIGGERS = {
+    "fact_index_insert": """
+        CREATE TRIGGER fact_index_insert AFTER INSERT ON facts
+        BEGIN
+            INSERT INTO fact_index(docid, name, category, description, tag)
+                 SELECT new.id, source.*, new.description, %s
+                   FROM (%s) source;
+        END""" % (FACT_INDEX_TAGS % "new.id", FACT_INDEX_SOURCE % "new.activity_id"),
+
+    "fact_index_update": """
+        CREATE TRIGGER fact_index_update AFTER UPDATE OF activity_id, description ON facts
+        BEGIN
+            DELETE FROM fact_index WHERE docid = old.id;
+            INSERT INTO fact_index(docid, name, category, description, tag)
+                 SELECT new.id, source.*, new.description, %s
+                   FROM (%s) source;
+        END""" % (FACT_INDEX_TAGS % "new.id", FACT_INDEX_SOURCE % "new.activity_id"),
+
+    "fact_index_delete": """
+        CREATE TRIGGER fact_index_delete AFTER DELETE ON facts
+        BEGIN
+            DELETE FROM fact_index WHERE docid = old.id;
+        END""",
+
+    "fact_index_tag_insert": """
+        CREATE TRIGGER fact_index_tag_insert AFTER INSERT ON fact_tags
+        BEGIN
+            UPDATE fact_index SET tag = %s WHERE docid = new.fact_id;
+        END""" % (FACT_INDEX_TAGS % "new.fact_id"),
+
+    "fact_index_tag_delete": """
+        CREATE TRIGGER fact_index_tag_delete AFTER DELETE ON fact_tags
+        BEGIN
+            UPDATE fact_index SET tag = %s WHERE docid = old.fact_id;
+        END""" % (FACT_INDEX_TAGS % "old.fact_id"),
+
+    "fact_index_tag_rename": """
+        CREATE TRIGGER fact_index_tag_rename AFTER UPDATE OF name ON tags
+        BEGIN
+            UPDATE fact_index SET tag = %s
+             WHERE docid IN (SELECT fact_id FROM fact_tags WHERE tag_id = new.id);
+        END""" % (FACT_INDEX_TAGS % "fact_index.docid"),
+
+    "fact_index_activity_update": """
+        CREATE TRIGGER fact_index_activity_update AFTER UPDATE OF name, category_id ON activities
+        BEGIN
+            UPDATE fact_index
+               SET name = new.name,
+                   category = (SELECT name FROM categories WHERE id = new.category_id)
+             WHERE docid IN (SELECT id FROM facts WHERE activity_id = new.id);
+        END""",
+
+    "fact_index_category_update": """
+        CREATE TRIGGER fact_index_category_update AFTER UPDATE OF name ON categories
+        BEGIN
+            UPDATE fact_index
+               SET category = new.name
+             WHERE docid IN (SELECT a.id
+                               FROM facts a
+                               JOIN activities b ON a.activity_id = b.id
+                              WHERE b.category_id = new.id);
+        END""",
+}
+
+
+# the hamster date of a fact is the day it started on, with days split at the
+# configured day start - unless it runs into the next day and most of it
+# happened there. ongoing facts get their start day and are sorted out on read
+FACT_DATE = """CASE WHEN end_time IS NOT NULL
+                     AND date(end_time, '-{0} minutes') = date(start_time, '-{0} minutes', '+1 day')
+                     AND 2 * strftime('%s', date(end_time, '-{0} minutes'), '+{0} minutes')
+                         <= strftime('%s', start_time) + strftime('%s', end_time)
+                    THEN date(end_time, '-{0} minutes')
+                    ELSE date(start_time, '-{0} minutes') END"""
+FACT_DATE_TRIGGERS = {
+    "fact_date_insert": """
+        CREATE TRIGGER fact_date_insert AFTER INSERT ON facts
+        BEGIN
+            UPDATE facts SET date = {date} WHERE id = new.id;
+        END""",
+
+    "fact_date_update": """
+        CREATE TRIGGER fact_date_update AFTER UPDATE OF start_time, end_time ON facts
+        BEGIN
+            UPDATE facts SET date = {date} WHERE id = new.id;
+        END""",
+}
+
+
+# daily totals per activity and tag, maintained by sqlite on every write.
+# tag_id 0 holds the total of all facts so that sums per activity or category
+# do not count facts with several tags more than once, and tag_id -1 the
+# facts without tags. ongoing facts are left out as their duration grows by
+# the minute
+FACT_TOTALS_FACT = """
+            INSERT OR IGNORE INTO fact_totals(date, activity_id, tag_id, duration, facts)
+                 SELECT {row}.date, {row}.activity_id, tag_id, 0, 0
+                   FROM (SELECT 0 AS tag_id
+                          UNION ALL
+                         SELECT tag_id FROM fact_tags WHERE fact_id = {row}.id
+                          UNION ALL
+                         SELECT -1 WHERE NOT EXISTS (SELECT 1 FROM fact_tags WHERE fact_id = {row}.id))
+                  WHERE {row}.date IS NOT NULL AND {row}.end_time IS NOT NULL;
+            UPDATE fact_totals
+               SET duration = duration {sign} (strftime('%s', {row}.end_time) - strftime('%s', {row}.start_time)),
+                   facts = facts {sign} 1
+             WHERE date = {row}.date AND activity_id = {row}.activity_id
+               AND {row}.end_time IS NOT NULL
+               AND tag_id IN (SELECT 0
+                               UNION ALL
+                              SELECT tag_id FROM fact_tags WHERE fact_id = {row}.id
+                               UNION ALL
+                              SELECT -1 WHERE NOT EXISTS (SELECT 1 FROM fact_tags WHERE fact_id = {row}.id));
+            DELETE FROM fact_totals
+             WHERE date = {row}.date AND activity_id = {row}.activity_id AND facts = 0;"""
+FACT_TOTALS_TAG = """
+            INSERT OR IGNORE INTO fact_totals(date, activity_id, tag_id, duration, facts)
+                 SELECT date, activity_id, {tag}, 0, 0
+                   FROM facts
+                  WHERE id = {row}.fact_id AND date IS NOT NULL AND end_time IS NOT NULL AND {when};
+            UPDATE fact_totals
+               SET duration = duration {sign} (SELECT strftime('%s', end_time) - strftime('%s', start_time)
+                                                 FROM facts WHERE id = {row}.fact_id),
+                   facts = facts {sign} 1
+             WHERE date = (SELECT date FROM facts WHERE id = {row}.fact_id AND end_time IS NOT NULL)
+               AND activity_id = (SELECT activity_id FROM facts WHERE id = {row}.fact_id)
+               AND tag_id = {tag} AND {when};
+            DELETE FROM fact_totals
+             WHERE date = (SELECT date FROM facts WHERE id = {row}.fact_id)
+               AND activity_id = (SELECT activity_id FROM facts WHERE id = {row}.fact_id)
+               AND tag_id = {tag} AND facts = 0;"""
+
+FACT_TOTALS_TRIGGERS = {
+    "fact_totals_insert": """
+        CREATE TRIGGER fact_totals_insert AFTER INSERT ON facts
+        BEGIN %s
+        END""" % FACT_TOTALS_FACT.format(row = "new", sign = "+"),
+
+    "fact_totals_update": """
+        CREATE TRIGGER fact_totals_update AFTER UPDATE OF date, start_time, end_time, activity_id ON facts
+        BEGIN %s %s
+        END""" % (FACT_TOTALS_FACT.format(row = "old", sign = "-"),
+                  FACT_TOTALS_FACT.format(row = "new", sign = "+")),
+
+    "fact_totals_delete": """
+        CREATE TRIGGER fact_totals_delete AFTER DELETE ON facts
+        BEGIN %s
+        END""" % FACT_TOTALS_FACT.format(row = "old", sign = "-"),
+
+    # the first tag takes the fact out of the untagged ones, the last one
+    # removed puts it back
+    "fact_totals_tag_insert": """
+        CREATE TRIGGER fact_totals_tag_insert AFTER INSERT ON fact_tags
+        BEGIN %s %s
+        END""" % (FACT_TOTALS_TAG.format(row = "new", tag = "new.tag_id", sign = "+", when = "1"),
+                  FACT_TOTALS_TAG.format(row = "new", tag = "-1", sign = "-",
+                                         when = "(SELECT count(*) FROM fact_tags WHERE fact_id = new.fact_id) = 1")),
+
+    "fact_totals_tag_delete": """
+        CREATE TRIGGER fact_totals_tag_delete AFTER DELETE ON fact_tags
+        BEGIN %s %s
+        END""" % (FACT_TOTALS_TAG.format(row = "old", tag = "old.tag_id", sign = "-", when = "1"),
+                  FACT_TOTALS_TAG.format(row = "old", tag = "-1", sign = "+",
+                                         when = "NOT EXISTS (SELECT 1 FROM fact_tags WHERE fact_id = old.fact_id)")),
+}
+
+# ids and dates of the facts touched by our own writes, collected on the
+# writer connection only and drained when the change is signalled. ongoing
+# facts may count towards the next day by the time anyone looks
+FACT_CHANGES_ROW = """
+            INSERT INTO fact_changes(id, date) VALUES ({row}.id, {row}.date);
+            INSERT INTO fact_changes(id, date)
+                 SELECT {row}.id, date({row}.date, '+1 day') WHERE {row}.end_time IS NULL;"""
+FACT_CHANGES_TRIGGERS = [
+    """CREATE TEMP TRIGGER fact_changes_insert AFTER INSERT ON main.facts
+       BEGIN %s
+       END""" % FACT_CHANGES_ROW.format(row = "new"),
+    """CREATE TEMP TRIGGER fact_changes_update AFTER UPDATE ON main.facts
+       BEGIN %s %s
+       END""" % (FACT_CHANGES_ROW.format(row = "old"), FACT_CHANGES_ROW.format(row = "new")),
+    """CREATE TEMP TRIGGER fact_changes_delete AFTER DELETE ON main.facts
+       BEGIN %s
+       END""" % FACT_CHANGES_ROW.format(row = "old"),
+]
+
+# the version run_fixtures brings the database up to
+SCHEMA_VERSION = 15
+
+# how many distinct get_facts results to keep around between writes
+QUERY_CACHE_SIZE = 32
+
+# statements taking longer go to the slow query log, with their query plan
+SLOW_QUERY_SECONDS = 0.1
+
+# what get_totals can group by
+TOTALS_GROUPS = {
+    "date": "t.date",
+    "activity": "b.name",
+    "category": "c.name",
+    "tag": "e.name",
+}
+
+
+class FactRecord(object):
+    """Fact as read from the database. Slots keep long ranges cheap on memory,
+    while item access keeps it compatible with the dicts we used to pass
+    around (and dict(record) still works)"""
+    __slots__ = ("id", "start_time", "end_time", "description", "name",
+                 "activity_id", "category", "tags", "exported", "date", "delta")
+
+    def __init__(self, id, start_time, end_time, description, name,
+                 activity_id, category, tags, exported, date = None, delta = None):
+        self.id = id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.description = description
+        self.name = name
+        self.activity_id = activity_id
+        self.category = category
+        self.tags = tags
+        self.exported = exported
+        self.date = date
+        self.delta = delta
+
+    def keys(self):
+        return self.__slots__
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return "<FactRecord %s>" % dict(self)
+
+
+# the connection settings used where there is no configuration to go by,
+# same as the defaults of the configuration
+DEFAULT_PROFILE = dict(journal_mode = "wal",
+                       synchronous = "normal",
+                       mmap_size = 64 * 1024 * 1024,
+                       cache_size = -8 * 1024,
+                       busy_timeout = 5000,
+                       statement_cache = 256)
+
+# what the settings that go into the pragmas as words can be
+PROFILE_KEYWORDS = dict(journal_mode = ("delete", "truncate", "persist", "memory", "wal", "off"),
+                        synchronous = ("off", "normal", "full", "extra"))
+
+def check_profile(profile):
+    """the profile with the keywords checked and the numbers made ints, as
+    they go into the pragmas as they are. bad values are left at the
+    default, with a warning"""
+    checked = dict(DEFAULT_PROFILE)
+    for key, default in DEFAULT_PROFILE.items():
+        value = profile.get(key)
+        if value is None:
+            continue
+        try:
+            if key in PROFILE_KEYWORDS:
+                if str(value).lower() not in PROFILE_KEYWORDS[key]:
+                    raise ValueError(value)
+                value = str(value).lower()
+            else:
+                value = int(value)
+        except (TypeError, ValueError):
+            logging.warn("bad %s setting %r, using %r" % (key, value, default))
+            continue
+        checked[key] = value
+    return checked
+
+def connection_profile():
+    """sqlite tuning applied to every new connection, as configured"""
+    from configuration import conf # pulls in gconf, so only when asked for
+    return dict(journal_mode = conf.get("db_journal_mode"),
+                synchronous = conf.get("db_synchronous"),
+                mmap_size = conf.get("db_mmap_size"),
+                cache_size = conf.get("db_cache_size"),
+                busy_timeout = conf.get("db_busy_timeout"),
+                statement_cache = conf.get("db_statement_cache"))
+
+
 class Storage(storage.Storage):
     con = None # Connection will be created on demand
-    external = None
-    external_need_update = False
 
-    def __init__(self, unsorted_localized="Unsorted", database_dir=None):
+    def __init__(self, unsorted_localized="Unsorted", database_dir=None, profile=None,
+                 read_only=False, day_start=None):
         """
         XXX - you have to pass in name for the uncategorized category
         Delayed setup so we don't do everything at the same time
+        profile holds the connection settings, see DEFAULT_PROFILE for the
+        keys. they are read from the configuration when not given, and the
+        missing or bad ones fall back to the defaults
+        read_only opens an existing database for queries only, next to the
+        running service - without file monitors and without upgrading it
+        day_start, in minutes, fixes the start of the day instead of
+        following the configuration. a read-only storage goes by the one
+        the database was last written with
         """
         storage.Storage.__init__(self)
 
@@ -68,22 +393,46 @@ class Storage(storage.Storage):
 
         self.__con = None
         self.__cur = None
-        self.__last_etag = None
-
-
+        self.__local = threading.local() # read-only connections of reader threads
+        self.__schema_ready = False # until the fixtures have run
+
+        # get_facts results, valid for as long as the generation stays the
+        # same. the generation moves on with every write
+        self.__generation = 0
+        self.__query_cache = OrderedDict()
+        self.__query_cache_lock = threading.Lock()
+        self.__query_cache_hits, self.__query_cache_misses = 0, 0
+        self.__data_version = None
+        self.__dates_day_start = None # day start the fact dates are computed for
+        self.__day_start = day_start
+        self.__external_generation = 0 # moves on when trackers are to reconnect
+        self.metrics = metrics.Metrics()
+
+        if profile is None:
+            profile = connection_profile()
+        self.profile = check_profile(profile)
+
+        check_sqlite_version()
+
+        self.read_only = read_only
         self.db_path = self.__init_db_file(database_dir)
 
+        if read_only:
+            self.__open_read_only()
+            return
+
         if gio:
             # add file monitoring so the app does not have to be restarted
             # when db file is rewritten
             def on_db_file_change(monitor, gio_file, event_uri, event):
                 if event == gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT:
-                    if gio_file.query_info(gio.FILE_ATTRIBUTE_ETAG_VALUE).get_etag() == self.__last_etag:
-                        # ours
+                    if not self.is_modified_externally():
+                        # ours, or just a checkpoint
                         return
                 elif event == gio.FILE_MONITOR_EVENT_CREATED:
                     # treat case when instead of a move, a remove and create has been performed
                     self.con = None
+                    self.__bump_generation()
 
                 if event in (gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT, gio.FILE_MONITOR_EVENT_CREATED):
                     print "DB file has been modified externally. Calling all stations"
@@ -94,14 +443,15 @@ class Storage(storage.Storage):
                         trophies.unlock("plan_b")
 
 
-            self.__database_file = gio.File(self.db_path)
-            self.__db_monitor = self.__database_file.monitor_file()
-            self.__db_monitor.connect("changed", on_db_file_change)
+            # in WAL mode other writers touch only the log until a checkpoint
+            self.__db_monitors = []
+            for path in (self.db_path, self.db_path + "-wal"):
+                monitor = gio.File(path).monitor_file()
+                monitor.connect("changed", on_db_file_change)
+                self.__db_monitors.append(monitor)
 
         self.run_fixtures()
 
-        self.external = ActivitiesSource(conf)
-
     def __init_db_file(self, database_dir):
         if not database_dir:
             try:
@@ -111,6 +461,12 @@ class Storage(storage.Storage):
                 print "Could not import xdg - will store hamster.db in home folder"
                 database_dir = os.path.realpath(os.path.expanduser("~"))
 
+        if self.read_only:
+            db_path = os.path.join(database_dir, "hamster.db")
+            if not os.path.exists(db_path):
+                raise IOError("no database at %s" % db_path)
+            return db_path
+
         if not os.path.exists(database_dir):
             os.makedirs(database_dir, 0744)
 
@@ -151,11 +507,16 @@ class Storage(storage.Storage):
         return db_path
 
 
-    def register_modification(self):
-        if gio:
-            # db.execute calls this so we know that we were the ones
-            # that modified the DB and no extra refesh is not needed
-            self.__last_etag = self.__database_file.query_info(gio.FILE_ATTRIBUTE_ETAG_VALUE).get_etag()
+    def is_modified_externally(self):
+        """sqlite bumps data_version only for commits made by other
+        connections, so our own writes go unnoticed here without any
+        bookkeeping on each statement"""
+        data_version = self.fetchone("PRAGMA data_version")[0]
+        modified = data_version != self.__data_version
+        self.__data_version = data_version
+        if modified:
+            self.__bump_generation()
+        return modified
 
     #tags, here we come!
     def __get_tags(self, only_autocomplete = False):
@@ -233,10 +594,6 @@ class Storage(storage.Storage):
         """
         self.execute(query, (name, name.lower(), category_id, id))
 
-        affected_ids = [res[0] for res in self.fetchall("select id from facts where activity_id = ?", (id,))]
-        self.__remove_index(affected_ids)
-
-
     def __change_category(self, id, category_id):
         # first check if we don't have an activity with same name before us
         activity = self.fetchone("select name from activities where id = ?", (id, ))
@@ -267,11 +624,6 @@ class Storage(storage.Storage):
 
             self.execute(statement, (category_id, id))
 
-        affected_ids = [res[0] for res in self.fetchall("select id from facts where activity_id = ?", (id,))]
-        if existing_activity:
-            affected_ids.extend([res[0] for res in self.fetchall("select id from facts where activity_id = ?", (existing_activity['id'],))])
-        self.__remove_index(affected_ids)
-
         return True
 
     def __add_category(self, name):
@@ -291,14 +643,6 @@ class Storage(storage.Storage):
             """
             self.execute(update, (name, name.lower(), id))
 
-        affected_query = """
-            SELECT id
-              FROM facts
-             WHERE activity_id in (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-        self.__remove_index(affected_ids)
-
 
     def __get_activity_by_name(self, name, category_id = None, resurrect = True):
         """get most recent, preferably not deleted activity by it's name"""
@@ -369,40 +713,28 @@ class Storage(storage.Storage):
                           a.end_time AS end_time,
                           a.description as description,
                           b.name AS name, b.id as activity_id,
-                          coalesce(c.name, ?) as category, coalesce(c.id, -1) as category_id,
-                          e.name as tag,
+                          coalesce(c.name, ?) as category,
+                          %s as tags,
                           a.exported AS exported
                      FROM facts a
                 LEFT JOIN activities b ON a.activity_id = b.id
                 LEFT JOIN categories c ON b.category_id = c.id
-                LEFT JOIN fact_tags d ON d.fact_id = a.id
-                LEFT JOIN tags e ON e.id = d.tag_id
                     WHERE a.id = ?
-                 ORDER BY e.name
-        """
-
-        return self.__group_tags(self.fetchall(query, (self._unsorted_localized, id)))[0]
-
-    def __group_tags(self, facts):
-        """put the fact back together and move all the unique tags to an array"""
-        if not facts: return facts  #be it None or whatever
-
-        grouped_facts = []
-        for fact_id, fact_tags in itertools.groupby(facts, lambda f: f["id"]):
-            fact_tags = list(fact_tags)
-
-            # first one is as good as the last one
-            grouped_fact = fact_tags[0]
+        """ % TAGS_SUBQUERY
 
-            # we need dict so we can modify it (sqlite.Row is read only)
-            # in python 2.5, sqlite does not have keys() yet, so we hardcode them (yay!)
-            keys = ["id", "start_time", "end_time", "description", "name",
-                    "activity_id", "category", "tag", "exported"]
-            grouped_fact = dict([(key, grouped_fact[key]) for key in keys])
+        facts = self.__to_fact_records(self.fetchall(query, (self._unsorted_localized, TAG_SEPARATOR, id)))
+        return facts[0] if facts else None
 
-            grouped_fact["tags"] = [ft["tag"] for ft in fact_tags if ft["tag"]]
-            grouped_facts.append(grouped_fact)
-        return grouped_facts
+    def __to_fact_records(self, rows):
+        """turn the one-row-per-fact results into fact records, splitting the
+        concatenated tag names back into a list"""
+        return [FactRecord(row["id"], row["start_time"], row["end_time"],
+                           row["description"], row["name"], row["activity_id"],
+                           row["category"],
+                           row["tags"].split(TAG_SEPARATOR) if row["tags"] else [],
+                           row["exported"],
+                           row["date"] if "date" in row.keys() else None)
+                for row in rows]
 
 
     def __touch_fact(self, fact, end_time = None):
@@ -430,14 +762,20 @@ class Storage(storage.Storage):
         # we are checking if our start time is in the middle of anything
         # or maybe there is something after us - so we know to adjust end time
         # in the latter case go only few hours ahead. everything else is madness, heh
+        # each branch of the union is a range seek on one of the time indexes
         query = """
                    SELECT a.*, b.name
                      FROM facts a
                 LEFT JOIN activities b on b.id = a.activity_id
-                    WHERE ((start_time < ? and end_time > ?)
-                           OR (start_time > ? and start_time < ? and end_time is null)
-                           OR (start_time > ? and start_time < ?))
-                 ORDER BY start_time
+                    WHERE a.id in (SELECT id FROM facts
+                                    WHERE end_time > ? and start_time < ?
+                                    UNION
+                                   SELECT id FROM facts
+                                    WHERE start_time > ? and start_time < ? and end_time is null
+                                    UNION
+                                   SELECT id FROM facts
+                                    WHERE start_time > ? and start_time < ?)
+                 ORDER BY a.start_time
                     LIMIT 1
                 """
         fact = self.fetchone(query, (start_time, start_time,
@@ -463,78 +801,96 @@ class Storage(storage.Storage):
         if end_time is None or start_time is None:
             return
 
-        start_time = self.__round_seconds(start_time)
-        end_time = self.__round_seconds(end_time)
+        self.__make_room([(self.__round_seconds(start_time),
+                           self.__round_seconds(end_time))])
 
-        # possible combinations and the OR clauses that catch them
-        # (the side of the number marks if it catches the end or start time)
-        #             |----------------- NEW -----------------|
-        #      |--- old --- 1|   |2 --- old --- 1|   |2 --- old ---|
-        # |3 -----------------------  big old   ------------------------ 3|
+    def __make_room(self, spans):
+        """cuts the existing facts to make room for the new ones, given as
+        (start_time, end_time) pairs, in one sweep. facts that are covered
+        completely are removed. the new ones are resolved among themselves
+        too, the later one wins. returns {index: pieces} for the new ones
+        that have to change"""
         query = """
-                   SELECT a.*, b.name, c.name as category
-                     FROM facts a
-                LEFT JOIN activities b on b.id = a.activity_id
-                LEFT JOIN categories c on b.category_id = c.id
-                    WHERE (end_time >= ? and end_time <= ?)
-                       OR (start_time >= ? and start_time <= ?)
-                       OR (start_time <= ? and end_time >= ?)
-                 ORDER BY start_time
-                """
-        conflicts = self.fetchall(query, (start_time, end_time,
-                                          start_time, end_time,
-                                          start_time, end_time))
-
-        for fact in conflicts:
-            if fact["start_time"] is None:
-                continue
-
-            # handle case with not finished activities
-            fact_end_time = fact["end_time"] or dt.datetime.now()
-
-            # won't eliminate as it is better to have overlapping entries than loosing data
-            if start_time < fact["start_time"] and end_time >= fact_end_time:
-                continue
-
-            # split - truncate until beginning of new entry and create new activity for end
-            if fact["start_time"] < start_time < fact_end_time and \
-               fact["start_time"] < end_time <= fact_end_time:
-
-                logging.info("splitting %s" % fact["name"])
-                # truncate until beginning of the new entry
-                self.execute("""UPDATE facts
-                                   SET end_time = ?
-                                 WHERE id = ?""", (start_time, fact["id"]))
-                fact_name = fact["name"]
-
-                if end_time < fact['end_time']:
-                    # create new fact for the end
-                    new_fact = Fact(fact["name"],
-                                    category = fact["category"],
-                                    description = fact["description"])
-                    new_fact_id = self.__add_fact(new_fact.serialized_name(), end_time, fact_end_time)
-
-                    # copy tags
-                    tag_update = """INSERT INTO fact_tags(fact_id, tag_id)
-                                         SELECT ?, tag_id
-                                           FROM fact_tags
-                                          WHERE fact_id = ?"""
-                    self.execute(tag_update, (new_fact_id, fact["id"])) #clone tags
-
-                if trophies:
-                    trophies.unlock("split")
+                   SELECT id, start_time, end_time
+                     FROM facts
+                    WHERE id in (SELECT id FROM facts
+                                  WHERE end_time >= ? AND start_time <= ?
+                                  UNION ALL
+                                 SELECT id FROM facts
+                                  WHERE end_time IS NULL AND start_time <= ?)
+        """
+        span_start = min(start_time for start_time, end_time in spans)
+        span_end = max(end_time for start_time, end_time in spans)
+        intervals = [(other["id"], other["start_time"], other["end_time"], 0)
+                     for other in self.fetchall(query, (span_start, span_end, span_end))
+                     if other["start_time"]]
+        # new facts are keyed by negative numbers to keep apart from ids,
+        # growing with the index so that of two starting together the one
+        # that comes later wins, as it would when added after the other
+        count = len(spans)
+        intervals.extend((i - count, start_time, end_time, 1)
+                         for i, (start_time, end_time) in enumerate(spans))
+
+        changes = overlaps.resolve(intervals, settled = (0,))
+        cuts = dict((key, pieces) for key, pieces in changes.items() if key > 0)
+        if trophies and any(len(pieces) > 1 for pieces in cuts.values()):
+            trophies.unlock("split")
+        self.__cut_facts(cuts)
+
+        return dict((key + count, pieces) for key, pieces in changes.items() if key < 0)
+
+    def __follow_previous(self, start_time, activity_id, tag_names, description):
+        """what starting a fact at start_time does to the ongoing one of
+        today - it is stopped, or removed if too short to count. returns
+        (True, id) when the new fact is not to be added after all: id is
+        None when it is the ongoing one already, and the id of the fact
+        resumed instead otherwise"""
+        # pull in previous facts
+        facts = self.__get_todays_facts()
+
+        previous = None
+        if facts and facts[-1]["end_time"] == None:
+            previous = facts[-1]
+
+        if previous and previous['start_time'] <= start_time:
+            # check if maybe that is the same one, in that case no need to restart
+            if previous["activity_id"] == activity_id \
+               and set(previous["tags"]) == set(tag_names) \
+               and (previous["description"] or "") == (description or ""):
+                return True, None
+
+            # if no description is added
+            # see if maybe previous was too short to qualify as an activity
+            if not previous["description"] \
+               and 60 >= (start_time - previous['start_time']).seconds >= 0:
+                self.__remove_fact(previous['id'])
+
+                # now that we removed the previous one, see if maybe the one
+                # before that is actually same as the one we want to start
+                # (glueing)
+                if len(facts) > 1 and 60 >= (start_time - facts[-2]['end_time']).seconds >= 0:
+                    before = facts[-2]
+                    if before["activity_id"] == activity_id \
+                       and set(before["tags"]) == set(tag_names):
+                        # resume and return
+                        update = """
+                                   UPDATE facts
+                                      SET end_time = null
+                                    WHERE id = ?
+                        """
+                        self.execute(update, (before["id"],))
 
-            # overlap start
-            elif start_time <= fact["start_time"] <= end_time:
-                logging.info("Overlapping start of %s" % fact["name"])
-                self.execute("UPDATE facts SET start_time=? WHERE id=?",
-                             (end_time, fact["id"]))
+                        return True, before["id"]
+            else:
+                # otherwise stop
+                update = """
+                           UPDATE facts
+                              SET end_time = ?
+                            WHERE id = ?
+                """
+                self.execute(update, (start_time, previous["id"]))
 
-            # overlap end
-            elif start_time < fact_end_time <= end_time:
-                logging.info("Overlapping end of %s" % fact["name"])
-                self.execute("UPDATE facts SET end_time=? WHERE id=?",
-                             (start_time, fact["id"]))
+        return False, None
 
     def __add_fact(self, serialized_fact, start_time, end_time = None, temporary = False, exported = False):
         fact = Fact(serialized_fact,
@@ -577,50 +933,11 @@ class Storage(storage.Storage):
 
         # if we are working on +/- current day - check the last_activity
         if (dt.timedelta(days=-1) <= dt.datetime.now() - start_time <= dt.timedelta(days=1)):
-            # pull in previous facts
-            facts = self.__get_todays_facts()
-
-            previous = None
-            if facts and facts[-1]["end_time"] == None:
-                previous = facts[-1]
-
-            if previous and previous['start_time'] <= start_time:
-                # check if maybe that is the same one, in that case no need to restart
-                if previous["activity_id"] == activity_id \
-                   and set(previous["tags"]) == set([tag[1] for tag in tags]) \
-                   and (previous["description"] or "") == (fact.description or ""):
-                    return None
-
-                # if no description is added
-                # see if maybe previous was too short to qualify as an activity
-                if not previous["description"] \
-                   and 60 >= (start_time - previous['start_time']).seconds >= 0:
-                    self.__remove_fact(previous['id'])
-
-                    # now that we removed the previous one, see if maybe the one
-                    # before that is actually same as the one we want to start
-                    # (glueing)
-                    if len(facts) > 1 and 60 >= (start_time - facts[-2]['end_time']).seconds >= 0:
-                        before = facts[-2]
-                        if before["activity_id"] == activity_id \
-                           and set(before["tags"]) == set([tag[1] for tag in tags]):
-                            # resume and return
-                            update = """
-                                       UPDATE facts
-                                          SET end_time = null
-                                        WHERE id = ?
-                            """
-                            self.execute(update, (before["id"],))
-
-                            return before["id"]
-                else:
-                    # otherwise stop
-                    update = """
-                               UPDATE facts
-                                  SET end_time = ?
-                                WHERE id = ?
-                    """
-                    self.execute(update, (start_time, previous["id"]))
+            done, fact_id = self.__follow_previous(start_time, activity_id,
+                                                   [tag[1] for tag in tags],
+                                                   fact.description)
+            if done:
+                return fact_id
 
 
         # done with the current activity, now we can solve overlaps
@@ -644,36 +961,348 @@ class Storage(storage.Storage):
         params = [(fact_id, tag[0]) for tag in tags]
         self.execute(insert, params)
 
-        self.__remove_index([fact_id])
         return fact_id
 
+    def __add_facts(self, facts):
+        """bulk insert. expects to be run within a transaction.
+        names are looked up once per distinct value and overlaps are
+        resolved once over the whole batch - within the batch the later
+        fact wins, and the existing facts make room for the batch, same as
+        when added one by one with add_fact.
+        returns ids of the new facts in chronological order and whether any
+        new activities and tags were created"""
+        batch = []
+        for fact in facts:
+            start_time = self.__round_seconds(fact.start_time)
+            end_time = self.__round_seconds(fact.end_time)
+            if fact.activity and start_time:
+                batch.append([fact, start_time, end_time])
+
+        if not batch:
+            return [], False, False
+
+        batch.sort(key = lambda item: item[1])
+
+        # tags, in chunks to stay within the sqlite variable limit
+        tag_names = list(set(tag for fact, start, end in batch for tag in fact.tags))
+        tag_ids, tags_changed = {}, False
+        for i in range(0, len(tag_names), 500):
+            tags, changes = self.__get_tag_ids(tag_names[i:i + 500])
+            tag_ids.update((tag["name"], tag["id"]) for tag in tags)
+            tags_changed = tags_changed or changes
+
+        # categories and activities
+        activities_changed = False
+        category_ids = {}
+        for name in set(fact.category for fact, start, end in batch if fact.category):
+            category_ids[name] = self.__get_category_id(name)
+            if not category_ids[name]:
+                category_ids[name] = self.__add_category(name)
+                activities_changed = True
+
+        activity_ids = {}
+        for key in set((fact.activity, fact.category) for fact, start, end in batch):
+            name, category_id = key[0], category_ids.get(key[1])
+            activity = self.__get_activity_by_name(name, category_id)
+            if activity:
+                activity_ids[key] = activity['id']
+            else:
+                activity_ids[key] = self.__add_activity(name, category_id)
+                activities_changed = True
+
+        # an ongoing fact can stay ongoing only if it is the last one
+        for i, item in enumerate(batch[:-1]):
+            if item[2] is None:
+                item[2] = batch[i + 1][1]
+        batch = [item for item in batch if item[2] is None or item[2] > item[1]]
+
+        # the ongoing fact of today is stopped, removed or resumed as by
+        # add_fact, one batch fact after the other
+        ids, kept = [], []
+        now = dt.datetime.now()
+        for item in batch:
+            fact, start_time, end_time = item
+            if dt.timedelta(days=-1) <= now - start_time <= dt.timedelta(days=1):
+                done, fact_id = self.__follow_previous(start_time,
+                                                       activity_ids[(fact.activity, fact.category)],
+                                                       fact.tags, fact.description)
+                if done:
+                    if fact_id:
+                        ids.append(fact_id)
+                    continue
+            kept.append(item)
+        batch = kept
+
+        # resolve overlaps within the batch and against the existing facts
+        # in one sweep. the batch wins, and the existing facts are not
+        # reconciled among themselves - that is what repair_overlaps is for
+        closed = [item for item in batch if item[2] is not None]
+        pieces = {}
+        if closed:
+            pieces = self.__make_room([(start_time, end_time)
+                                       for fact, start_time, end_time in closed])
+
+        # finally insert
+        insert = """
+                    INSERT INTO facts (activity_id, start_time, end_time, description, exported)
+                               VALUES (?, ?, ?, ?, ?)
+        """
+        rows = []
+        for i, (fact, start_time, end_time) in enumerate(closed):
+            for start_time, end_time in pieces.get(i, [(start_time, end_time)]):
+                rows.append((start_time, end_time, fact))
+        rows.extend((start_time, end_time, fact)
+                    for fact, start_time, end_time in batch if end_time is None)
+        rows.sort(key = lambda row: row[0])
+
+        fact_tags = []
+        for start_time, end_time, fact in rows:
+            if end_time is None:
+                end_time = self.__squeeze_in(start_time)
+            self.execute(insert, (activity_ids[(fact.activity, fact.category)],
+                                  start_time, end_time, fact.description, fact.exported))
+            fact_id = self.__last_insert_rowid()
+            ids.append(fact_id)
+            fact_tags.extend((fact_id, tag_ids[tag]) for tag in set(fact.tags))
+
+        self.executemany("insert into fact_tags(fact_id, tag_id) values(?, ?)", fact_tags)
+
+        return ids, activities_changed, tags_changed
+
+    def __cut_facts(self, changes):
+        """applies what overlaps.resolve came up with. the first piece stays
+        with the fact, the rest become copies of it. facts with no pieces
+        left are removed"""
+        for fact_id, pieces in changes.items():
+            if not pieces:
+                self.__remove_fact(fact_id)
+                continue
+
+            start_time, end_time = pieces[0]
+            self.execute("UPDATE facts SET start_time = ?, end_time = ? WHERE id = ?",
+                         (start_time, end_time, fact_id))
+
+            for start_time, end_time in pieces[1:]:
+                self.execute("""INSERT INTO facts (activity_id, start_time, end_time, description, exported)
+                                     SELECT activity_id, ?, ?, description, exported
+                                       FROM facts
+                                      WHERE id = ?""", (start_time, end_time, fact_id))
+                self.execute("""INSERT INTO fact_tags (fact_id, tag_id)
+                                     SELECT ?, tag_id
+                                       FROM fact_tags
+                                      WHERE fact_id = ?""", (self.__last_insert_rowid(), fact_id))
+
+    def __repair_overlaps(self, start_time = None, end_time = None):
+        """resolves overlaps among all facts that touch the given span, or
+        the whole database, in one go. returns number of facts changed"""
+        query = """
+                   SELECT id, start_time, end_time
+                     FROM facts
+                    WHERE id in (SELECT id FROM facts
+                                  WHERE end_time >= ? AND start_time <= ?
+                                  UNION ALL
+                                 SELECT id FROM facts
+                                  WHERE end_time IS NULL AND start_time <= ?)
+        """
+        start_time = start_time or dt.datetime.min
+        end_time = end_time or dt.datetime.max
+        facts = self.fetchall(query, (start_time, end_time, end_time))
+
+        changes = overlaps.resolve([(fact["id"], fact["start_time"], fact["end_time"], 0)
+                                    for fact in facts if fact["start_time"]])
+        self.__cut_facts(changes)
+        return len(changes)
+
+    def __pop_fact_changes(self):
+        """returns ids of the facts changed since the last call, along with
+        the first and the last date affected"""
+        ids = [row["id"] for row in self.fetchall("SELECT DISTINCT id FROM fact_changes")]
+        dates = self.fetchone("""SELECT min(date) AS "min_date [date]",
+                                        max(date) AS "max_date [date]"
+                                   FROM fact_changes""")
+        if ids:
+            self.execute("DELETE FROM fact_changes")
+        return ids, dates["min_date"], dates["max_date"]
+
     def __last_insert_rowid(self):
         return self.fetchone("SELECT last_insert_rowid();")[0]
 
 
-    def __get_todays_facts(self):
+    def __day_start_minutes(self):
+        if self.__day_start is not None:
+            return self.__day_start
         try:
-            day_start = conf.get("day_start_minutes")
+            from configuration import conf
+            return conf.get("day_start_minutes")
         except:
-            day_start = 5 * 60 # default day start to 5am
-        day_start = dt.time(day_start / 60, day_start % 60)
-        today = (dt.datetime.now() - dt.timedelta(hours = day_start.hour,
-                                                  minutes = day_start.minute)).date()
+            return 5 * 60 # default day start to 5am
+
+    def __build_dates(self, day_start):
+        """(re)create the triggers that keep the hamster date of facts current
+        for the given day start in minutes, and recompute it for all facts"""
+        fact_date = FACT_DATE.format(day_start)
+        for name, trigger in FACT_DATE_TRIGGERS.items():
+            self.execute("DROP TRIGGER IF EXISTS %s" % name)
+            self.execute(trigger.format(date = fact_date))
+
+        self.execute("UPDATE facts SET date = %s" % fact_date)
+        self.execute("UPDATE version SET day_start_minutes = ?", (day_start,))
+        self.__dates_day_start = day_start
+
+    def __check_dates(self):
+        """recomputes fact dates if the day start has been changed since.
+        returns the day start in minutes"""
+        if self.read_only or getattr(self.__local, "con", None):
+            # readers can not write, and the writer keeps the dates current
+            return self.__dates_day_start
+
+        day_start = self.__day_start_minutes()
+        if day_start != self.__dates_day_start:
+            logging.info("day start changed to %d minutes, recomputing dates" % day_start)
+            in_transaction = self.in_transaction()
+            if not in_transaction:
+                self.start_transaction()
+            self.__drop_totals() # cheaper to rebuild than to follow each row
+            self.__build_dates(day_start)
+            self.__build_totals()
+
+            # the dates of all the facts may have moved - rather than a
+            # detailed signal with every fact in the log, a plain one has
+            # everything read again
+            self.__pop_fact_changes()
+            self.__changed("facts")
+            if not in_transaction:
+                self.end_transaction()
+        return day_start
+
+    def __fact_date(self, start_time, end_time, split_time):
+        """python side of FACT_DATE, for the ongoing facts"""
+        fact_start_date = start_time.date() \
+            - dt.timedelta(1 if start_time.time() < split_time else 0)
+        fact_end_date = end_time.date() \
+            - dt.timedelta(1 if end_time.time() < split_time else 0)
+        fact_date_span = fact_end_date - fact_start_date
+
+        # check if the task spans across two dates
+        if fact_date_span.days == 1:
+            datetime_split = dt.datetime.combine(fact_end_date, split_time)
+            start_date_duration = datetime_split - start_time
+            end_date_duration = end_time - datetime_split
+            if start_date_duration > end_date_duration:
+                # most of the task was done during the previous day
+                return fact_start_date
+            else:
+                return fact_end_date
+
+        # either doesn't span or more than 24 hrs tracked
+        # (in which case we give up)
+        return fact_start_date
+
+
+    def __bump_generation(self):
+        with self.__query_cache_lock:
+            self.__generation += 1
+            self.__query_cache.clear()
+
+    def __cached_fetchall(self, key, query, params):
+        """fetchall for results that are good until the next write"""
+        if self.read_only:
+            # the writes all come from elsewhere
+            self.is_modified_externally()
+        with self.__query_cache_lock:
+            generation = self.__generation
+            if key in self.__query_cache:
+                self.__query_cache_hits += 1
+                return self.__query_cache[key]
+            self.__query_cache_misses += 1
+
+        rows = self.fetchall(query, params)
+
+        with self.__query_cache_lock:
+            # a write could have happened while we were reading
+            if generation == self.__generation:
+                self.__query_cache[key] = rows
+                if len(self.__query_cache) > QUERY_CACHE_SIZE:
+                    self.__query_cache.popitem(last = False)
+        return rows
+
+    def query_cache_stats(self):
+        """hits and misses of the get_facts result cache"""
+        with self.__query_cache_lock:
+            return {"hits": self.__query_cache_hits,
+                    "misses": self.__query_cache_misses,
+                    "entries": len(self.__query_cache),
+                    "generation": self.__generation}
+
+    def __get_ongoing(self, date, end_date, split_time):
+        """ongoing facts can move on to the next day as the time passes, so
+        their date is decided here. there is hardly ever more than one.
+        returns {fact_id: (date, end_time)} for those within the dates"""
+        now = dt.datetime.now().replace(microsecond = 0)
+        ongoing = {}
+        query = """
+                   SELECT id, start_time
+                     FROM facts
+                    WHERE end_time IS NULL AND date BETWEEN ? AND ?
+        """
+        facts = self.fetchall(query, (date - dt.timedelta(days = 1), end_date))
+        with self.metrics.timed("python:ongoing"):
+            for fact in facts:
+                # if fact has no end time, set the current time if fact has
+                # happened in last 24 hours, otherwise it ends where it started
+                if (dt.date.today() - fact["start_time"].date()) <= dt.timedelta(days=1):
+                    fact_end_time = now
+                else:
+                    fact_end_time = fact["start_time"]
+
+                fact_date = self.__fact_date(fact["start_time"], fact_end_time, split_time)
+                if date <= fact_date <= end_date:
+                    ongoing[fact["id"]] = (fact_date, fact_end_time)
+        return ongoing
+
+
+    def __get_todays_facts(self):
+        day_start = self.__check_dates()
+        today = (dt.datetime.now() - dt.timedelta(minutes = day_start)).date()
         return self.__get_facts(today)
 
 
-    def __get_facts(self, date, end_date = None, search_terms = "", limit = 0, asc_by_date = True):
-        try:
-            day_start = conf.get("day_start_minutes")
-        except:
-            day_start = 5 * 60 # default day start to 5am
-        day_start = dt.time(day_start / 60, day_start % 60)
+    def __search_conditions(self, search_terms, fact_id):
+        """sql conditions on the fact_id column for the search terms"""
+        if not search_terms:
+            return []
+
+        search_terms = search_terms.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace("'", "''")
+
+        # Split by NOT, but only once
+        search_terms = search_terms.split('NOT', 1)
+
+        conditions = []
+        if search_terms[0] and search_terms[0].strip():
+            conditions.append("""%s in (SELECT docid
+                                         FROM fact_index
+                                        WHERE fact_index MATCH '%s')""" % (fact_id, search_terms[0].strip()))
 
-        split_time = day_start
-        datetime_from = dt.datetime.combine(date, split_time)
+        if len(search_terms)>1 and search_terms[1].strip():
+            conditions.append("""%s NOT in (SELECT docid
+                                             FROM fact_index
+                                            WHERE fact_index MATCH '%s')""" % (fact_id, search_terms[1].strip()))
+        return conditions
+
+    def __get_facts(self, date, end_date = None, search_terms = "", limit = 0, asc_by_date = True):
+        """facts of the hamster dates from date to end_date. long ranges are
+        read a window of days at a time - see storage.date_windows"""
+        day_start = self.__check_dates()
+        split_time = dt.time(day_start / 60, day_start % 60)
 
         end_date = end_date or date
-        datetime_to = dt.datetime.combine(end_date, split_time) + dt.timedelta(days = 1)
+
+        ongoing = self.__get_ongoing(date, end_date, split_time)
+        ongoing_ids = ""
+        if ongoing:
+            ongoing_ids = """UNION ALL
+                             SELECT id FROM facts
+                              WHERE id IN (%s)""" % ",".join(str(int(id)) for id in ongoing)
 
         query = """
                    SELECT a.id AS id,
@@ -682,100 +1311,263 @@ class Storage(storage.Storage):
                           a.description as description,
                           b.name AS name, b.id as activity_id,
                           coalesce(c.name, ?) as category,
-                          e.name as tag,
-                          a.exported AS exported
+                          %s as tags,
+                          a.exported AS exported,
+                          a.date AS date
                      FROM facts a
                 LEFT JOIN activities b ON a.activity_id = b.id
                 LEFT JOIN categories c ON b.category_id = c.id
-                LEFT JOIN fact_tags d ON d.fact_id = a.id
-                LEFT JOIN tags e ON e.id = d.tag_id
-                    WHERE (a.end_time >= ? OR a.end_time IS NULL) AND a.start_time <= ?
-        """
-
-        if search_terms:
-            # check if we need changes to the index
-            self.__check_index(datetime_from, datetime_to)
-
-            search_terms = search_terms.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace("'", "''")
-
-            # Split by NOT, but only once
-            search_terms = search_terms.split('NOT', 1)
+                    WHERE a.id in (SELECT id FROM facts
+                                    WHERE date BETWEEN ? AND ? AND end_time IS NOT NULL
+                                   %s)
+        """ % (TAGS_SUBQUERY, ongoing_ids)
+        params = [self._unsorted_localized, TAG_SEPARATOR, date, end_date]
 
-            if search_terms[0] and search_terms[0].strip():
-                query += """ AND a.id in (SELECT id
-                                        FROM fact_index
-                                       WHERE fact_index MATCH '%s')""" % search_terms[0].strip()
+        # the records are handed out to be changed, so it is the rows we keep
+        key = (date, end_date, search_terms, limit, asc_by_date, tuple(sorted(ongoing)))
 
-            if len(search_terms)>1 and search_terms[1].strip():
-                query += """ AND a.id NOT in (SELECT id
-                                        FROM fact_index
-                                       WHERE fact_index MATCH '%s')""" % search_terms[1].strip()
+        for condition in self.__search_conditions(search_terms, "a.id"):
+            query += " AND " + condition
 
         if asc_by_date:
-            query += " ORDER BY a.start_time, e.name"
+            query += " ORDER BY a.start_time, a.id"
         else:
-            query += " ORDER BY a.start_time desc, e.name"
+            query += " ORDER BY a.start_time desc, a.id desc"
         if limit and limit > 0:
             query += " LIMIT " + str(limit)
 
-        facts = self.fetchall(query, (self._unsorted_localized,
-                                      datetime_from,
-                                      datetime_to))
+        facts = self.__cached_fetchall(key, query, params)
+        with self.metrics.timed("python:fact_records"):
+            facts = self.__to_fact_records(facts)
 
-        #first let's put all tags in an array
-        facts = self.__group_tags(facts)
+            for fact in facts:
+                if fact["id"] in ongoing:
+                    fact["date"], fact_end_time = ongoing[fact["id"]]
+                else:
+                    fact_end_time = fact["end_time"]
+                fact["delta"] = fact_end_time - fact["start_time"]
+
+        return facts
+
+    def __drop_totals(self):
+        for trigger in FACT_TOTALS_TRIGGERS:
+            self.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+        self.execute("DROP TABLE IF EXISTS fact_totals")
+
+    def __build_totals(self):
+        """(re)create the daily totals along with the triggers that keep
+        them up to date, and fill them from all the facts we have"""
+        self.__drop_totals()
+
+        self.execute("""CREATE TABLE fact_totals (date date,
+                                                  activity_id integer,
+                                                  tag_id integer,
+                                                  duration integer,
+                                                  facts integer,
+                                                  PRIMARY KEY (date, activity_id, tag_id))""")
+        for trigger in FACT_TOTALS_TRIGGERS.values():
+            self.execute(trigger)
+
+        query = """
+                   INSERT INTO fact_totals(date, activity_id, tag_id, duration, facts)
+                        SELECT a.date, a.activity_id, d.tag_id,
+                               sum(strftime('%s', a.end_time) - strftime('%s', a.start_time)),
+                               count(*)
+                          FROM facts a
+                          JOIN (SELECT id AS fact_id, 0 AS tag_id FROM facts
+                                 UNION ALL
+                                SELECT fact_id, tag_id FROM fact_tags
+                                 UNION ALL
+                                SELECT id, -1 FROM facts
+                                 WHERE id NOT IN (SELECT fact_id FROM fact_tags)) d ON d.fact_id = a.id
+                         WHERE a.date IS NOT NULL AND a.end_time IS NOT NULL
+                      GROUP BY a.date, a.activity_id, d.tag_id
+        """
+        self.execute(query)
+
+    def __get_totals(self, date, end_date = None, group_by = (), filters = None):
+        """sums up durations of facts between the dates, grouped by any of
+        date, activity, category and tag, facts without tags going under the
+        None tag. filters can hold lists of "category", "activity" and "tag"
+        names a fact should have one of (None for no tags), and "search"
+        terms as in get_facts"""
+        day_start = self.__check_dates()
+        split_time = dt.time(day_start / 60, day_start % 60)
+        end_date = end_date or date
+        filters = filters or {}
+
+        group_by = [group for group in group_by if group in TOTALS_GROUPS]
+        columns = [TOTALS_GROUPS[group] for group in group_by]
+
+        def one_of(column, values):
+            names = [value for value in values if value is not None]
+            conditions = []
+            if names:
+                conditions.append("%s IN (%s)" % (column, ", ".join(["?"] * len(names))))
+            if None in values:
+                conditions.append("%s IS NULL" % column)
+            return "(%s)" % " OR ".join(conditions), names
+
+        conditions, params = [], []
+        if filters.get("category"):
+            categories = [None if category == self._unsorted_localized else category
+                          for category in filters["category"]]
+            condition, names = one_of("c.name", categories)
+            conditions.append(condition)
+            params.extend(names)
+
+        if filters.get("activity"):
+            condition, names = one_of("b.name", filters["activity"])
+            conditions.append(condition)
+            params.extend(names)
+
+        if filters.get("tag"):
+            names = [tag for tag in filters["tag"] if tag is not None]
+            conditions.append("""(t.id IN (SELECT d.fact_id
+                                             FROM fact_tags d
+                                             JOIN tags e ON e.id = d.tag_id
+                                            WHERE e.name IN (%s))
+                                  OR ? AND t.id NOT IN (SELECT fact_id FROM fact_tags))""" % ", ".join(["?"] * len(names)))
+            params.extend(names + [None in filters["tag"]])
+
+        conditions.extend(self.__search_conditions(filters.get("search"), "t.id"))
+
+        if filters.get("tag") or filters.get("search"):
+            # the daily totals know nothing of single facts, so sum them up
+            query = """
+                       SELECT %s sum(strftime('%%s', t.end_time) - strftime('%%s', t.start_time)) AS duration,
+                              count(*) AS facts
+                         FROM facts t
+                         JOIN activities b ON b.id = t.activity_id
+                    LEFT JOIN categories c ON c.id = b.category_id
+                    %s
+                        WHERE t.date BETWEEN ? AND ? AND t.end_time IS NOT NULL
+            """ % ("".join("%s, " % column for column in columns),
+                   """LEFT JOIN fact_tags d ON d.fact_id = t.id
+                      LEFT JOIN tags e ON e.id = d.tag_id""" if "tag" in group_by else "")
+        else:
+            query = """
+                       SELECT %s sum(t.duration) AS duration, sum(t.facts) AS facts
+                         FROM fact_totals t
+                         JOIN activities b ON b.id = t.activity_id
+                    LEFT JOIN categories c ON c.id = b.category_id
+                    LEFT JOIN tags e ON e.id = t.tag_id
+                        WHERE t.date BETWEEN ? AND ? AND t.tag_id %s 0
+            """ % ("".join("%s, " % column for column in columns),
+                   "!=" if "tag" in group_by else "=")
+
+        query += "".join(" AND " + condition for condition in conditions)
+        if columns:
+            query += " GROUP BY " + ", ".join(columns)
+
+        totals = {}
+        for row in self.fetchall(query, [date, end_date] + params):
+            if row["facts"]:
+                key = tuple(row[i] for i in range(len(columns)))
+                totals[key] = [row["duration"], row["facts"]]
+
+        ongoing = self.__get_ongoing(date, end_date, split_time)
+        if ongoing and conditions:
+            query = """
+                       SELECT t.id
+                         FROM facts t
+                         JOIN activities b ON b.id = t.activity_id
+                    LEFT JOIN categories c ON c.id = b.category_id
+                        WHERE t.id IN (%s)
+            """ % ",".join(str(int(id)) for id in ongoing)
+            query += "".join(" AND " + condition for condition in conditions)
+            passed = set(row["id"] for row in self.fetchall(query, params))
+            ongoing = dict(item for item in ongoing.items() if item[0] in passed)
+
+        for fact_id, (fact_date, fact_end_time) in ongoing.items():
+            fact = self.__get_fact(fact_id)
+            delta = fact_end_time - fact["start_time"]
+
+            values = {"date": [fact_date], "activity": [fact["name"]],
+                      "category": [None if fact["category"] == self._unsorted_localized else fact["category"]],
+                      "tag": fact["tags"] or [None]}
+            keys = [()]
+            for group in group_by:
+                keys = [key + (value,) for key in keys for value in values[group]]
+
+            for key in keys:
+                total = totals.setdefault(key, [0, 0])
+                total[0] += delta.days * 24 * 60 * 60 + delta.seconds
+                total[1] += 1
 
         res = []
-        for fact in facts:
-            # heuristics to assign tasks to proper days
-
-            # if fact has no end time, set the last minute of the day,
-            # or current time if fact has happened in last 24 hours
-            if fact["end_time"]:
-                fact_end_time = fact["end_time"]
-            elif (dt.date.today() - fact["start_time"].date()) <= dt.timedelta(days=1):
-                fact_end_time = dt.datetime.now().replace(microsecond = 0)
-            else:
-                fact_end_time = fact["start_time"]
-
-            fact_start_date = fact["start_time"].date() \
-                - dt.timedelta(1 if fact["start_time"].time() < split_time else 0)
-            fact_end_date = fact_end_time.date() \
-                - dt.timedelta(1 if fact_end_time.time() < split_time else 0)
-            fact_date_span = fact_end_date - fact_start_date
-
-            # check if the task spans across two dates
-            if fact_date_span.days == 1:
-                datetime_split = dt.datetime.combine(fact_end_date, split_time)
-                start_date_duration = datetime_split - fact["start_time"]
-                end_date_duration = fact_end_time - datetime_split
-                if start_date_duration > end_date_duration:
-                    # most of the task was done during the previous day
-                    fact_date = fact_start_date
-                else:
-                    fact_date = fact_end_date
-            else:
-                # either doesn't span or more than 24 hrs tracked
-                # (in which case we give up)
-                fact_date = fact_start_date
+        for key in sorted(totals):
+            total = dict(zip(group_by, key))
+            if "category" in total:
+                total["category"] = total["category"] or self._unsorted_localized
+            total["duration"] = dt.timedelta(seconds = totals[key][0])
+            total["facts"] = totals[key][1]
+            res.append(total)
+        return res
 
-            if fact_date < date or fact_date > end_date:
-                # due to spanning we've jumped outside of given period
-                continue
+    def __get_histogram(self, date, end_date = None, bucket = "day"):
+        """time tracked between the dates by the "hour" of the clock, or by
+        the hamster "day" or "month". returns sorted list of (start, duration)
+        tuples for the buckets that have anything in them, where start is
+        a datetime for hours and a date otherwise"""
+        day_start = self.__check_dates()
+        split_time = dt.time(day_start / 60, day_start % 60)
+        end_date = end_date or date
 
-            fact["date"] = fact_date
-            fact["delta"] = fact_end_time - fact["start_time"]
-            res.append(fact)
+        ongoing = self.__get_ongoing(date, end_date, split_time)
 
-        return res
+        histogram = {}
+        if bucket == "hour":
+            # facts are cut into pieces at the turn of every hour
+            ongoing_spans, params = "", [date, end_date]
+            for fact_id, (fact_date, fact_end_time) in ongoing.items():
+                ongoing_spans += """UNION ALL
+                                    SELECT strftime('%Y-%m-%d %H:00:00', start_time), start_time, ?
+                                      FROM facts WHERE id = ?"""
+                params.extend([fact_end_time, fact_id])
+
+            query = """
+                   WITH RECURSIVE spans(hour, start_time, end_time) AS (
+                            SELECT strftime('%%Y-%%m-%%d %%H:00:00', start_time), start_time, end_time
+                              FROM facts
+                             WHERE date BETWEEN ? AND ? AND end_time IS NOT NULL
+                            %s
+                             UNION ALL
+                            SELECT datetime(hour, '+1 hour'), datetime(hour, '+1 hour'), end_time
+                              FROM spans
+                             WHERE datetime(hour, '+1 hour') < end_time)
+                   SELECT hour AS "bucket [timestamp]",
+                          sum(strftime('%%s', min(end_time, datetime(hour, '+1 hour'))) - strftime('%%s', start_time)) AS duration
+                     FROM spans
+                 GROUP BY hour
+            """ % ongoing_spans
+            for row in self.fetchall(query, params):
+                histogram[row["bucket"]] = row["duration"]
+        else:
+            column = "date" if bucket == "day" else "date(date, 'start of month')"
+            query = """
+                       SELECT %s AS "bucket [date]", sum(duration) AS duration
+                         FROM fact_totals
+                        WHERE date BETWEEN ? AND ? AND tag_id = 0
+                     GROUP BY 1
+            """ % column
+            for row in self.fetchall(query, (date, end_date)):
+                histogram[row["bucket"]] = row["duration"]
+
+            for fact_id, (fact_date, fact_end_time) in ongoing.items():
+                delta = fact_end_time - self.__get_fact(fact_id)["start_time"]
+                if bucket == "month":
+                    fact_date = fact_date.replace(day = 1)
+                histogram[fact_date] = histogram.get(fact_date, 0) + delta.days * 24 * 60 * 60 + delta.seconds
+
+        return [(start, dt.timedelta(seconds = histogram[start]))
+                for start in sorted(histogram) if histogram[start]]
 
     def __remove_fact(self, fact_id):
         statements = ["DELETE FROM fact_tags where fact_id = ?",
                       "DELETE FROM facts where id = ?"]
         self.execute(statements, [(fact_id,)] * 2)
 
-        self.__remove_index([fact_id])
-
     def __get_category_activities(self, category_id):
         """returns list of activities, if category is specified, order by name
            otherwise - by activity_order"""
@@ -792,7 +1584,8 @@ class Storage(storage.Storage):
 
 
     def __get_ext_activities(self, search):
-        return self.get_external().get_activities(search)
+        with self.metrics.timed("external:get_activities"):
+            return self.get_external().get_activities(search)
 
     def __get_activities(self, search):
         """returns list of activities for autocomplete,
@@ -834,21 +1627,11 @@ class Storage(storage.Storage):
 
     def __remove_category(self, id):
         """move all activities to unsorted and remove category"""
-
-        affected_query = """
-            SELECT id
-              FROM facts
-             WHERE activity_id in (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-
         update = "update activities set category_id = -1 where category_id = ?"
         self.execute(update, (id, ))
 
         self.execute("delete from categories where id = ?", (id, ))
 
-        self.__remove_index(affected_ids)
-
 
     def __add_activity(self, name, category_id = None, temporary = False):
         # first check that we don't have anything like that yet
@@ -871,69 +1654,114 @@ class Storage(storage.Storage):
         self.execute(query, (name, name.lower(), category_id, deleted))
         return self.__last_insert_rowid()
 
-    def __remove_index(self, ids):
-        """remove affected ids from the index"""
-        if not ids:
-            return
-
-        ids = ",".join((str(id) for id in ids))
-        self.execute("DELETE FROM fact_index where id in (%s)" % ids)
+    def __build_index(self):
+        """(re)create the full text index along with the triggers that keep it
+        in sync, and fill it with all the facts we have"""
+        for trigger in FACT_INDEX_TRIGGERS:
+            self.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+        self.execute("DROP TABLE IF EXISTS fact_index")
 
+        self.execute("""CREATE VIRTUAL TABLE fact_index
+                                       USING fts4(name, category, description, tag)""")
+        for trigger in FACT_INDEX_TRIGGERS.values():
+            self.execute(trigger)
 
-    def __check_index(self, start_date, end_date):
-        """check if maybe index needs rebuilding in the time span"""
-        index_query = """SELECT id
-                           FROM facts
-                          WHERE (end_time >= ? OR end_time IS NULL)
-                            AND start_time <= ?
-                            AND id not in(select id from fact_index)"""
+        query = """
+                   INSERT INTO fact_index(docid, name, category, description, tag)
+                        SELECT a.id, b.name, c.name, a.description,
+                               (SELECT group_concat(e.name, ' ')
+                                  FROM fact_tags d
+                                  JOIN tags e ON e.id = d.tag_id
+                                 WHERE d.fact_id = a.id)
+                          FROM facts a
+                     LEFT JOIN activities b ON a.activity_id = b.id
+                     LEFT JOIN categories c ON b.category_id = c.id
+        """
+        self.execute(query)
+        self.execute("INSERT INTO fact_index(fact_index) VALUES('optimize')")
 
-        rebuild_ids = ",".join([str(res[0]) for res in self.fetchall(index_query, (start_date, end_date))])
 
-        if rebuild_ids:
-            query = """
-                       SELECT a.id AS id,
-                              a.start_time AS start_time,
-                              a.end_time AS end_time,
-                              a.description as description,
-                              b.name AS name, b.id as activity_id,
-                              coalesce(c.name, ?) as category,
-                              e.name as tag,
-                              a.exported AS exported
-                         FROM facts a
-                    LEFT JOIN activities b ON a.activity_id = b.id
-                    LEFT JOIN categories c ON b.category_id = c.id
-                    LEFT JOIN fact_tags d ON d.fact_id = a.id
-                    LEFT JOIN tags e ON e.id = d.tag_id
-                        WHERE a.id in (%s)
-                     ORDER BY a.id
-            """ % rebuild_ids
-
-            facts = self.__group_tags(self.fetchall(query, (self._unsorted_localized, )))
+    """ Here be dragons (lame connection/cursor wrappers) """
+    def __connect(self, query_only = False):
+        profile = self.profile
+        con = sqlite.connect(self.db_path,
+                             detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES,
+                             timeout=profile["busy_timeout"] / 1000.0,
+                             cached_statements=profile["statement_cache"])
+        con.row_factory = sqlite.Row
 
-            insert = """INSERT INTO fact_index (id, name, category, description, tag)
-                             VALUES (?, ?, ?, ?, ?)"""
-            params = [(fact['id'], fact['name'], fact['category'], fact['description'], " ".join(fact['tags'])) for fact in facts]
+        cur = con.cursor()
+        pragmas = ["synchronous", "mmap_size", "cache_size", "busy_timeout"]
+        if not query_only:
+            pragmas.insert(0, "journal_mode") # the writer sets it, once and for all
+        for pragma in pragmas:
+            cur.execute("PRAGMA %s = %s" % (pragma, profile[pragma]))
+        if query_only:
+            cur.execute("PRAGMA query_only = 1")
+        cur.close()
+        return con
 
-            self.executemany(insert, params)
+    def get_connection(self):
+        reader = getattr(self.__local, "con", None)
+        if reader:
+            return reader
 
+        if self.read_only:
+            # the threads of a read-only storage read each on its own
+            self.open_reader()
+            return self.__local.con
 
-    """ Here be dragons (lame connection/cursor wrappers) """
-    def get_connection(self):
         if self.con is None:
-            self.con = sqlite.connect(self.db_path, detect_types=sqlite.PARSE_DECLTYPES|sqlite.PARSE_COLNAMES)
-            self.con.row_factory = sqlite.Row
+            self.con = self.__connect()
+            self.__data_version = self.con.execute("PRAGMA data_version").fetchone()[0]
+            if self.__schema_ready:
+                self.__watch_fact_changes()
 
         return self.con
 
+    def __watch_fact_changes(self):
+        self.con.execute("CREATE TEMP TABLE fact_changes (id integer, date date)")
+        for trigger in FACT_CHANGES_TRIGGERS:
+            self.con.execute(trigger)
+
+    def open_reader(self):
+        """gives the calling thread a read-only connection of its own, used
+        for all the queries made from the thread from then on. with WAL the
+        readers and the writer do not wait on each other"""
+        self.__local.con = self.__connect(query_only = True)
+
+    def __check_writer(self):
+        if self.read_only:
+            raise sqlite.OperationalError("the database is open read-only")
+        # the transaction, if any, belongs to the writer
+        if getattr(self.__local, "con", None):
+            raise sqlite.OperationalError("writing from a reader thread")
+
+    def close_reader(self):
+        con = getattr(self.__local, "con", None)
+        if con:
+            con.close()
+            self.__local.con = None
+
     connection = property(get_connection, None)
 
+    def __record_statement(self, con, statement, params, seconds):
+        self.metrics.add("sql:" + metrics.statement_name(statement), seconds)
+        if seconds >= SLOW_QUERY_SECONDS:
+            try:
+                plan = [row[-1] for row in con.execute("EXPLAIN QUERY PLAN " + statement,
+                                                       params or ())]
+            except sqlite.Error, e:
+                plan = ["no query plan: %s" % e]
+            self.metrics.add_slow(statement, seconds, params, plan)
+
     def fetchall(self, query, params = None):
         con = self.connection
         cur = con.cursor()
 
         logging.debug("%s %s" % (query, params))
 
+        started = time.time()
         if params:
             cur.execute(query, params)
         else:
@@ -941,6 +1769,7 @@ class Storage(storage.Storage):
 
         res = cur.fetchall()
         cur.close()
+        self.__record_statement(con, query, params, time.time() - started)
 
         return res
 
@@ -956,6 +1785,7 @@ class Storage(storage.Storage):
         execute sql statement. optionally you can give multiple statements
         to save on cursor creation and closure
         """
+        self.__check_writer()
         con = self.__con or self.connection
         cur = self.__cur or con.cursor()
 
@@ -965,24 +1795,31 @@ class Storage(storage.Storage):
 
         for state, param in zip(statement, params):
             logging.debug("%s %s" % (state, param))
+            started = time.time()
             cur.execute(state, param)
+            self.__record_statement(con, state, param, time.time() - started)
 
         if not self.__con:
             con.commit()
             cur.close()
-            self.register_modification()
+        self.__bump_generation()
 
     def executemany(self, statement, params = []):
+        self.__check_writer()
         con = self.__con or self.connection
         cur = self.__cur or con.cursor()
 
         logging.debug("%s %s" % (statement, params))
+        started = time.time()
         cur.executemany(statement, params)
+        # the first row of parameters stands in for all of them in the log
+        first_params = params[0] if isinstance(params, list) and params else None
+        self.__record_statement(con, statement, first_params, time.time() - started)
 
         if not self.__con:
             con.commit()
             cur.close()
-            self.register_modification()
+        self.__bump_generation()
 
 
 
@@ -995,14 +1832,19 @@ class Storage(storage.Storage):
         self.__con.commit()
         self.__cur.close()
         self.__con, self.__cur = None, None
-        self.register_modification()
+        # once more, for the reads that started before the commit
+        self.__bump_generation()
+        self.signal_changes()
+
+    def in_transaction(self):
+        return self.__con is not None
 
     def run_fixtures(self):
         self.start_transaction()
 
         """upgrade DB to hamster version"""
         version = self.fetchone("SELECT version FROM version")["version"]
-        current_version = 10
+        current_version = SCHEMA_VERSION
 
         if version < 8:
             # working around sqlite's utf-f case sensitivity (bug 624438)
@@ -1030,6 +1872,47 @@ class Storage(storage.Storage):
             self.execute("""ALTER TABLE facts ADD COLUMN exported bool default false""")
             self.execute("""UPDATE facts set exported=1""")
 
+        if version < 11:
+            # time range and activity lookups - the (start, end) pairs cover
+            # the overlap and squeeze-in queries without touching the table
+            self.execute("""CREATE INDEX IF NOT EXISTS idx_facts_start_end
+                                                ON facts(start_time, end_time)""")
+            self.execute("""CREATE INDEX IF NOT EXISTS idx_facts_end_start
+                                                ON facts(end_time, start_time)""")
+            self.execute("""CREATE INDEX IF NOT EXISTS idx_facts_activity
+                                                ON facts(activity_id, start_time)""")
+            self.execute("""CREATE INDEX IF NOT EXISTS idx_activities_category
+                                                ON activities(category_id)""")
+            self.execute("ANALYZE")
+
+
+        if version < 12:
+            # full text index kept up to date by triggers instead of lazy rebuilds
+            self.__build_index()
+
+        if version < 13:
+            # hamster date of every fact, so that date ranges, limits and
+            # totals can be done exactly in sql. the version table remembers
+            # the day start the dates are valid for
+            self.execute("ALTER TABLE facts ADD COLUMN date date")
+            self.execute("ALTER TABLE version ADD COLUMN day_start_minutes integer")
+            self.execute("""CREATE INDEX IF NOT EXISTS idx_facts_date
+                                                ON facts(date, start_time)""")
+            self.__build_dates(self.__day_start_minutes())
+
+        if version < 14:
+            # daily totals, so that sums over long spans are read from a
+            # few aggregate rows rather than from every fact
+            self.__build_totals()
+
+        if 14 <= version < 15:
+            # totals of the facts without tags. older databases got them
+            # with the totals built just above
+            self.__build_totals()
+
+        self.__dates_day_start = self.fetchone("SELECT day_start_minutes FROM version")["day_start_minutes"]
+        self.__schema_ready = True
+        self.__watch_fact_changes()
 
         # at the happy end, update version number
         if version < current_version:
@@ -1043,11 +1926,30 @@ class Storage(storage.Storage):
 
         self.end_transaction()
 
+    def __open_read_only(self):
+        """what run_fixtures does for the readers, minus the writing. the
+        database is left to the service to upgrade"""
+        version = self.fetchone("SELECT version FROM version")["version"]
+        if version != SCHEMA_VERSION:
+            raise sqlite.OperationalError("database is at version %d, expected %d. "
+                                          "start hamster once to upgrade it"
+                                          % (version, SCHEMA_VERSION))
+        self.__dates_day_start = self.fetchone("SELECT day_start_minutes FROM version")["day_start_minutes"]
+        self.__schema_ready = True
+
     def get_external(self):
-        if self.external_need_update:
-            self.refresh_external(conf)
-        return self.external
-    
+        """the remote tracker source. connecting takes the network, so it is
+        done on first use, and as the connections are not safe to share each
+        thread gets a source of its own"""
+        from configuration import conf
+        from external import ActivitiesSource
+
+        local = self.__local
+        if getattr(local, "external_generation", None) != self.__external_generation:
+            local.external = ActivitiesSource(conf)
+            local.external_generation = self.__external_generation
+        return local.external
+
     def refresh_external(self, conf):
-        self.external = ActivitiesSource(conf)
-        self.external_need_update = False
+        """have the trackers reconnected with the current settings"""
+        self.__external_generation += 1
@@ -0,0 +1,90 @@
+# - coding: utf-8 -
+
+# This file is part of Project Hamster.
+
+# Project Hamster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Project Hamster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The reads of client.Storage made straight on the database, read-only,
+for scripts and cron jobs that should work without a session bus or the
+service - and next to a running one. Nothing is marshalled on the way, and
+there are no file monitors or remote trackers to set up"""
+
+import datetime as dt
+
+from hamster import db
+from hamster.lib import Fact, columnar
+
+
+def to_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
+
+def from_db_fact(fact):
+    return Fact(fact["name"],
+                start_time = fact["start_time"],
+                end_time = fact["end_time"],
+                description = fact["description"] or "",
+                activity_id = fact["activity_id"],
+                category = fact["category"] or "",
+                tags = fact["tags"],
+                date = fact["date"],
+                delta = fact["delta"],
+                exported = fact["exported"],
+                id = fact["id"])
+
+
+class Storage(object):
+    """Same arguments and results as client.Storage, for the reads.
+    database_dir is where hamster.db is, the usual place by default, and
+    profile the connection settings - db.DEFAULT_PROFILE unless given, as
+    the configuration is not read"""
+    def __init__(self, database_dir = None, profile = None):
+        self.db = db.Storage(_("Unsorted"), database_dir, profile or db.DEFAULT_PROFILE,
+                             read_only = True)
+
+    def get_todays_facts(self):
+        return [from_db_fact(fact) for fact in self.db.get_todays_facts()]
+
+    def get_facts(self, date, end_date = None, search_terms = "", limit = None, asc_by_date = True):
+        facts = self.db.get_facts(to_date(date), to_date(end_date), search_terms,
+                                  limit or 0, asc_by_date)
+        return [from_db_fact(fact) for fact in facts]
+
+    def iter_facts(self, date, end_date = None, search_terms = "", asc_by_date = True):
+        for fact in self.db.iter_facts(to_date(date), to_date(end_date), search_terms, asc_by_date):
+            yield from_db_fact(fact)
+
+    def get_facts_columnar(self, date, end_date = None, search_terms = "", asc_by_date = True):
+        facts = self.db.get_facts(to_date(date), to_date(end_date), search_terms, 0, asc_by_date)
+        return columnar.FactColumns.from_facts(facts)
+
+    def get_fact(self, id):
+        return from_db_fact(self.db.get_fact(id))
+
+    def get_totals(self, date, end_date = None, group_by = (), filters = None):
+        return self.db.get_totals(to_date(date), to_date(end_date), group_by, filters)
+
+    def get_histogram(self, date, end_date = None, bucket = "day"):
+        return self.db.get_histogram(to_date(date), to_date(end_date), bucket)
+
+    def get_activities(self, search = ""):
+        return [{"name": row["name"], "category": row["category"] or ""}
+                for row in self.db.get_activities(search)]
+
+    def get_categories(self):
+        return [{"id": row["id"], "name": row["name"]} for row in self.db.get_categories()]
+
+    def get_tags(self, only_autocomplete = False):
+        return [{"id": row["id"], "name": row["name"], "autocomplete": row["autocomplete"]}
+                for row in self.db.get_tags(only_autocomplete)]
+
@@ -18,40 +18,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
 
-import gtk
 import logging
 # from configuration import conf
 import re
-import dbus.mainloop.glib
 import json
-from lib import rt
-from lib import redmine
-from lib.rt import DEFAULT_RT_CATEGORY
-from beaker.cache import cache_regions, cache_region
 import urllib2
 
-jira_active = True
-try:
-    from jira.client import JIRA
-except ImportError:
-    JIRA = None
-    jira_active = False
-
-try:
-    import evolution
-    from evolution import ecal
-except ImportError:
-    ecal = None
-    evolution = None
-
-# configure regions
-cache_regions.update({
-    'short_term': {
-        'expire': 60 * 1000,
-        'type': 'memory',
-        'key_length': 250
-    }
-})
+# the tracker clients, gtk and dbus are imported when first needed, so that
+# importing this module, and with it hamster.db, stays cheap for the service
+
 logger = logging.getLogger("external")
 
 SOURCE_NONE = ""
@@ -78,6 +53,7 @@ class ActivitiesSource(object):
         self.jira_projects = None
         self.jira_issue_types = None
         self.jira_query = None
+        self.__jira_search = None
 
         try:
             self.__connect(conf)
@@ -88,18 +64,20 @@ class ActivitiesSource(object):
             self.source = SOURCE_NONE
 
     def __connect(self, conf):
-        if self.source == SOURCE_EVOLUTION and not evolution:
+        if self.source == SOURCE_EVOLUTION and not get_ecal():
             self.source = SOURCE_NONE  # on failure pretend that there is no evolution
         elif self.source == SOURCE_GTG:
+            import dbus.mainloop.glib
             dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         elif self.source == SOURCE_RT:
             self.__connect_to_rt(conf)
         elif self.source == SOURCE_REDMINE:
             self.__connect_to_redmine(conf)
-        elif jira_active and self.source == SOURCE_JIRA:
+        elif self.source == SOURCE_JIRA:
             self.__connect_to_jira(conf)
 
     def __connect_to_redmine(self, conf):
+        from lib import redmine
         self.redmine_url = conf.get("redmine_url")
         self.redmine_user = conf.get("redmine_user")
         self.redmine_pass = conf.get("redmine_pass")
@@ -116,6 +94,12 @@ class ActivitiesSource(object):
             self.source = SOURCE_NONE
 
     def __connect_to_jira(self, conf):
+        try:
+            from jira.client import JIRA
+        except ImportError:
+            self.source = SOURCE_NONE
+            return
+
         self.jira_url = conf.get("jira_url")
         self.jira_user = conf.get("jira_user")
         self.jira_pass = conf.get("jira_pass")
@@ -132,6 +116,7 @@ class ActivitiesSource(object):
             self.source = SOURCE_NONE
 
     def __connect_to_rt(self, conf):
+        from lib import rt
         self.rt_url = conf.get("rt_url")
         self.rt_user = conf.get("rt_user")
         self.rt_pass = conf.get("rt_pass")
@@ -214,6 +199,7 @@ class ActivitiesSource(object):
 
             activities = []
 
+            import dbus
             tasks = []
             try:
                 tasks = conn.GetTasks()
@@ -335,11 +321,19 @@ class ActivitiesSource(object):
     def __get_jira_issue_types(self):
         return [issuetype.name.lower() for issuetype in self.jira.issue_types()]
 
-    @cache_region('short_term', '__extract_from_jira')
     def __search_jira_issues(self, jira_query=None):
-        return self.jira.search_issues(jira_query, fields=self.jira_fields, maxResults=100)
+        if not self.__jira_search:
+            from beaker.cache import cache_region
+            configure_cache_regions()
+
+            @cache_region('short_term', '__extract_from_jira')
+            def search_issues(jira_url, jira_user, jira_query):
+                return self.jira.search_issues(jira_query, fields=self.jira_fields, maxResults=100)
+            self.__jira_search = search_issues
+        return self.__jira_search(self.jira_url, self.jira_user, jira_query)
 
     def __extract_cat_from_ticket(self, ticket):
+        from lib.rt import DEFAULT_RT_CATEGORY
         category = DEFAULT_RT_CATEGORY
         if 'Queue' in ticket:
             category = ticket['Queue']
@@ -353,6 +347,7 @@ class ActivitiesSource(object):
         return category
 
     def __get_gtg_connection(self):
+        import dbus
         bus = dbus.SessionBus()
         if self.__gtg_connection and bus.name_has_owner("org.gnome.GTG"):
             return self.__gtg_connection
@@ -365,6 +360,7 @@ class ActivitiesSource(object):
             return None
 
     def on_error(self, msg):
+        import gtk
         md = gtk.MessageDialog(None,
                                gtk.DIALOG_DESTROY_WITH_PARENT, gtk.MESSAGE_ERROR,
                                gtk.BUTTONS_CLOSE, msg)
@@ -382,7 +378,29 @@ class ActivitiesSource(object):
         return False
 
 
+def configure_cache_regions():
+    from beaker.cache import cache_regions
+    if 'short_term' not in cache_regions:
+        cache_regions.update({
+            'short_term': {
+                'expire': 60 * 1000,
+                'type': 'memory',
+                'key_length': 250
+            }
+        })
+
+
+def get_ecal():
+    """the evolution calendar module, None if evolution is not there"""
+    try:
+        from evolution import ecal
+    except ImportError:
+        ecal = None
+    return ecal
+
+
 def get_eds_tasks():
+    ecal = get_ecal()
     try:
         sources = ecal.list_task_sources()
         tasks = []
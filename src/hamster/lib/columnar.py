@@ -0,0 +1,196 @@
+# - coding: utf-8 -
+
+# This file is part of Project Hamster.
+
+# Project Hamster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Project Hamster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Facts as parallel lists of their fields rather than as fact objects, for
+stats and charts over years of facts. This is also how GetFactsColumnar
+hands them out, one typed array per field.
+
+Times are seconds since epoch of the local time, as everywhere on d-bus,
+so the time of day and the weekday are plain arithmetic. Activities are
+kept once in a table that the facts point into, and the tags of fact i are
+tag_names[tag_indexes[j]] for j from tag_offsets[i] up to tag_offsets[i + 1]"""
+
+import datetime as dt
+from calendar import timegm
+from collections import defaultdict
+
+DAY = 24 * 60 * 60
+
+
+def to_timestamp(date):
+    """seconds since epoch of the date or datetime"""
+    return timegm(date.timetuple())
+
+def to_datetime(timestamp):
+    return dt.datetime.utcfromtimestamp(timestamp)
+
+def weekday(timestamp):
+    """monday is 0, as in datetime. 1970-01-01 was a thursday"""
+    return (timestamp // DAY + 3) % 7
+
+
+class FactColumns(object):
+    # the order of the columns in GetFactsColumnar and in the constructor
+    COLUMNS = ("ids", "start_times", "end_times", "dates", "deltas", "activities",
+               "descriptions", "exported",
+               "activity_ids", "activity_names", "activity_categories",
+               "tag_offsets", "tag_indexes", "tag_names")
+
+    def __init__(self, ids = None, start_times = None, end_times = None, dates = None,
+                 deltas = None, activities = None, descriptions = None, exported = None,
+                 activity_ids = None, activity_names = None, activity_categories = None,
+                 tag_offsets = None, tag_indexes = None, tag_names = None):
+        self.ids = ids or []
+        self.start_times = start_times or []
+        self.end_times = end_times or [] # 0 for the ongoing one
+        self.dates = dates or []
+        self.deltas = deltas or [] # seconds
+        self.activities = activities or [] # index in the activity table
+        self.descriptions = descriptions or []
+        self.exported = exported or []
+
+        self.activity_ids = activity_ids or []
+        self.activity_names = activity_names or []
+        self.activity_categories = activity_categories or []
+
+        self.tag_offsets = tag_offsets or [0]
+        self.tag_indexes = tag_indexes or []
+        self.tag_names = tag_names or []
+
+    @classmethod
+    def from_facts(cls, facts):
+        """columns of fact records as the storage returns them"""
+        columns = cls()
+        activity_index, tag_index = {}, {}
+        for fact in facts:
+            columns.ids.append(fact["id"])
+            columns.start_times.append(to_timestamp(fact["start_time"]))
+            columns.end_times.append(to_timestamp(fact["end_time"]) if fact["end_time"] else 0)
+            columns.dates.append(to_timestamp(fact["date"]))
+            columns.deltas.append(fact["delta"].days * DAY + fact["delta"].seconds)
+            columns.descriptions.append(fact["description"] or "")
+            columns.exported.append(bool(fact["exported"]))
+
+            activity = (fact["activity_id"] or 0, fact["name"] or "", fact["category"] or "")
+            if activity not in activity_index:
+                activity_index[activity] = len(columns.activity_ids)
+                columns.activity_ids.append(activity[0])
+                columns.activity_names.append(activity[1])
+                columns.activity_categories.append(activity[2])
+            columns.activities.append(activity_index[activity])
+
+            for tag in fact["tags"]:
+                if tag not in tag_index:
+                    tag_index[tag] = len(columns.tag_names)
+                    columns.tag_names.append(tag)
+                columns.tag_indexes.append(tag_index[tag])
+            columns.tag_offsets.append(len(columns.tag_indexes))
+        return columns
+
+    def columns(self):
+        return tuple(getattr(self, name) for name in self.COLUMNS)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __nonzero__(self):
+        return bool(self.ids)
+
+
+    def start_time(self, i):
+        return to_datetime(self.start_times[i])
+
+    def end_time(self, i):
+        return to_datetime(self.end_times[i]) if self.end_times[i] else None
+
+    def date(self, i):
+        return to_datetime(self.dates[i]).date()
+
+    def tags(self, i):
+        return [self.tag_names[j]
+                for j in self.tag_indexes[self.tag_offsets[i]:self.tag_offsets[i + 1]]]
+
+    def names(self):
+        """activity name of every fact"""
+        return [self.activity_names[activity] for activity in self.activities]
+
+    def categories(self):
+        """category of every fact"""
+        return [self.activity_categories[activity] for activity in self.activities]
+
+    def years(self):
+        """the years facts start in"""
+        return sorted(set(to_datetime(start).year for start in self.start_times))
+
+    def totals(self, keys):
+        """seconds tracked by key, keys being a list with one for each fact"""
+        totals = defaultdict(int)
+        for key, delta in zip(keys, self.deltas):
+            totals[key] += delta
+        return dict(totals)
+
+
+    def select(self, indexes):
+        """the facts at the indexes, in that order. the tables are shared"""
+        columns = FactColumns(activity_ids = self.activity_ids,
+                              activity_names = self.activity_names,
+                              activity_categories = self.activity_categories,
+                              tag_names = self.tag_names)
+        for name in ("ids", "start_times", "end_times", "dates", "deltas",
+                     "activities", "descriptions", "exported"):
+            column = getattr(self, name)
+            setattr(columns, name, [column[i] for i in indexes])
+
+        for i in indexes:
+            columns.tag_indexes.extend(self.tag_indexes[self.tag_offsets[i]:self.tag_offsets[i + 1]])
+            columns.tag_offsets.append(len(columns.tag_indexes))
+        return columns
+
+    def merged(self, other):
+        """facts of both, ordered by start time"""
+        activity_index = dict(((self.activity_ids[i], self.activity_names[i], self.activity_categories[i]), i)
+                              for i in range(len(self.activity_ids)))
+        tag_index = dict((tag, i) for i, tag in enumerate(self.tag_names))
+
+        columns = self.select(range(len(self)))
+        columns.activity_ids, columns.activity_names, columns.activity_categories = \
+            list(self.activity_ids), list(self.activity_names), list(self.activity_categories)
+        columns.tag_names = list(self.tag_names)
+
+        for name in ("ids", "start_times", "end_times", "dates", "deltas", "descriptions", "exported"):
+            getattr(columns, name).extend(getattr(other, name))
+
+        for i in range(len(other)):
+            activity = other.activities[i]
+            activity = (other.activity_ids[activity], other.activity_names[activity],
+                        other.activity_categories[activity])
+            if activity not in activity_index:
+                activity_index[activity] = len(columns.activity_ids)
+                columns.activity_ids.append(activity[0])
+                columns.activity_names.append(activity[1])
+                columns.activity_categories.append(activity[2])
+            columns.activities.append(activity_index[activity])
+
+            for tag in other.tags(i):
+                if tag not in tag_index:
+                    tag_index[tag] = len(columns.tag_names)
+                    columns.tag_names.append(tag)
+                columns.tag_indexes.append(tag_index[tag])
+            columns.tag_offsets.append(len(columns.tag_indexes))
+
+        order = sorted(range(len(columns)), key = columns.start_times.__getitem__)
+        return columns.select(order)
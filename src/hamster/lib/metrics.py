@@ -0,0 +1,122 @@
+# - coding: utf-8 -
+
+# This file is part of Project Hamster.
+
+# Project Hamster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Project Hamster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Counts and latencies of what the storage spends its time on - d-bus
+methods, sql statements, the python bits in between and remote trackers.
+Every timing goes under a name like "dbus:GetFacts" or "sql:SELECT ...",
+into a histogram with fixed BUCKETS so that nothing grows with the calls"""
+
+import re
+import time
+import threading
+from collections import deque
+
+# upper bounds of the histogram buckets in seconds, the last one is open
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+MAX_NAMES = 500 # timings beyond that many names go under "other"
+SLOW_LOG_SIZE = 50
+
+
+def statement_name(statement):
+    """sql statement with whitespace collapsed and the numbers taken out,
+    so that the ones differing in an id or a limit share a name"""
+    statement = " ".join(statement.split())
+    return re.sub(r"\b\d+\b", "?", statement)
+
+
+def percentile(buckets, fraction):
+    """upper bound of the bucket the given fraction of calls fit in. None
+    if it is in the open one or there are no calls"""
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip(BUCKETS, buckets):
+        seen += count
+        if seen >= total * fraction:
+            return bound
+    return None
+
+
+class Timing(object):
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count, self.total, self.max = 0, 0.0, 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+
+class Metrics(object):
+    """Thread safe, as the readers record alongside the main loop"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._slow = deque(maxlen = SLOW_LOG_SIZE)
+
+    def add(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if not timing:
+                if len(self._timings) >= MAX_NAMES:
+                    name = name.split(":")[0] + ":other"
+                timing = self._timings.setdefault(name, Timing())
+            timing.add(seconds)
+
+    def timed(self, name):
+        """context manager timing the block under the name"""
+        return _Timer(self, name)
+
+    def add_slow(self, statement, seconds, params, plan):
+        """statement that took longer than it should, along with its query
+        plan as lines of the EXPLAIN QUERY PLAN output"""
+        with self._lock:
+            self._slow.append((statement_name(statement), seconds,
+                               repr(params)[:200], "\n".join(plan)))
+
+    def timings(self):
+        """list of (name, count, total seconds, max seconds, bucket counts)"""
+        with self._lock:
+            return sorted((name, timing.count, timing.total, timing.max, list(timing.buckets))
+                          for name, timing in self._timings.items())
+
+    def slow_queries(self):
+        """list of (statement, seconds, params, plan), the latest last"""
+        with self._lock:
+            return list(self._slow)
+
+
+class _Timer(object):
+    def __init__(self, metrics, name):
+        self.metrics, self.name = metrics, name
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.name, time.time() - self.started)
@@ -0,0 +1,97 @@
+# - coding: utf-8 -
+
+# This file is part of Project Hamster.
+
+# Project Hamster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Project Hamster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Overlap resolution over a whole set of facts in one sweep.
+
+Of two overlapping facts the one with higher priority wins, and on equal
+priority the one that starts later wins (ties go to the bigger key). The loser
+is cut by the full extent of the winner - truncated at either end or split
+in two. That makes the outcome independent of the order facts were added in.
+Facts that are covered completely by the ones that beat them are dropped. An
+ongoing fact is stopped by the first fact that cuts into it, same as starting
+a new activity stops the current one."""
+
+import datetime as dt
+
+INFINITY = dt.datetime.max
+
+
+def resolve(intervals, settled = ()):
+    """intervals is a list of (key, start_time, end_time, priority) tuples,
+    end_time can be None for ongoing facts. Intervals that share a priority
+    listed in `settled` do not cut each other.
+    Returns {key: [(start_time, end_time), ...]} with the remaining pieces of
+    every interval that has to change, in chronological order. Intervals
+    that are covered completely come back with an empty list"""
+    items = sorted(intervals, key = lambda item: item[1])
+
+    def rank(item):
+        return (item[3], item[1], item[0])
+
+    def cuts(winner, loser):
+        if winner[3] == loser[3] and winner[3] in settled:
+            return False
+        return rank(winner) > rank(loser)
+
+    changes = {}
+    active = [] # started before the current one and still running
+    for i, item in enumerate(items):
+        key, start_time, end_time, priority = item
+        end = end_time or INFINITY
+
+        active = [other for other in active if (other[2] or INFINITY) > start_time]
+        cutters = [other for other in active if cuts(other, item)]
+
+        j = i + 1
+        while j < len(items) and items[j][1] < end:
+            if cuts(items[j], item):
+                cutters.append(items[j])
+            j += 1
+
+        active.append(item)
+
+        if not cutters:
+            continue
+
+        pieces = subtract((start_time, end),
+                          [(other[1], other[2] or INFINITY) for other in cutters])
+        if end_time is None:
+            pieces = pieces[:1]
+        pieces = [(start, None if end == INFINITY else end) for start, end in pieces]
+        if pieces != [(start_time, end_time)]:
+            changes[key] = pieces
+
+    return changes
+
+
+def subtract(interval, cutters):
+    """returns what is left of the (start, end) interval after removing
+    all the cutter intervals from it"""
+    start, end = interval
+    pieces = []
+    for cut_start, cut_end in sorted(cutters):
+        if cut_start > start:
+            pieces.append((start, min(cut_start, end)))
+        start = max(start, cut_end)
+        if start >= end:
+            break
+
+    if start < end:
+        pieces.append((start, end))
+
+    return [(piece_start, piece_end) for piece_start, piece_end in pieces
+                                     if piece_end > piece_start]
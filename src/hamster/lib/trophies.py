@@ -31,7 +31,6 @@ except:
     storage = None
 
 from ..lib import Fact
-import stuff
 import datetime as dt
 
 def unlock(achievement_id):
@@ -57,6 +56,7 @@ def check_ongoing(todays_facts):
         last_activity.delta = dt.datetime.now() - last_activity.start_time
 
     # overwhelmed: tracking for more than 16 hours during one day
+    import stuff # gtk and pango come with it, the service gets here late
     total = stuff.duration_minutes([fact.delta for fact in todays_facts])
     if total > 16 * 60:
         unlock("overwhelmed")
@@ -81,9 +81,11 @@ class Overview(gtk.Object):
 
         self._gui.connect_signals(self)
 
+        self.change_detailed = False # facts-changed to follow is taken care of
         self.external_listeners = [
             (runtime.storage, runtime.storage.connect('activities-changed',self.after_activity_update)),
-            (runtime.storage, runtime.storage.connect('facts-changed',self.after_activity_update)),
+            (runtime.storage, runtime.storage.connect('facts-changed',self.after_facts_changed)),
+            (runtime.storage, runtime.storage.connect('facts-changed-detailed',self.after_fact_update)),
             (conf, conf.connect('conf-changed', self.on_conf_change))
         ]
         
@@ -182,14 +184,19 @@ class Overview(gtk.Object):
 
         self.range_pick.set_range(self.start_date, self.end_date, self.view_date)
 
-        durations = [(fact.start_time, fact.delta) for fact in self.facts]
+        if search_terms:
+            durations = [(fact.start_time, fact.delta) for fact in self.facts]
+        else:
+            bucket = widgets.timechart.histogram_bucket(self.start_date, self.end_date)
+            durations = [(start, stuff.duration_minutes(duration)) for start, duration in
+                            runtime.storage.get_histogram(self.start_date, self.end_date, bucket)]
         self.timechart.draw(durations, self.start_date, self.end_date)
 
         if self.get_widget("window_tabs").get_current_page() == 0:
             self.overview.search(self.start_date, self.end_date, self.facts)
-            self.reports.search(self.start_date, self.end_date, self.facts)
+            self.reports.search(self.start_date, self.end_date, self.facts, search_terms)
         else:
-            self.reports.search(self.start_date, self.end_date, self.facts)
+            self.reports.search(self.start_date, self.end_date, self.facts, search_terms)
             self.overview.search(self.start_date, self.end_date, self.facts)
 
     def set_title(self):
@@ -216,6 +223,18 @@ class Overview(gtk.Object):
     def after_activity_update(self, widget):
         self.search()
 
+    def after_facts_changed(self, widget):
+        if self.change_detailed:
+            self.change_detailed = False
+            return
+        self.search()
+
+    def after_fact_update(self, widget, ids, min_date, max_date, kind):
+        self.change_detailed = True
+        if min_date and (max_date < self.start_date or min_date > self.end_date):
+            return # not something we are looking at
+        self.search()
+
 
     def on_search_icon_press(self, widget, position, data):
         if position == gtk.ENTRY_ICON_SECONDARY:
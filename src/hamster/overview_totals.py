@@ -45,6 +45,7 @@ class TotalsBox(gtk.VBox):
         self.get_widget("reports_vbox").reparent(self) #mine!
 
         self.start_date, self.end_date = None, None
+        self.search_terms = ""
 
         #graphs
         x_offset = 0.4 # align all graphs to the left edge
@@ -77,6 +78,8 @@ class TotalsBox(gtk.VBox):
 
         self.get_widget("totals_by_tag").add(self.tag_chart);
 
+        self.totals = {} # replies of the totals read for the current selection
+
         self._gui.connect_signals(self)
 
         self.report_chooser = None
@@ -91,7 +94,6 @@ class TotalsBox(gtk.VBox):
             self.selected_categories.append(key)
 
         self.calculate_totals()
-        self.do_charts()
 
     def on_activity_clicked(self, widget, key):
         if key in self.activity_chart.selected_keys:
@@ -101,7 +103,6 @@ class TotalsBox(gtk.VBox):
             self.activity_chart.selected_keys.append(key)
             self.selected_activities.append(key)
         self.calculate_totals()
-        self.do_charts()
 
     def on_tag_clicked(self, widget, key):
         if key in self.tag_chart.selected_keys:
@@ -111,11 +112,11 @@ class TotalsBox(gtk.VBox):
             self.tag_chart.selected_keys.append(key)
             self.selected_tags.append(key)
         self.calculate_totals()
-        self.do_charts()
 
 
-    def search(self, start_date, end_date, facts):
+    def search(self, start_date, end_date, facts, search_terms = ""):
         self.facts = facts
+        self.search_terms = search_terms
         self.category_sums, self.activity_sums, self.tag_sums = [], [], []
         self.selected_categories, self.selected_activities, self.selected_tags = [], [], []
         self.category_chart.selected_keys, self.activity_chart.selected_keys, self.tag_chart.selected_keys = [], [], []
@@ -132,7 +133,6 @@ class TotalsBox(gtk.VBox):
             self.get_widget("charts").show()
             self.get_widget("total_hours").show()
             self.calculate_totals()
-            self.do_charts()
         else:
             self.get_widget("no_data_label").show()
             self.get_widget("charts").hide()
@@ -142,32 +142,49 @@ class TotalsBox(gtk.VBox):
     def calculate_totals(self):
         if not self.facts:
             return
-        facts = []
-
-        category_sums, activity_sums, tag_sums = defaultdict(dt.timedelta), defaultdict(dt.timedelta), defaultdict(dt.timedelta),
-
-        for fact in self.facts:
-            if self.selected_categories and fact.category not in self.selected_categories:
-                continue
-            if self.selected_activities and fact.activity not in self.selected_activities:
-                continue
-            if self.selected_tags:
-                if fact.tags and not (set(self.selected_tags) & set(fact.tags)):
-                    continue
-                if not fact.tags and WITHOUT_TAG not in self.selected_tags:
-                    continue
-            facts.append(fact)
-            
-            category_sums[fact.category] += fact.delta
-            activity_sums[fact.activity] += fact.delta
-            
-            if fact.tags:
-                for tag in fact.tags:
-                    tag_sums[tag] += fact.delta
-            else:
-                tag_sums[_(WITHOUT_TAG)] += fact.delta
-                
-        total_minutes = stuff.duration_minutes([fact.delta for fact in facts])
+
+        filters = {}
+        if self.selected_categories:
+            filters["category"] = self.selected_categories
+        if self.selected_activities:
+            filters["activity"] = self.selected_activities
+        if self.selected_tags:
+            filters["tag"] = [None if tag == _(WITHOUT_TAG) else tag for tag in self.selected_tags]
+        if self.search_terms:
+            filters["search"] = self.search_terms
+
+        # a fact has one activity and category but can have many tags, so
+        # the tags get a read of their own. the charts are drawn once both
+        # are back
+        self.totals = {}
+        runtime.storage.get_totals_async(self.on_activity_totals, self.start_date, self.end_date,
+                                         ["category", "activity"], filters)
+        runtime.storage.get_totals_async(self.on_tag_totals, self.start_date, self.end_date,
+                                         ["tag"], filters)
+
+    def on_activity_totals(self, totals):
+        self.totals["activity"] = totals
+        self.show_totals()
+
+    def on_tag_totals(self, totals):
+        self.totals["tag"] = totals
+        self.show_totals()
+
+    def show_totals(self):
+        if len(self.totals) < 2:
+            return
+
+        def get_sums(totals, group):
+            sums = defaultdict(dt.timedelta)
+            for total in totals:
+                sums[total[group] or _(WITHOUT_TAG)] += total["duration"]
+            return sums
+
+        category_sums = get_sums(self.totals["activity"], "category")
+        activity_sums = get_sums(self.totals["activity"], "activity")
+        tag_sums = get_sums(self.totals["tag"], "tag")
+
+        total_minutes = stuff.duration_minutes(category_sums.values())
         total_label = _("%s hours (%s minutes) tracked total") % (locale.format("%.2f", total_minutes/60.0), locale.format("%d", total_minutes))
         self.get_widget("total_hours").set_text(total_label)
 
@@ -211,6 +228,8 @@ class TotalsBox(gtk.VBox):
                 tag_sums = sorted(tag_sums.items(), key=lambda x:x[1], reverse = True)
             self.tag_sums = zip(*tag_sums)
 
+        self.do_charts()
+
 
     def do_charts(self):
         self.get_widget("totals_by_category").set_size_request(10,10)
@@ -21,11 +21,11 @@
 # along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
 import os, sys
 import datetime as dt
-from xml.dom.minidom import Document
 import csv
-import copy
-import itertools
 import re
+import shutil
+import tempfile
+from collections import defaultdict
 from string import Template
 
 from configuration import runtime
@@ -44,8 +44,10 @@ from calendar import timegm
 from StringIO import StringIO
 
 def simple(facts, start_date, end_date, format, path = None):
-    facts = copy.deepcopy(facts) # dont want to do anything bad to the input
-    report_path = stuff.locale_from_utf8(path)
+    """writes the report of facts, an iterable that is gone through once
+    and left as it is, to path or an open file. without either the
+    report is kept for export()"""
+    report_path = stuff.locale_from_utf8(path) if isinstance(path, basestring) else path
 
     if format == "tsv":
         writer = TSVWriter(report_path)
@@ -53,6 +55,10 @@ def simple(facts, start_date, end_date, format, path = None):
         writer = XMLWriter(report_path)
     elif format == "ical":
         writer = ICalWriter(report_path)
+    elif format == "jsonl":
+        writer = JSONLinesWriter(report_path)
+    elif format == "csv":
+        writer = CSVWriter(report_path)
     else: #default to HTML
         writer = HTMLWriter(report_path, start_date, end_date)
 
@@ -72,9 +78,16 @@ def simple(facts, start_date, end_date, format, path = None):
 
 
 class ReportWriter(object):
-    #a tiny bit better than repeating the code all the time
+    """Writes each fact out as it comes, so that the report of a year takes
+    no more memory than the one of a day. Subclasses write the start in
+    _start, a fact in _write_fact and the end in _finish"""
     def __init__(self, path = None, datetime_format = "%Y-%m-%d %H:%M:%S"):
-        self.file = open(path, "w") if path else StringIO()
+        # path can also be a file open for writing, which is left open
+        self.own_file = isinstance(path, basestring)
+        if self.own_file:
+            self.file = open(path, "w")
+        else:
+            self.file = path or StringIO()
         self.datetime_format = datetime_format
 
     def export(self):
@@ -85,50 +98,63 @@ class ReportWriter(object):
 
     def write_report(self, facts):
         try:
+            self._start()
             for fact in facts:
-                fact.activity= fact.activity.encode('utf-8')
-                fact.description = (fact.description or u"").encode('utf-8')
-                fact.category = (fact.category or _("Unsorted")).encode('utf-8')
-
-                if self.datetime_format:
-                    fact.start_time = fact.start_time.strftime(self.datetime_format)
-
-                    if fact.end_time:
-                        fact.end_time = fact.end_time.strftime(self.datetime_format)
-                    else:
-                        fact.end_time = ""
-
-                fact.tags = self.correct_tags(fact.tags)
-
-                self._write_fact(fact)
-
-            self._finish(facts)
+                self._write_fact(self._report_fact(fact))
+            self._finish()
         finally:
-            if isinstance(self.file, file):
+            if self.own_file:
                 self.file.close()
 
-    def _start(self, facts):
-        raise NotImplementedError
+    def _report_fact(self, fact):
+        """the values of the fact as they go in the report"""
+        start_time, end_time = fact.start_time, fact.end_time
+        if self.datetime_format:
+            start_time = start_time.strftime(self.datetime_format)
+            end_time = end_time.strftime(self.datetime_format) if end_time else ""
+
+        return ReportFact(activity = fact.activity.encode('utf-8'),
+                          description = (fact.description or u"").encode('utf-8'),
+                          category = (fact.category or _("Unsorted")).encode('utf-8'),
+                          start_time = start_time,
+                          end_time = end_time,
+                          tags = self.correct_tags(fact.tags),
+                          date = fact.date,
+                          delta = fact.delta)
+
+    def _start(self):
+        pass
 
     def _write_fact(self, fact):
         raise NotImplementedError
 
-    def _finish(self, facts):
-        raise NotImplementedError
+    def _finish(self):
+        pass
+
+
+class ReportFact(dict):
+    """a dict of what goes in the report, with the values as attributes too"""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
 
 class ICalWriter(ReportWriter):
     """a lame ical writer, could not be bothered with finding a library"""
     def __init__(self, path):
         ReportWriter.__init__(self, path, datetime_format = "%Y%m%dT%H%M%S")
-        self.file.write("BEGIN:VCALENDAR\nVERSION:1.0\n")
 
+    def _start(self):
+        self.file.write("BEGIN:VCALENDAR\nVERSION:1.0\n")
 
     def _write_fact(self, fact):
         #for now we will skip ongoing facts
         if not fact.end_time: return
 
         if fact.category == _("Unsorted"):
-            fact.category = None
+            fact["category"] = None
 
         self.file.write("""BEGIN:VEVENT
 CATEGORIES:%(category)s
@@ -137,9 +163,9 @@ DTEND:%(end_time)s
 SUMMARY:%(activity)s
 DESCRIPTION:%(description)s
 END:VEVENT
-""" % dict(fact))
+""" % fact)
 
-    def _finish(self, facts):
+    def _finish(self):
         self.file.write("END:VCALENDAR\n")
 
 class TSVWriter(ReportWriter):
@@ -147,6 +173,7 @@ class TSVWriter(ReportWriter):
         ReportWriter.__init__(self, path)
         self.csv_writer = csv.writer(self.file, dialect='excel-tab')
 
+    def _start(self):
         headers = [# column title in the TSV export format
                    _("activity"),
                    # column title in the TSV export format
@@ -164,41 +191,158 @@ class TSVWriter(ReportWriter):
         self.csv_writer.writerow([h.encode('utf-8') for h in headers])
 
     def _write_fact(self, fact):
-        fact.delta = stuff.duration_minutes(fact.delta)
         self.csv_writer.writerow([fact.activity,
                                   fact.start_time,
                                   fact.end_time,
-                                  fact.delta,
+                                  stuff.duration_minutes(fact.delta),
                                   fact.category,
                                   fact.description,
                                   fact.tags])
-    def _finish(self, facts):
-        pass
 
 class XMLWriter(ReportWriter):
+    """writes the elements as they come, in the shape minidom gave them"""
+    def _start(self):
+        # closed once we know whether there are any facts - an empty
+        # report is <activities/>
+        self.file.write('<?xml version="1.0" ?><activities')
+        self.empty = True
+
+    def _write_fact(self, fact):
+        if self.empty:
+            self.file.write(">")
+            self.empty = False
+
+        attributes = [("category", fact.category),
+                      ("description", fact.description),
+                      ("duration_minutes", str(stuff.duration_minutes(fact.delta))),
+                      ("end_time", fact.end_time),
+                      ("name", fact.activity),
+                      ("start_time", fact.start_time),
+                      ("tags", fact.tags)]
+        self.file.write("<activity %s/>" % " ".join('%s="%s"' % (name, xml_escape(value))
+                                                     for name, value in attributes))
+
+    def _finish(self):
+        self.file.write("/>" if self.empty else "</activities>")
+
+# columns of the csv and json lines exports, in this order. meant for other
+# programs, so new ones only ever go at the end
+DATA_COLUMNS = ("id", "start_time", "end_time", "date", "duration_seconds",
+                "activity", "category", "description", "tags", "exported")
+
+class DataWriter(ReportWriter):
+    """For other programs to read - the same DATA_COLUMNS whatever the
+    locale, times in ISO 8601, durations in seconds and no category
+    rather than the translated Unsorted"""
     def __init__(self, path):
-        ReportWriter.__init__(self, path)
-        self.doc = Document()
-        self.activity_list = self.doc.createElement("activities")
+        ReportWriter.__init__(self, path, datetime_format = None)
 
+    def _report_fact(self, fact):
+        delta = fact.delta or dt.timedelta()
+        return ReportFact(id = fact.id,
+                          start_time = fact.start_time.isoformat(),
+                          end_time = fact.end_time.isoformat() if fact.end_time else None,
+                          date = fact.date.isoformat() if fact.date else None,
+                          duration_seconds = delta.days * 24 * 60 * 60 + delta.seconds,
+                          activity = fact.activity,
+                          category = "" if fact.category in (None, _("Unsorted")) else fact.category,
+                          description = fact.description or "",
+                          tags = list(fact.tags),
+                          exported = bool(fact.exported))
+
+class JSONLinesWriter(DataWriter):
+    """a json object on a line for each fact, with the keys in the order of
+    DATA_COLUMNS and the end time null for the ongoing one. put together
+    by hand, as the json module gives up its speedups for ordered keys"""
     def _write_fact(self, fact):
-        activity = self.doc.createElement("activity")
-        activity.setAttribute("name", fact.activity)
-        activity.setAttribute("start_time", fact.start_time)
-        activity.setAttribute("end_time", fact.end_time)
-        activity.setAttribute("duration_minutes", str(stuff.duration_minutes(fact.delta)))
-        activity.setAttribute("category", fact.category)
-        activity.setAttribute("description", fact.description)
-        activity.setAttribute("tags", fact.tags)
-        self.activity_list.appendChild(activity)
+        escape = json.encoder.encode_basestring_ascii
+        self.file.write('{"id": %d, "start_time": "%s", "end_time": %s, "date": %s, '
+                        '"duration_seconds": %d, "activity": %s, "category": %s, '
+                        '"description": %s, "tags": [%s], "exported": %s}\n' % (
+                        fact.id,
+                        fact.start_time,
+                        '"%s"' % fact.end_time if fact.end_time else "null",
+                        '"%s"' % fact.date if fact.date else "null",
+                        fact.duration_seconds,
+                        escape(fact.activity),
+                        escape(fact.category),
+                        escape(fact.description),
+                        ", ".join(escape(tag) for tag in fact.tags),
+                        "true" if fact.exported else "false"))
+
+class CSVWriter(DataWriter):
+    """RFC 4180 - comma separated, fields quoted as needed, CRLF line ends.
+    utf-8, tags separated by commas and exported as true or false"""
+    def __init__(self, path):
+        DataWriter.__init__(self, path)
+        self.csv_writer = csv.writer(self.file, dialect = "excel")
 
-    def _finish(self, facts):
-        self.doc.appendChild(self.activity_list)
-        self.file.write(self.doc.toxml())
+    def _start(self):
+        self.csv_writer.writerow(DATA_COLUMNS)
 
+    def _write_fact(self, fact):
+        fact["tags"] = ", ".join(fact.tags)
+        fact["exported"] = "true" if fact.exported else "false"
+        self.csv_writer.writerow([value.encode("utf-8") if isinstance(value, unicode) else value
+                                  for value in (fact[column] for column in DATA_COLUMNS)])
+
+
+def xml_escape(value):
+    """as minidom escapes attribute values"""
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return value.replace("&", "&amp;").replace("<", "&lt;") \
+                .replace("\"", "&quot;").replace(">", "&gt;")
+
+
+
+# what each row of the activity log is filled with
+ROW_NAMES = ("date", "date_iso", "activity", "category", "tags", "start", "start_iso",
+             "end", "end_iso", "duration", "duration_minutes", "duration_decimal", "description")
+
+# what the page gets once all the facts are in
+TOTALS_NAMES = set(["totals", "day_totals", "fact_totals", "date_fact_totals"])
+
+# each of the facts, for templates that go through them themselves
+FACTS_NAMES = set(["facts", "date_facts"])
+
+def template_names(template):
+    """the placeholders the template has"""
+    return set(match.group("named") or match.group("braced")
+               for match in Template.pattern.finditer(template)
+               if match.group("named") or match.group("braced"))
+
+class RowTemplate(object):
+    """a string.Template turned into a format string once, so that filling
+    it for each of thousands of facts is a single %. Placeholders not in
+    names are left as they are, as safe_substitute does"""
+    def __init__(self, template, names):
+        parts, pos = [], 0
+        for match in Template.pattern.finditer(template):
+            parts.append(template[pos:match.start()].replace("%", "%%"))
+            name = match.group("named") or match.group("braced")
+            if name in names:
+                parts.append("%%(%s)s" % name)
+            elif match.group("escaped") is not None:
+                parts.append("$")
+            else:
+                parts.append(match.group().replace("%", "%%"))
+            pos = match.end()
+        parts.append(template[pos:].replace("%", "%%"))
+        self.format = "".join(parts)
+
+    def substitute(self, data):
+        return self.format % data
 
 
 class HTMLWriter(ReportWriter):
+    """The rows go out as the facts come. The totals the page draws its
+    charts from are summed up on the way by date, activity, category and
+    tags, and go in once all the facts are in - at the end of the page in
+    the default template, added up by day, category, activity and tag so
+    that the page only draws them. Templates that want them before the
+    rows have the rows held in a temporary file meanwhile, and so are the
+    facts themselves for templates that name $facts or $date_facts"""
     def __init__(self, path, start_date, end_date):
         ReportWriter.__init__(self, path, datetime_format = None)
         self.start_date, self.end_date = start_date, end_date
@@ -228,13 +372,42 @@ class HTMLWriter(ReportWriter):
             self.main_template =f.read()
 
 
-        self.fact_row_template = self._extract_template('all_activities')
+        # parsed once, filled for every fact
+        self.fact_row_template = RowTemplate(self._extract_template('all_activities'), ROW_NAMES)
 
         self.by_date_row_template = self._extract_template('by_date_activity')
 
         self.by_date_template = self._extract_template('by_date')
 
-        self.fact_rows = []
+        # date column format for each row in HTML report
+        # Using python datetime formatting syntax. See:
+        # http://docs.python.org/library/time.html#time.strftime
+        self.date_format = C_("html report","%b %d, %Y")
+        self.unsorted = _("Unsorted")
+
+        # the date column, formatted once for each date
+        self.date_strings = {}
+
+        # seconds by (date, activity, category, tags)
+        self.totals = defaultdict(int)
+
+        # what goes before the rows, and what after
+        self.head, self.tail = self.main_template, ""
+        if "$all_activities_rows" in self.main_template:
+            self.head, self.tail = self.main_template.split("$all_activities_rows", 1)
+
+        # the totals are only put together when the template asks for them
+        names = template_names(self.head) | template_names(self.tail)
+        self.totals_names = TOTALS_NAMES & names
+        self.rows_file = self.file
+        if (TOTALS_NAMES | FACTS_NAMES) & template_names(self.head):
+            self.rows_file = tempfile.TemporaryFile()
+
+        # the json of each fact a line, and where the ones of each date are
+        self.facts_file = None
+        if FACTS_NAMES & names:
+            self.facts_file = tempfile.TemporaryFile()
+            self.fact_positions = defaultdict(list)
 
     def correct_tags(self, fact_tags):
         return fact_tags;
@@ -251,60 +424,185 @@ class HTMLWriter(ReportWriter):
         return ""
 
 
+    def _report_fact(self, fact):
+        report_fact = ReportWriter._report_fact(self, fact)
+        report_fact["id"] = fact.id
+        return report_fact
+
+    def _start(self):
+        if self.rows_file is self.file:
+            self.file.write(self._fill(self.head))
+
+
     def _write_fact(self, fact):
+        # straight from the dict - the attribute fallback of ReportFact
+        # adds up over thousands of rows
+        start_time, end_time, delta = fact["start_time"], fact["end_time"], fact["delta"]
+
         # no having end time is fine
         end_time_str, end_time_iso_str = "", ""
-        if fact.end_time:
-            end_time_str = fact.end_time.strftime('%H:%M')
-            end_time_iso_str = fact.end_time.isoformat()
+        if end_time:
+            end_time_str = end_time.strftime('%H:%M')
+            end_time_iso_str = end_time.isoformat()
 
         category = ""
-        if fact.category != _("Unsorted"): #do not print "unsorted" in list
-            category = fact.category
+        if fact["category"] != self.unsorted: #do not print "unsorted" in list
+            category = fact["category"]
 
+        # a year of facts has a few hundred dates
+        if fact["date"] not in self.date_strings:
+            self.date_strings[fact["date"]] = (fact["date"].strftime(self.date_format),
+                                               fact["date"].isoformat())
+        date_str, date_iso_str = self.date_strings[fact["date"]]
 
+        minutes = stuff.duration_minutes(delta)
         data = dict(
-            date = fact.date.strftime(
-                   # date column format for each row in HTML report
-                   # Using python datetime formatting syntax. See:
-                   # http://docs.python.org/library/time.html#time.strftime
-                   C_("html report","%b %d, %Y")),
-            date_iso = fact.date.isoformat(),
-            activity = fact.activity,
+            date = date_str,
+            date_iso = date_iso_str,
+            activity = fact["activity"],
             category = category,
-            tags = fact.tags,
-            start = fact.start_time.strftime('%H:%M'),
-            start_iso = fact.start_time.isoformat(),
+            tags = fact["tags"],
+            start = start_time.strftime('%H:%M'),
+            start_iso = start_time.isoformat(),
             end = end_time_str,
             end_iso = end_time_iso_str,
-            duration = stuff.format_duration(fact.delta) or "",
-            duration_minutes = "%d" % (stuff.duration_minutes(fact.delta)),
-            duration_decimal = "%.2f" % (stuff.duration_minutes(fact.delta) / 60.0),
-            description = fact.description or ""
+            duration = stuff.format_duration(delta) or "",
+            duration_minutes = "%d" % minutes,
+            duration_decimal = "%.2f" % (minutes / 60.0),
+            description = fact["description"] or ""
         )
-        self.fact_rows.append(Template(self.fact_row_template).safe_substitute(data))
-
+        self.rows_file.write(self.fact_row_template.substitute(data))
+        self.rows_file.write("\n")
+
+        tags = tuple(tag.encode("utf-8").strip() for tag in fact["tags"])
+        self.totals[(fact["date"], fact["activity"], fact["category"], tags)] += \
+                                        delta.days * 24 * 60 * 60 + delta.seconds
+
+        if self.facts_file:
+            self.fact_positions[fact["date"]].append(self.facts_file.tell())
+            self.facts_file.write(json_dumps(self._fact_dict(fact, tags)))
+            self.facts_file.write("\n")
+
+    def _fact_dict(self, fact, tags):
+        """the fact as it goes in $facts, as dict(fact) gave it"""
+        delta = fact["delta"]
+        return {
+            'id': int(fact["id"]) if fact["id"] else "",
+            'activity': fact["activity"],
+            'category': fact["category"],
+            'description': fact["description"],
+            'tags': list(tags),
+            'date': timegm(fact["date"].timetuple()) if fact["date"] else "",
+            'start_time': timegm(fact["start_time"].timetuple()),
+            'end_time': timegm(fact["end_time"].timetuple()) if fact["end_time"] else "",
+            'delta': delta.seconds + delta.days * 24 * 60 * 60 if delta else "" #duration in seconds
+        }
+
+
+    def _finish(self):
+        totals = dict((name, json_dumps(getattr(self, "_" + name)()))
+                      for name in self.totals_names)
+
+        if self.rows_file is not self.file:
+            self._write_filled(self.head, totals)
+            self.rows_file.seek(0)
+            shutil.copyfileobj(self.rows_file, self.file)
+            self.rows_file.close()
+        self._write_filled(self.tail, totals)
+
+        if self.facts_file:
+            self.facts_file.close()
 
-    def _finish(self, facts):
-
-        # group by date
-        by_date = []
-        for date, date_facts in itertools.groupby(facts, lambda fact:fact.date):
-            by_date.append((date, [dict(fact) for fact in date_facts]))
-        by_date = dict(by_date)
+        if self.override:
+            # my report is better than your report - overrode and ran the default report
+            trophies.unlock("my_report")
 
-        date_facts = []
+    def _totals(self):
+        """what the charts and the grand total are drawn from: seconds by
+        category, activity and tag, largest first, and by day"""
+        categories, activities, tags = defaultdict(int), defaultdict(int), defaultdict(int)
+        dates = defaultdict(int)
+        for (date, activity, category, fact_tags), delta in self.totals.iteritems():
+            categories[category] += delta
+            activities[activity] += delta
+            for tag in fact_tags:
+                tags[tag] += delta
+            dates[date] += delta
+
+        by_duration = lambda totals: sorted(totals.items(), key = lambda (key, delta): (-delta, key))
+        return {"grand_total": round(sum(dates.values()) / 60.0 / 60, 1),
+                "categories": by_duration(categories),
+                "activities": by_duration(activities),
+                "tags": by_duration(tags),
+                "dates": [dates.get(date, 0) for date in self._dates()]}
+
+    def _day_totals(self):
+        """for each day the date, its seconds and the seconds by activity,
+        category and tags - the by day table groups those further"""
+        by_date = defaultdict(list)
+        for (date, activity, category, tags), delta in sorted(self.totals.items()):
+            by_date[date].append([activity, category, ", ".join(tags), delta])
+
+        return [[date.strftime(self.date_format),
+                 sum(row[3] for row in by_date.get(date, [])),
+                 by_date.get(date, [])] for date in self._dates()]
+
+    def _fact_totals(self):
+        """the totals in the shape of the facts, one for each date,
+        activity, category and tags"""
+        return [{"date": timegm(date.timetuple()),
+                 "activity": activity,
+                 "category": category,
+                 "tags": list(tags),
+                 "delta": delta} for (date, activity, category, tags), delta in sorted(self.totals.items())]
+
+    def _date_fact_totals(self):
+        facts = defaultdict(list)
+        for fact in self._fact_totals():
+            facts[fact["date"]].append(fact)
+        return [[date.strftime(self.date_format), facts.get(timegm(date.timetuple()), [])]
+                for date in self._dates()]
+
+    def _write_filled(self, template, totals):
+        """writes the template filled in, with the facts going in a line at
+        a time from where they were kept"""
+        pos = 0
+        for match in Template.pattern.finditer(template):
+            name = match.group("named") or match.group("braced")
+            if name in FACTS_NAMES:
+                self.file.write(self._fill(template[pos:match.start()], totals))
+                if name == "facts":
+                    self._write_facts()
+                else:
+                    self._write_date_facts()
+                pos = match.end()
+        self.file.write(self._fill(template[pos:], totals))
+
+    def _write_facts(self):
+        self.file.write("[")
+        self.facts_file.seek(0)
+        for i, line in enumerate(self.facts_file):
+            self.file.write((", " if i else "") + line[:-1])
+        self.file.write("]")
+
+    def _write_date_facts(self):
+        self.file.write("[")
+        for i, date in enumerate(self._dates()):
+            self.file.write("%s[%s, [" % (", " if i else "",
+                                          json_dumps(date.strftime(self.date_format))))
+            for j, position in enumerate(self.fact_positions.get(date, [])):
+                self.facts_file.seek(position)
+                self.file.write((", " if j else "") + self.facts_file.readline()[:-1])
+            self.file.write("]]")
+        self.file.write("]")
+
+    def _dates(self):
         date = self.start_date
         while date <= self.end_date:
-            str_date = date.strftime(
-                        # date column format for each row in HTML report
-                        # Using python datetime formatting syntax. See:
-                        # http://docs.python.org/library/time.html#time.strftime
-                        C_("html report","%b %d, %Y"))
-            date_facts.append([str_date, by_date.get(date, [])])
+            yield date
             date += dt.timedelta(days=1)
 
-
+    def _fill(self, template, totals = None):
         data = dict(
             title = self.title,
             #grand_total = _("%s hours") % ("%.1f" % (total_duration.seconds / 60.0 / 60 + total_duration.days * 24)),
@@ -335,15 +633,6 @@ class HTMLWriter(ReportWriter):
 
             start_date = timegm(self.start_date.timetuple()),
             end_date = timegm(self.end_date.timetuple()),
-            facts = json_dumps([dict(fact) for fact in facts]),
-            date_facts = json_dumps(date_facts),
-
-            all_activities_rows = "\n".join(self.fact_rows)
         )
-        self.file.write(Template(self.main_template).safe_substitute(data))
-
-        if self.override:
-            # my report is better than your report - overrode and ran the default report
-            trophies.unlock("my_report")
-
-        return
+        data.update(totals or {})
+        return Template(template).safe_substitute(data)
@@ -0,0 +1,271 @@
+# - coding: utf-8 -
+
+# This file is part of Project Hamster.
+
+# Project Hamster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Project Hamster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The storage api as newline delimited json over a unix socket, for scripts
+and bulk reads that d-bus is too slow and awkward for.
+
+Every request is a line like
+    {"id": 1, "method": "get_facts", "params": {"start_date": "2013-01-01"}}
+and gets a line back with the same id and either "result" or "error".
+get_facts and get_todays_facts stream instead - a {"id": 1, "fact": {...}}
+line for each fact, then the result with the number of facts sent.
+
+Params are named after the arguments of storage.Storage. Dates, in those
+ending in "date", go as "YYYY-MM-DD" and times, in those ending in "time", as
+"YYYY-MM-DDTHH:MM:SS", which is also how dates come back. Durations are in
+seconds. Connections stay open for as many requests as the client likes."""
+
+import os
+import json
+import socket
+import logging
+import tempfile
+import threading
+import datetime as dt
+
+# methods open to the socket. reads run on the connection's own thread
+READS = ("get_fact", "get_totals", "get_histogram", "get_activities",
+         "get_categories", "get_tags", "get_category_activities")
+STREAMS = ("get_facts", "get_todays_facts")
+WRITES = ("add_fact", "update_fact", "remove_fact", "stop_tracking")
+
+MAX_CONNECTIONS = 8
+
+
+def default_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~")
+    return os.path.join(runtime_dir, "hamster.sock")
+
+
+def to_json(obj):
+    """json.dumps default for what storage hands out"""
+    if isinstance(obj, (dt.datetime, dt.date)):
+        return obj.isoformat()
+    elif isinstance(obj, dt.timedelta):
+        return obj.days * 24 * 60 * 60 + obj.seconds
+    elif hasattr(obj, "keys"):
+        return dict((key, obj[key]) for key in obj.keys())
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def fact_to_json(fact):
+    """the fact with json values, converted here rather than in to_json as
+    facts go out by the thousand"""
+    delta = fact["delta"]
+    return {"id": fact["id"],
+            "start_time": fact["start_time"].isoformat(),
+            "end_time": fact["end_time"].isoformat() if fact["end_time"] else None,
+            "date": fact["date"].isoformat(),
+            "delta": delta.days * 24 * 60 * 60 + delta.seconds,
+            "activity": fact["name"],
+            "activity_id": fact["activity_id"],
+            "category": fact["category"],
+            "description": fact["description"],
+            "tags": fact["tags"],
+            "exported": fact["exported"]}
+
+
+def from_json(name, value):
+    if not isinstance(value, basestring):
+        return value
+    elif name.endswith("date"):
+        return dt.datetime.strptime(value, "%Y-%m-%d").date()
+    elif name.endswith("time"):
+        return dt.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+    return value
+
+
+class Server(object):
+    """Serves storage on the unix socket at path. Every connection gets a
+    thread with a read-only connection to the database, writes are handed
+    to run_on_main, which runs the function where the storage writes and
+    returns its result. before_read, if given, is run there before reads"""
+    def __init__(self, storage, path, run_on_main, before_read = None):
+        self.storage = storage
+        self.path = path
+        self.run_on_main = run_on_main
+        self.before_read = before_read
+        self.connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.socket = None
+        self.encoder = json.JSONEncoder(default = to_json)
+
+    def start(self):
+        """raises socket.error if another server answers at path"""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.remove(self.path) # left over from a previous run
+            else:
+                raise socket.error("%s is served already" % self.path)
+            finally:
+                probe.close()
+
+        # bound in a directory nobody but us can get into, and moved in
+        # place once locked down - so there is no moment anyone else could
+        # connect to it
+        workdir = tempfile.mkdtemp(prefix = ".hamster-", dir = os.path.dirname(self.path) or ".")
+        bound = os.path.join(workdir, "socket")
+        try:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.bind(bound)
+            os.chmod(bound, 0600)
+            os.rename(bound, self.path)
+        finally:
+            if os.path.exists(bound):
+                os.remove(bound)
+            os.rmdir(workdir)
+        self.socket.listen(MAX_CONNECTIONS)
+
+        listener = threading.Thread(target = self.listen)
+        listener.daemon = True
+        listener.start()
+
+    def stop(self):
+        if self.socket:
+            try:
+                # wakes up the listener waiting in accept
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.socket.close()
+            self.socket = None
+            os.remove(self.path)
+
+    def listen(self):
+        listening = self.socket
+        while self.socket:
+            try:
+                con, address = listening.accept()
+            except socket.error:
+                break # closed
+
+            if not self.connection_slots.acquire(False):
+                con.close()
+                continue
+
+            worker = threading.Thread(target = self.serve, args = (con,))
+            worker.daemon = True
+            worker.start()
+
+    def serve(self, con):
+        self.storage.open_reader()
+        reader, writer = con.makefile("rb"), con.makefile("wb")
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self.handle(line, writer)
+                    writer.flush()
+        except socket.error:
+            pass # gone
+        finally:
+            self.storage.close_reader()
+            reader.close(), writer.close(), con.close()
+            self.connection_slots.release()
+
+    def handle(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            method = request["method"]
+            params = dict((str(name), from_json(name, value))
+                          for name, value in (request.get("params") or {}).items())
+
+            if method not in STREAMS + READS + WRITES:
+                raise ValueError("unknown method %s" % method)
+
+            with self.storage.metrics.timed("socket:" + method):
+                if method in STREAMS:
+                    result = self.stream(request_id, method, params, writer)
+                elif method in READS:
+                    if self.before_read:
+                        self.run_on_main(self.before_read)
+                    result = getattr(self.storage, method)(**params)
+                else:
+                    result = self.run_on_main(lambda: getattr(self.storage, method)(**params))
+        except Exception, e:
+            logging.warn("socket request failed: %s" % e)
+            self.send(writer, {"id": request_id, "error": str(e)})
+        else:
+            self.send(writer, {"id": request_id, "result": result})
+
+    def stream(self, request_id, method, params, writer):
+        """sends the facts as they are read, returns how many were sent"""
+        if self.before_read:
+            self.run_on_main(self.before_read)
+
+        if method == "get_todays_facts":
+            facts = self.storage.get_todays_facts()
+            for fact in facts:
+                self.send(writer, {"id": request_id, "fact": fact_to_json(fact)})
+            return len(facts)
+
+        count = 0
+        for fact in self.storage.iter_facts(params["start_date"], params.get("end_date"),
+                                            params.get("search_terms", ""),
+                                            params.get("asc_by_date", True)):
+            self.send(writer, {"id": request_id, "fact": fact_to_json(fact)})
+            count += 1
+        return count
+
+    def send(self, writer, message):
+        writer.write(self.encoder.encode(message))
+        writer.write("\n")
+
+
+class Client(object):
+    """Talks to the server for scripts. call returns the result, or raises
+    RuntimeError with the error. facts yields facts as dicts of json values"""
+    def __init__(self, path = None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path or default_path())
+        self.reader, self.writer = self.socket.makefile("rb"), self.socket.makefile("wb")
+        self.request_id = 0
+
+    def request(self, method, params):
+        self.request_id += 1
+        self.writer.write(json.dumps({"id": self.request_id, "method": method, "params": params},
+                                     default = to_json))
+        self.writer.write("\n")
+        self.writer.flush()
+
+    def reply(self):
+        message = json.loads(self.reader.readline())
+        if "error" in message:
+            raise RuntimeError(message["error"])
+        return message
+
+    def call(self, method, **params):
+        self.request(method, params)
+        return self.reply()["result"]
+
+    def facts(self, start_date, end_date = None, search_terms = "", asc_by_date = True):
+        self.request("get_facts", {"start_date": start_date, "end_date": end_date,
+                                   "search_terms": search_terms, "asc_by_date": asc_by_date})
+        while True:
+            message = self.reply()
+            if "result" in message:
+                break
+            yield message["fact"]
+
+    def close(self):
+        self.reader.close(), self.writer.close(), self.socket.close()
@@ -33,7 +33,7 @@ import gtk, gobject
 import pango
 
 import widgets
-from lib import stuff, charting, graphics
+from lib import stuff, charting, graphics, columnar
 from configuration import runtime, conf, load_ui_file
 
 from lib.i18n import C_
@@ -106,9 +106,11 @@ class Stats(gtk.Object):
         self.get_widget("explore_summary").add(self.explore_summary)
         self.get_widget("explore_summary").show_all()
 
+        self.change_detailed = False # facts-changed to follow is taken care of
         self.external_listeners = [
-            (runtime.storage, runtime.storage.connect('activities-changed',self.after_fact_update)),
-            (runtime.storage, runtime.storage.connect('facts-changed',self.after_fact_update))
+            (runtime.storage, runtime.storage.connect('activities-changed',self.after_activity_update)),
+            (runtime.storage, runtime.storage.connect('facts-changed',self.after_facts_changed)),
+            (runtime.storage, runtime.storage.connect('facts-changed-detailed',self.after_fact_update))
         ]
 
         self._gui.connect_signals(self)
@@ -117,24 +119,43 @@ class Stats(gtk.Object):
     def show(self):
         self.window.show_all()
         self.stat_facts = None
+        self.facts_read = None
         day_start = conf.get("day_start_minutes")
         day_start = dt.time(day_start / 60, day_start % 60)
         self.timechart.day_start = day_start
+
+        # all of the facts, as columns rather than objects
+        self.read_facts(dt.date(1970, 1, 2), dt.date.today(), columnar.FactColumns(), self.on_first_read)
+
+    def on_first_read(self):
         self.init_stats()
         self.get_widget("year_box").get_children()[0].set_active(True)
         self.stats()
 
 
+    def read_facts(self, date, end_date, facts, on_read):
+        """reads the facts between the dates a window of days at a time,
+        merged into facts. stat_facts is set to the result and on_read
+        called once they are all in"""
+        if self.facts_read:
+            self.facts_read.cancel()
+
+        read_facts = [facts]
+        def on_window(columns, last):
+            read_facts[0] = read_facts[0].merged(columns)
+            if last:
+                self.facts_read = None
+                self.stat_facts = read_facts[0]
+                on_read()
+
+        self.facts_read = runtime.storage.read_facts_columnar(on_window, date, end_date)
 
-    def init_stats(self):
-        self.stat_facts = runtime.storage.get_facts(dt.date(1970, 1, 2), dt.date.today())
 
+    def init_stats(self):
         if not self.stat_facts:
             self.get_widget("explore_controls").hide()
         else:
-            by_year = stuff.totals(self.stat_facts,
-                                   lambda fact: fact.start_time.year,
-                                   lambda fact: 1)
+            years = self.stat_facts.years()
 
             year_box = self.get_widget("year_box")
             if len(year_box.get_children()) == 0:
@@ -152,11 +173,10 @@ class Stats(gtk.Object):
                 all_button.set_active(True)
                 self.bubbling = False # TODO figure out how to properly work with togglebuttons as radiobuttons
 
-                years = sorted(by_year.keys())
                 for year in years:
                     year_box.pack_start(YearButton(str(year), year, self.on_year_changed))
 
-            if self.stat_facts[-1].start_time.year == self.stat_facts[0].start_time.year:
+            if len(years) == 1:
                 self.get_widget("explore_controls").hide_all()
             else:
                 year_box.show_all()
@@ -165,10 +185,12 @@ class Stats(gtk.Object):
     def stats(self, year = None):
         facts = self.stat_facts
         if year:
-            facts = filter(lambda fact: fact.start_time.year == year,
-                           facts)
+            year_start = columnar.to_timestamp(dt.date(year, 1, 1))
+            year_end = columnar.to_timestamp(dt.date(year + 1, 1, 1))
+            facts = facts.select([i for i, start_time in enumerate(facts.start_times)
+                                  if year_start <= start_time < year_end])
 
-        if not facts or (facts[-1].start_time - facts[0].start_time) < dt.timedelta(days=6):
+        if not facts or facts.start_times[-1] - facts.start_times[0] < 6 * columnar.DAY:
             self.get_widget("statistics_box").hide()
             #self.get_widget("explore_controls").hide()
             label = self.get_widget("not_enough_records_label")
@@ -187,47 +209,50 @@ A week of usage would be nice!"""))
             self.get_widget("not_enough_records_label").hide()
 
         # All dates in the scope
-        durations = [(fact.start_time, fact.delta) for fact in facts]
-        self.timechart.draw(durations, facts[0].date, facts[-1].date)
+        start_date, end_date = facts.date(0), facts.date(len(facts) - 1)
+        bucket = widgets.timechart.histogram_bucket(start_date, end_date)
+        durations = [(start, stuff.duration_minutes(duration)) for start, duration in
+                        runtime.storage.get_histogram(start_date, end_date, bucket)]
+        self.timechart.draw(durations, start_date, end_date)
 
 
         # Totals by category
-        categories = stuff.totals(facts,
-                                  lambda fact: fact.category,
-                                  lambda fact: fact.delta.seconds / 60 / 60.0)
+        categories = dict((total["category"], stuff.duration_minutes(total["duration"]) / 60.0)
+                          for total in runtime.storage.get_totals(start_date, end_date, ["category"]))
         category_keys = sorted(categories.keys())
         categories = [categories[key] for key in category_keys]
         self.chart_category_totals.plot(category_keys, categories)
 
         # Totals by weekday
-        weekdays = stuff.totals(facts,
-                                lambda fact: (fact.start_time.weekday(),
-                                              fact.start_time.strftime("%a")),
-                                lambda fact: fact.delta.seconds / 60 / 60.0)
-
-        weekday_keys = sorted(weekdays.keys(), key = lambda x: x[0]) #sort
-        weekdays = [weekdays[key] for key in weekday_keys] #get values in the order
-        weekday_keys = [key[1] for key in weekday_keys] #now remove the weekday and keep just the abbreviated one
+        weekdays = facts.totals([columnar.weekday(start_time) for start_time in facts.start_times])
+
+        weekday_keys = sorted(weekdays.keys()) #sort
+        weekdays = [weekdays[key] / 60 / 60.0 for key in weekday_keys] #get values in the order
+        weekday_keys = [calendar.day_abbr[key] for key in weekday_keys] #and the abbreviated names
         self.chart_weekday_totals.plot(weekday_keys, weekdays)
 
 
         split_minutes = 5 * 60 + 30 #the mystical hamster midnight
 
+        def minutes(timestamp):
+            return timestamp % columnar.DAY / 60
+
+        def by_date(i):
+            return facts.start_times[i] / columnar.DAY
+
         # starts and ends by weekday
         by_weekday = {}
-        for date, date_facts in groupby(facts, lambda fact: fact.start_time.date()):
+        for date, date_facts in groupby(range(len(facts)), by_date):
             date_facts = list(date_facts)
-            weekday = (date_facts[0].start_time.weekday(),
-                       date_facts[0].start_time.strftime("%a"))
+            weekday = columnar.weekday(facts.start_times[date_facts[0]])
+            weekday = (weekday, calendar.day_abbr[weekday])
             by_weekday.setdefault(weekday, [])
 
             start_times, end_times = [], []
-            for fact in date_facts:
-                start_time = fact.start_time.time()
-                start_time = start_time.hour * 60 + start_time.minute
-                if fact.end_time:
-                    end_time = fact.end_time.time()
-                    end_time = end_time.hour * 60 + end_time.minute
+            for i in date_facts:
+                start_time = minutes(facts.start_times[i])
+                if facts.end_times[i]:
+                    end_time = minutes(facts.end_times[i])
 
                     if start_time < split_minutes:
                         start_time += 24 * 60
@@ -267,21 +292,19 @@ A week of usage would be nice!"""))
 
 
         # starts and ends by category
+        fact_categories = facts.categories()
         by_category = {}
-        for date, date_facts in groupby(facts, lambda fact: fact.start_time.date()):
-            date_facts = sorted(list(date_facts), key = lambda x: x.category)
+        for date, date_facts in groupby(range(len(facts)), by_date):
+            date_facts = sorted(date_facts, key = lambda i: fact_categories[i])
 
-            for category, category_facts in groupby(date_facts, lambda x: x.category):
-                category_facts = list(category_facts)
+            for category, category_facts in groupby(date_facts, lambda i: fact_categories[i]):
                 by_category.setdefault(category, [])
 
                 start_times, end_times = [], []
-                for fact in category_facts:
-                    start_time = fact.start_time
-                    start_time = start_time.hour * 60 + start_time.minute
-                    if fact.end_time:
-                        end_time = fact.end_time.time()
-                        end_time = end_time.hour * 60 + end_time.minute
+                for i in category_facts:
+                    start_time = minutes(facts.start_times[i])
+                    if facts.end_times[i]:
+                        end_time = minutes(facts.end_times[i])
 
                         if start_time < split_minutes:
                             start_time += 24 * 60
@@ -328,20 +351,18 @@ A week of usage would be nice!"""))
             # date format for the first record if the year has not been selected
             # Using python datetime formatting syntax. See:
             # http://docs.python.org/library/time.html#time.strftime
-            first_date = facts[0].start_time.strftime(C_("first record", "%b %d, %Y"))
+            first_date = facts.start_time(0).strftime(C_("first record", "%b %d, %Y"))
         else:
             # date of first record when year has been selected
             # Using python datetime formatting syntax. See:
             # http://docs.python.org/library/time.html#time.strftime
-            first_date = facts[0].start_time.strftime(C_("first record", "%b %d"))
+            first_date = facts.start_time(0).strftime(C_("first record", "%b %d"))
 
         summary += _("First activity was recorded on %s.") % \
                                                      ("<b>%s</b>" % first_date)
 
         # total time tracked
-        total_delta = dt.timedelta(days=0)
-        for fact in facts:
-            total_delta += fact.delta
+        total_delta = dt.timedelta(seconds = sum(facts.deltas))
 
         if total_delta.days > 1:
             human_years_str = ngettext("%(num)s year",
@@ -362,18 +383,15 @@ A week of usage would be nice!"""))
 
 
         # longest fact
-        max_fact = None
-        for fact in facts:
-            if not max_fact or fact.delta > max_fact.delta:
-                max_fact = fact
+        max_fact = max(range(len(facts)), key = facts.deltas.__getitem__)
 
-        longest_date = max_fact.start_time.strftime(
+        longest_date = facts.start_time(max_fact).strftime(
             # How the date of the longest activity should be displayed in statistics
             # Using python datetime formatting syntax. See:
             # http://docs.python.org/library/time.html#time.strftime
             C_("date of the longest activity", "%b %d, %Y"))
 
-        num_hours = max_fact.delta.seconds / 60 / 60.0 + max_fact.delta.days * 24
+        num_hours = facts.deltas[max_fact] / 60 / 60.0
         hours = "<b>%s</b>" % locale.format("%.1f", num_hours)
 
         summary += "\n" + ngettext("Longest continuous work happened on \
@@ -389,19 +407,21 @@ A week of usage would be nice!"""))
                                   len(facts)) % ("<b>%d</b>" % len(facts))
 
 
-        early_start, early_end = dt.time(5,0), dt.time(9,0)
-        late_start, late_end = dt.time(20,0), dt.time(5,0)
+        # in seconds of the day
+        early_start, early_end = 5 * 60 * 60, 9 * 60 * 60
+        late_start, late_end = 20 * 60 * 60, 5 * 60 * 60
 
 
         fact_count = len(facts)
         def percent(condition):
-            matches = [fact for fact in facts if condition(fact)]
-            return round(len(matches) / float(fact_count) * 100)
+            matches = sum(1 for start_time, delta in zip(facts.start_times, facts.deltas)
+                          if condition(start_time % columnar.DAY, delta))
+            return round(matches / float(fact_count) * 100)
 
 
-        early_percent = percent(lambda fact: early_start < fact.start_time.time() < early_end)
-        late_percent = percent(lambda fact: fact.start_time.time() > late_start or fact.start_time.time() < late_end)
-        short_percent = percent(lambda fact: fact.delta <= dt.timedelta(seconds = 60 * 15))
+        early_percent = percent(lambda start_time, delta: early_start < start_time < early_end)
+        late_percent = percent(lambda start_time, delta: start_time > late_start or start_time < late_end)
+        short_percent = percent(lambda start_time, delta: delta <= 60 * 15)
 
         if fact_count < 100:
             summary += "\n\n" + _("Hamster would like to observe you some more!")
@@ -431,9 +451,36 @@ than 15 minutes, you seem to be a busy bee.") % ("<b>%d</b>" % short_percent)
         self.stats(button.year)
 
 
-    def after_fact_update(self, event):
-        self.stat_facts = runtime.storage.get_facts(dt.date(1970, 1, 1), dt.date.today())
-        self.stats()
+    def after_activity_update(self, event):
+        # the first read may still be on its way
+        on_read = self.stats if self.stat_facts is not None else self.on_first_read
+        self.read_facts(dt.date(1970, 1, 1), dt.date.today(), columnar.FactColumns(), on_read)
+
+    def after_facts_changed(self, event):
+        if self.change_detailed:
+            self.change_detailed = False
+            return
+        self.after_activity_update(event)
+
+    def after_fact_update(self, event, ids, min_date, max_date, kind):
+        self.change_detailed = True
+        if not min_date or self.stat_facts is None or self.facts_read:
+            # a read still on its way would miss this change
+            self.after_activity_update(event)
+            return
+
+        today = dt.date.today()
+        if min_date > today:
+            return # we stop at today
+
+        # refetch just the dates that changed
+        max_date = min(max_date, today)
+        ids = set(ids)
+        first, last = columnar.to_timestamp(min_date), columnar.to_timestamp(max_date)
+        facts = self.stat_facts
+        keep = [i for i in range(len(facts))
+                if facts.ids[i] not in ids and not (first <= facts.dates[i] <= last)]
+        self.read_facts(min_date, max_date, facts.select(keep), self.stats)
 
     def get_widget(self, name):
         """ skip one variable (huh) """
@@ -450,6 +497,8 @@ than 15 minutes, you seem to be a busy bee.") % ("<b>%d</b>" % short_percent)
         return True
 
     def close_window(self):
+        if self.facts_read:
+            self.facts_read.cancel()
         if not self.parent:
             gtk.main_quit()
         else:
@@ -18,18 +18,117 @@
 # You should have received a copy of the GNU General Public License
 # along with Project Hamster.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import datetime as dt
 from lib import Fact
 
+# held back change signals go out at the latest this many seconds after the
+# first of them, however long the burst of writes
+MAX_SIGNAL_DELAY = 1
+
+# days of facts iter_facts reads at a time. the date index finds each window
+# directly, where paging by offset or key sifts through all the facts before
+FACT_WINDOW_DAYS = 31
+
+
+def date_windows(start_date, end_date = None, asc_by_date = True, days = FACT_WINDOW_DAYS):
+    """(first, last) dates of the windows of days that cover the span, in
+    the order of the dates"""
+    end_date = end_date or start_date
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + dt.timedelta(days = days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + dt.timedelta(days = 1)
+    if not asc_by_date:
+        windows.reverse()
+    return windows
+
+
 class Storage(object):
+    # seconds to gather changes for before signalling them, so that a burst
+    # of writes is signalled once. 0 signals as soon as the transaction ends
+    signal_window = 0
+
+    def __init__(self):
+        self.__pending = set() # of "tags", "activities" and "facts"
+        self.__pending_kinds = set()
+        self.__first_change, self.__last_change = None, None
+        self.__flush_scheduled = False
+
     def run_fixtures(self):
         pass
 
     # signals that are called upon changes
     def tags_changed(self): pass
     def facts_changed(self): pass
+    def facts_changed_detailed(self, ids, min_date, max_date, kind): pass
     def activities_changed(self): pass
 
+    def in_transaction(self):
+        return False
+
+    def call_later(self, seconds, func):
+        """runs func after the given seconds, where the writes run. there
+        is no loop to wait on here, so it runs right away"""
+        func()
+
+    def __changed(self, signal, kind = None):
+        """notes the change to be signalled once the transaction ends and
+        the signal window has passed. kind is one of added, updated and
+        removed for facts"""
+        self.__pending.add(signal)
+        if kind:
+            self.__pending_kinds.add(kind)
+        self.__last_change = time.time()
+        self.__first_change = self.__first_change or self.__last_change
+        self.signal_changes()
+
+    def signal_changes(self):
+        """signals the pending changes, now or when the window has passed.
+        called again at the end of every transaction"""
+        if not self.__pending or self.__flush_scheduled or self.in_transaction():
+            return
+        if not self.signal_window:
+            self.flush_changes()
+        else:
+            self.__flush_scheduled = True
+            self.call_later(self.signal_window, self.__on_signal_window)
+
+    def __on_signal_window(self):
+        self.__flush_scheduled = False
+        if not self.__pending or self.in_transaction():
+            return # the end of the transaction signals them
+
+        # wait on while the writes keep coming, but not forever
+        now = time.time()
+        due = min(self.__last_change + self.signal_window,
+                  self.__first_change + MAX_SIGNAL_DELAY)
+        if now < due:
+            self.__flush_scheduled = True
+            self.call_later(due - now, self.__on_signal_window)
+        else:
+            self.flush_changes()
+
+    def flush_changes(self):
+        """sends the pending change signals, each once. facts_changed is
+        preceded by what exactly has changed if we know"""
+        pending, kinds = self.__pending, self.__pending_kinds
+        self.__pending, self.__pending_kinds = set(), set()
+        self.__first_change, self.__last_change = None, None
+
+        if "tags" in pending:
+            self.tags_changed()
+        if "activities" in pending:
+            self.activities_changed()
+        if "facts" in pending:
+            ids, min_date, max_date = self.__pop_fact_changes()
+            if ids:
+                kind = kinds.pop() if len(kinds) == 1 else "updated"
+                self.facts_changed_detailed(ids, min_date, max_date, kind)
+            self.facts_changed()
+
     def dispatch_overwrite(self):
         self.tags_changed()
         self.facts_changed()
@@ -52,9 +151,24 @@ class Storage(object):
         self.end_transaction()
 
         if result:
-            self.facts_changed()
+            self.__changed("facts", "added")
         return result
 
+    def add_facts(self, facts):
+        """Add many facts in a single transaction, for imports. facts is an
+        iterable of Fact objects. Returns list of the new fact ids"""
+        self.start_transaction()
+        ids, activities_changed, tags_changed = self.__add_facts(facts)
+        self.end_transaction()
+
+        if tags_changed:
+            self.__changed("tags")
+        if activities_changed:
+            self.__changed("activities")
+        if ids:
+            self.__changed("facts", "added")
+        return ids
+
     def get_fact(self, fact_id):
         """Get fact by id. For output format see GetFacts"""
         return self.__get_fact(fact_id)
@@ -66,7 +180,7 @@ class Storage(object):
         result = self.__add_fact(fact, start_time, end_time, temporary, exported)
         self.end_transaction()
         if result:
-            self.facts_changed()
+            self.__changed("facts", "updated")
         return result
 
 
@@ -75,7 +189,7 @@ class Storage(object):
         facts = self.__get_todays_facts()
         if facts and not facts[-1]['end_time']:
             self.__touch_fact(facts[-1], end_time)
-            self.facts_changed()
+            self.__changed("facts", "updated")
 
 
     def remove_fact(self, fact_id):
@@ -84,13 +198,33 @@ class Storage(object):
         fact = self.__get_fact(fact_id)
         if fact:
             self.__remove_fact(fact_id)
-            self.facts_changed()
+            self.__changed("facts", "removed")
         self.end_transaction()
 
 
     def get_facts(self, start_date, end_date, search_terms, limit, asc_by_date):
         return self.__get_facts(start_date, end_date, search_terms, limit, asc_by_date)
 
+    def iter_facts(self, start_date, end_date = None, search_terms = "", asc_by_date = True):
+        """Same facts as get_facts, read a window of days at a time as they
+        are consumed, for going through years without holding them all"""
+        for window_start, window_end in date_windows(start_date, end_date, asc_by_date):
+            for fact in self.__get_facts(window_start, window_end, search_terms, 0, asc_by_date):
+                yield fact
+
+
+    def get_totals(self, start_date, end_date = None, group_by = (), filters = None):
+        """Totals of the facts between the dates, grouped by any of "date",
+        "activity", "category" and "tag". Filters narrow the facts down by
+        "category", "activity" and "tag" lists and "search" terms.
+        Returns list of dicts with the group values, duration and number of
+        facts"""
+        return self.__get_totals(start_date, end_date, group_by, filters)
+
+    def get_histogram(self, start_date, end_date = None, bucket = "day"):
+        """Time tracked between the dates per "hour", "day" or "month".
+        Returns list of (bucket start, duration) tuples"""
+        return self.__get_histogram(start_date, end_date, bucket)
 
     def get_todays_facts(self):
         """Gets facts of today, respecting hamster midnight. See GetFacts for
@@ -101,7 +235,7 @@ class Storage(object):
     # categories
     def add_category(self, name):
         res = self.__add_category(name)
-        self.activities_changed()
+        self.__changed("activities")
         return res
 
     def get_category_id(self, category):
@@ -109,11 +243,11 @@ class Storage(object):
 
     def update_category(self, id, name):
         self.__update_category(id, name)
-        self.activities_changed()
+        self.__changed("activities")
 
     def remove_category(self, id):
         self.__remove_category(id)
-        self.activities_changed()
+        self.__changed("activities")
 
 
     def get_categories(self):
@@ -123,16 +257,16 @@ class Storage(object):
     # activities
     def add_activity(self, name, category_id = -1):
         new_id = self.__add_activity(name, category_id)
-        self.activities_changed()
+        self.__changed("activities")
         return new_id
 
     def update_activity(self, id, name, category_id):
         self.__update_activity(id, name, category_id)
-        self.activities_changed()
+        self.__changed("activities")
 
     def remove_activity(self, id):
         result = self.__remove_activity(id)
-        self.activities_changed()
+        self.__changed("activities")
         return result
 
     def get_category_activities(self, category_id = -1):
@@ -147,7 +281,7 @@ class Storage(object):
     def change_category(self, id, category_id):
         changed = self.__change_category(id, category_id)
         if changed:
-            self.activities_changed()
+            self.__changed("activities")
         return changed
 
     def get_activity_by_name(self, activity, category_id, resurrect = True):
@@ -164,10 +298,27 @@ class Storage(object):
     def get_tag_ids(self, tags):
         tags, new_added = self.__get_tag_ids(tags)
         if new_added:
-            self.tags_changed()
+            self.__changed("tags")
         return tags
 
     def update_autocomplete_tags(self, tags):
         changes = self.__update_autocomplete_tags(tags)
         if changes:
-            self.tags_changed()
+            self.__changed("tags")
+
+    # maintenance
+    def reindex(self):
+        """rebuild the full text search index from scratch"""
+        self.start_transaction()
+        self.__build_index()
+        self.end_transaction()
+
+    def repair_overlaps(self, start_time = None, end_time = None):
+        """resolve overlapping facts in the given span, or everywhere if the
+        span is not given. returns number of facts that were changed"""
+        self.start_transaction()
+        changed = self.__repair_overlaps(start_time, end_time)
+        self.end_transaction()
+        if changed:
+            self.__changed("facts", "updated")
+        return changed
@@ -251,7 +251,10 @@ class ProjectHamsterStatusIconUnity():
         
     def update_last_activities(self):
         date = dt.datetime.now() - dt.timedelta(days=self._last_activities_days)
-        last_facts = runtime.storage.get_facts(date = date, end_date = dt.datetime.now(), asc_by_date = False)
+        runtime.storage.get_facts_async(self.fill_last_activities, date = date,
+                                        end_date = dt.datetime.now(), asc_by_date = False)
+
+    def fill_last_activities(self, last_facts):
         self.last_activities_menu = gtk.Menu()
         if last_facts:
             self.last_activities_item.set_sensitive(True)
@@ -37,6 +37,7 @@ class ActivityEntry(gtk.Entry):
         self.news = False
         self.activities = None
         self.external_activities = [] # suggestions from outer space
+        self.ext_request = None
         self.categories = None
         self.filter = None
         self.timeout_id = None
@@ -106,6 +107,9 @@ class ActivityEntry(gtk.Entry):
         for obj, handler in self.external_listeners:
             obj.disconnect(handler)
 
+        if self.ext_request:
+            self.ext_request.cancel()
+
         self.popup.destroy()
         self.popup = None
 
@@ -233,7 +237,26 @@ class ActivityEntry(gtk.Entry):
 
         # do not cache as ordering and available options change over time
         self.activities = runtime.storage.get_activities(fact.activity)
-        self.external_activities = runtime.storage.get_ext_activities(fact.activity)
+
+        # remote trackers can take their time, their suggestions are added
+        # once they answer
+        self.external_activities = []
+        self.ext_request = runtime.storage.get_ext_activities_async(self.on_ext_activities, fact.activity)
+
+        self.categories = self.categories or runtime.storage.get_categories()
+        self.fill_suggestions()
+
+    def on_ext_activities(self, activities):
+        if not self.popup:
+            return
+        self.external_activities = activities
+        self.fill_suggestions()
+        if self.popup.get_property("visible"):
+            self.show_popup() # make room for the new ones
+
+    def fill_suggestions(self):
+        fact = Fact(self.filter)
+
         new_activities = []
         for activity in self.activities:
             match = re.match("^(#\d+: )", activity['name'])
@@ -247,12 +270,8 @@ class ActivityEntry(gtk.Entry):
                     new_activities.append(activity)
             else:
                 new_activities.append(activity)
-                
-        self.activities = new_activities
-                    
-        #self.activities.extend(self.external_activities)
 
-        self.categories = self.categories or runtime.storage.get_categories()
+        #new_activities.extend(self.external_activities)
 
 
         time = ''
@@ -279,11 +298,11 @@ class ActivityEntry(gtk.Entry):
             activities_to_append = []
             if conf.get("remote_activities_only"):
                 if not self.external_activities:
-                    activities_to_append.extend(self.activities)
+                    activities_to_append.extend(new_activities)
                 else:
                     activities_to_append.extend(self.external_activities)
             else:
-                activities_to_append.extend(self.activities)
+                activities_to_append.extend(new_activities)
                 if self.external_activities:
                     activities_to_append.extend(self.external_activities)
 
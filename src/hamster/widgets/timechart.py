@@ -30,6 +30,16 @@ from bisect import bisect
 DAY = dt.timedelta(1)
 WEEK = dt.timedelta(7)
 
+
+def histogram_bucket(start_date, end_date):
+    """the storage histogram bucket that fits the bars drawn for the range"""
+    days = abs((end_date - start_date).days)
+    if days > 125:
+        return "month"
+    elif days >= 1:
+        return "day"
+    return "hour"
+
 class VerticalBar(graphics.Sprite):
     def __init__(self, key, format, value, normalized):
         graphics.Sprite.__init__(self)
@@ -149,6 +159,8 @@ class TimeChart(graphics.Scene):
 
 
     def draw(self, durations, start_date, end_date):
+        """durations are (start_time, timedelta) of facts or (start, minutes)
+        of the buckets from the storage histogram"""
         self.durations = durations
 
         if start_date > end_date:
@@ -162,7 +174,10 @@ class TimeChart(graphics.Scene):
             durations_start_time, durations_end_time = start_time, end_time
             if durations:
                 durations_start_time = durations[0][0]
-                durations_end_time = durations[-1][0] + durations[-1][1]
+                last_start, last_duration = durations[-1]
+                if not isinstance(last_duration, dt.timedelta):
+                    last_duration = dt.timedelta(hours = 1) # hour from the histogram
+                durations_end_time = last_start + last_duration
 
             self.start_time = min([start_time, durations_start_time])
             self.end_time = max([end_time, durations_end_time])
@@ -379,6 +394,9 @@ class TimeChart(graphics.Scene):
                     duration_date = start_time.date() - dt.timedelta(1 if start_time.time() < self.day_start else 0)
                     hour_index = bisect(fractions, dt.datetime.combine(duration_date, dt.time())) - 1
                     hours[hour_index] += stuff.duration_minutes(duration)
+            elif isinstance(start_time, dt.datetime) and self.minor_tick < dt.timedelta(1):
+                # minutes within the hour from the histogram
+                hours[bisect(fractions, start_time) - 1] += duration / tick_minutes
             else:
                 if isinstance(start_time, dt.datetime):
                     duration_date = start_time.date() - dt.timedelta(1 if start_time.time() < self.day_start else 0)
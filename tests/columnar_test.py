@@ -0,0 +1,64 @@
+'''Tests the fact columns from /src/hamster/lib/columnar.py'''
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+import datetime as dt
+from hamster.lib import columnar
+
+def fact(id, start, end, name, category, tags):
+    end_time = end or start
+    return {"id": id, "start_time": start, "end_time": end, "date": start.date(),
+            "delta": end_time - start, "activity_id": hash(name) % 100, "name": name,
+            "category": category, "description": None, "tags": tags, "exported": False}
+
+FACTS = [fact(1, dt.datetime(2013, 3, 4, 9), dt.datetime(2013, 3, 4, 10), "work", "job", ["a", "b"]),
+         fact(2, dt.datetime(2013, 3, 4, 11), dt.datetime(2013, 3, 4, 11, 30), "lunch", "", []),
+         fact(3, dt.datetime(2013, 3, 5, 9), dt.datetime(2013, 3, 5, 12), "work", "job", ["b"]),
+         fact(4, dt.datetime(2014, 1, 1, 9), None, "work", "job", ["c"])]
+
+class TestColumns(unittest.TestCase):
+    def test_from_facts(self):
+        columns = columnar.FactColumns.from_facts(FACTS)
+        self.assertEquals(len(columns), 4)
+        self.assertEquals(columns.names(), ["work", "lunch", "work", "work"])
+        self.assertEquals(columns.activity_names, ["work", "lunch"]) # kept once
+        self.assertEquals([columns.tags(i) for i in range(4)], [["a", "b"], [], ["b"], ["c"]])
+        self.assertEquals(columns.tag_names, ["a", "b", "c"])
+        self.assertEquals(columns.start_time(2), dt.datetime(2013, 3, 5, 9))
+        self.assertEquals(columns.end_time(3), None)
+        self.assertEquals(columns.date(0), dt.date(2013, 3, 4))
+        self.assertEquals(columns.deltas, [3600, 1800, 3 * 3600, 0])
+
+    def test_through_columns(self):
+        # what goes over d-bus comes back the same
+        columns = columnar.FactColumns.from_facts(FACTS)
+        copy = columnar.FactColumns(*columns.columns())
+        self.assertEquals(copy.columns(), columns.columns())
+
+    def test_totals(self):
+        columns = columnar.FactColumns.from_facts(FACTS)
+        self.assertEquals(columns.totals(columns.categories()), {"job": 4 * 3600, "": 1800})
+        weekdays = columns.totals([columnar.weekday(start) for start in columns.start_times])
+        self.assertEquals(weekdays, {0: 3600 + 1800, 1: 3 * 3600, 2: 0}) # mon, tue, wed
+        self.assertEquals(columns.years(), [2013, 2014])
+
+    def test_select(self):
+        columns = columnar.FactColumns.from_facts(FACTS).select([2, 0])
+        self.assertEquals(columns.ids, [3, 1])
+        self.assertEquals([columns.tags(i) for i in range(2)], [["b"], ["a", "b"]])
+        self.assertFalse(columnar.FactColumns.from_facts(FACTS).select([]))
+
+    def test_merged(self):
+        first = columnar.FactColumns.from_facts([FACTS[2], FACTS[0]])
+        second = columnar.FactColumns.from_facts([FACTS[3], FACTS[1]])
+        merged = first.merged(second)
+        self.assertEquals(merged.ids, [1, 2, 3, 4])
+        self.assertEquals(merged.names(), ["work", "lunch", "work", "work"])
+        self.assertEquals([merged.tags(i) for i in range(4)], [["a", "b"], [], ["b"], ["c"]])
+        self.assertEquals(len(merged.activity_names), 2)
+
+if __name__ == '__main__':
+    unittest.main()
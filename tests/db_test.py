@@ -0,0 +1,109 @@
+'''Tests adding facts to the storage from /src/hamster/db.py'''
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+import shutil, tempfile
+import datetime as dt
+from hamster.lib import Fact
+from hamster import db
+
+def at(hour, minute = 0):
+    return dt.datetime(2013, 3, 4, hour, minute)
+
+class TestAddFacts(unittest.TestCase):
+    '''The batch import has to end up where adding one by one does'''
+    def setUp(self):
+        self.dirs = []
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        for path in self.dirs:
+            shutil.rmtree(path)
+
+    def make_storage(self, day_start = 0):
+        self.dirs.append(tempfile.mkdtemp())
+        return db.Storage("Unsorted", self.dirs[-1], db.DEFAULT_PROFILE, day_start = day_start)
+
+    def make_today(self):
+        """storage with the day started half a day ago, for the rules that
+        apply to the facts of today"""
+        now = dt.datetime.now().replace(second = 0, microsecond = 0)
+        day_start = now - dt.timedelta(hours = 12)
+        return now, self.make_storage(day_start.hour * 60 + day_start.minute)
+
+    def facts(self, storage, date = at(0).date(), end_date = None):
+        return [(fact["name"], fact["start_time"], fact["end_time"])
+                for fact in storage.get_facts(date, end_date or date, "", 0, True)]
+
+    def test_covered(self):
+        # an existing fact under an imported one is gone
+        self.storage.add_fact("meeting", at(13), at(14))
+        self.storage.add_facts([Fact("import", start_time = at(12), end_time = at(15))])
+        self.assertEquals(self.facts(self.storage), [("import", at(12), at(15))])
+
+    def test_ongoing(self):
+        # an ongoing fact alone stops the ongoing one, same as add_fact
+        now, storage = self.make_today()
+        start, end = now - dt.timedelta(hours = 2), now - dt.timedelta(hours = 1)
+        storage.add_fact("work", start, None)
+        storage.add_facts([Fact("call", start_time = end)])
+        self.assertEquals(self.facts(storage, now.date() - dt.timedelta(days = 1), now.date()),
+                          [("work", start, end), ("call", end, None)])
+
+    def test_ongoing_rules(self):
+        # too short to count is removed, and the same one is kept going
+        now, storage = self.make_today()
+        start = now - dt.timedelta(hours = 1)
+        storage.add_fact("work", start, None)
+        storage.add_facts([Fact("call", start_time = start + dt.timedelta(minutes = 1))])
+        storage.add_facts([Fact("call", start_time = now)])
+        self.assertEquals(self.facts(storage, now.date() - dt.timedelta(days = 1), now.date()),
+                          [("call", start + dt.timedelta(minutes = 1), None)])
+
+    def test_same_as_add_fact(self):
+        existing = [("morning", at(8), at(10)),
+                    ("meeting", at(13), at(14)),
+                    ("lunch", at(11, 30), at(12, 30)),
+                    ("evening", at(16), at(19))]
+        imported = [("review", at(9), at(11)),
+                    ("import", at(12), at(15)),
+                    ("call", at(12, 15), at(12, 45)),
+                    ("standup", at(17), at(17, 15)),
+                    ("short", at(17), at(17, 10))]
+
+        one_by_one = self.make_storage()
+        for storage in (self.storage, one_by_one):
+            for name, start_time, end_time in existing:
+                storage.add_fact(name, start_time, end_time)
+
+        self.storage.add_facts([Fact(name, start_time = start_time, end_time = end_time)
+                                for name, start_time, end_time in imported])
+        for name, start_time, end_time in sorted(imported, key = lambda fact: fact[1]):
+            one_by_one.add_fact(name, start_time, end_time)
+
+        self.assertEquals(self.facts(self.storage), self.facts(one_by_one))
+        self.assertEquals(self.facts(self.storage),
+                          [("morning", at(8), at(9)),
+                           ("review", at(9), at(11)),
+                           ("lunch", at(11, 30), at(12)),
+                           ("import", at(12), at(12, 15)),
+                           ("call", at(12, 15), at(12, 45)),
+                           ("import", at(12, 45), at(15)),
+                           ("evening", at(16), at(17)),
+                           ("short", at(17), at(17, 10)),
+                           ("standup", at(17, 10), at(17, 15)),
+                           ("evening", at(17, 15), at(19))])
+
+class TestProfile(unittest.TestCase):
+    def test_check(self):
+        profile = db.check_profile(dict(journal_mode = "WAL", synchronous = "full; drop table facts",
+                                        mmap_size = "1024", cache_size = -2000.0, busy_timeout = "soon"))
+        self.assertEquals(profile, dict(db.DEFAULT_PROFILE, journal_mode = "wal",
+                                        mmap_size = 1024, cache_size = -2000))
+        self.assertEquals(type(profile["cache_size"]), int)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+'''Tests the timings kept in /src/hamster/lib/metrics.py'''
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+from hamster.lib import metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_buckets(self):
+        m = metrics.Metrics()
+        for seconds in (0.0005, 0.001, 0.003, 10):
+            m.add("dbus:GetFacts", seconds)
+        [(name, count, total, max_seconds, buckets)] = m.timings()
+        self.assertEquals((name, count, max_seconds), ("dbus:GetFacts", 4, 10))
+        self.assertAlmostEquals(total, 10.0045)
+        self.assertEquals(buckets, [2, 0, 1] + [0] * 9 + [1])
+
+    def test_percentile(self):
+        buckets = [0] * (len(metrics.BUCKETS) + 1)
+        self.assertEquals(metrics.percentile(buckets, 0.95), None)
+        buckets[0], buckets[4] = 90, 10
+        self.assertEquals(metrics.percentile(buckets, 0.5), 0.001)
+        self.assertEquals(metrics.percentile(buckets, 0.95), 0.02)
+        buckets[-1] = 100
+        self.assertEquals(metrics.percentile(buckets, 0.95), None)
+
+    def test_statement_name(self):
+        # statements differing in numbers only go under the same name
+        self.assertEquals(metrics.statement_name("SELECT *\n  FROM facts WHERE id IN (1, 22) LIMIT 10"),
+                          "SELECT * FROM facts WHERE id IN (?, ?) LIMIT ?")
+        self.assertEquals(metrics.statement_name("SELECT tag1 FROM t2"), "SELECT tag1 FROM t2")
+
+    def test_names_capped(self):
+        m = metrics.Metrics()
+        for i in range(metrics.MAX_NAMES + 10):
+            m.add("sql:statement %d" % i, 0.001)
+        names = [timing[0] for timing in m.timings()]
+        self.assertEquals(len(names), metrics.MAX_NAMES + 1)
+        self.assertTrue("sql:other" in names)
+
+    def test_slow_log(self):
+        m = metrics.Metrics()
+        for i in range(metrics.SLOW_LOG_SIZE + 5):
+            m.add_slow("SELECT %d" % i, 0.5, (i,), ["SCAN facts"])
+        slow = m.slow_queries()
+        self.assertEquals(len(slow), metrics.SLOW_LOG_SIZE)
+        self.assertEquals(slow[-1], ("SELECT ?", 0.5, "(54,)", "SCAN facts"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''Tests the overlap resolver from /src/hamster/lib/overlaps.py'''
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+import datetime as dt
+from hamster.lib import overlaps
+
+def at(hour, minute = 0):
+    return dt.datetime(2013, 3, 4, hour, minute)
+
+class TestOverlaps(unittest.TestCase):
+    '''Testing the sweep over a set of facts'''
+    def test_no_overlaps(self):
+        changes = overlaps.resolve([(1, at(9), at(10), 0),
+                                    (2, at(10), at(11), 0),
+                                    (3, at(12), None, 0)])
+        self.assertEquals(changes, {})
+
+    def test_later_one_wins(self):
+        # the earlier one gets truncated, no matter the order given in
+        changes = overlaps.resolve([(2, at(10), at(12), 0),
+                                    (1, at(9), at(11), 0)])
+        self.assertEquals(changes, {1: [(at(9), at(10))]})
+
+    def test_split(self):
+        changes = overlaps.resolve([(1, at(9), at(17), 0),
+                                    (2, at(12), at(13), 0)])
+        self.assertEquals(changes, {1: [(at(9), at(12)), (at(13), at(17))]})
+
+    def test_chain(self):
+        # each fact is cut by the full extent of the ones that beat it
+        changes = overlaps.resolve([(1, at(9), at(17), 0),
+                                    (2, at(10), at(11), 0),
+                                    (3, at(10, 30), at(12), 0)])
+        self.assertEquals(changes, {1: [(at(9), at(10)), (at(12), at(17))],
+                                    2: [(at(10), at(10, 30))]})
+
+    def test_priority(self):
+        # higher priority wins even if it starts earlier
+        changes = overlaps.resolve([(1, at(9), at(11), 1),
+                                    (2, at(10), at(12), 0)])
+        self.assertEquals(changes, {2: [(at(11), at(12))]})
+
+    def test_covered(self):
+        # a fact covered by one that beats it is dropped
+        changes = overlaps.resolve([(1, at(10), at(11), 0),
+                                    (2, at(9), at(12), 1)])
+        self.assertEquals(changes, {1: []})
+
+    def test_covered_by_later(self):
+        # same goes for facts covered by later ones of the same priority
+        changes = overlaps.resolve([(1, at(9), at(10), 0),
+                                    (2, at(9), at(12), 0),
+                                    (3, at(13), at(14), 0),
+                                    (4, at(13), at(15), 0)])
+        self.assertEquals(changes, {1: [], 3: []})
+
+    def test_ongoing(self):
+        # an ongoing fact is stopped by the first one cutting into it
+        changes = overlaps.resolve([(1, at(9), None, 0),
+                                    (2, at(10), at(11), 0),
+                                    (3, at(13), at(14), 0)])
+        self.assertEquals(changes, {1: [(at(9), at(10))]})
+
+    def test_settled(self):
+        # settled facts are left to each other and only make room for others
+        changes = overlaps.resolve([(1, at(9), at(12), 0),
+                                    (2, at(10), at(13), 0),
+                                    (3, at(11, 30), at(14), 1)],
+                                   settled = (0,))
+        self.assertEquals(changes, {1: [(at(9), at(11, 30))],
+                                    2: [(at(10), at(11, 30))]})
+
+if __name__ == '__main__':
+    unittest.main()
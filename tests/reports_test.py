@@ -0,0 +1,36 @@
+'''Tests the report writers from /src/hamster/reports.py'''
+
+import sys, os.path
+# a convoluted line to add hamster module to absolute path
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+import datetime as dt
+from hamster.lib import i18n
+i18n.setup_i18n()
+from hamster.lib import Fact
+from hamster import reports
+
+class TestXMLWriter(unittest.TestCase):
+    def export(self, facts):
+        writer = reports.XMLWriter(None)
+        writer.write_report(facts)
+        return writer.export()
+
+    def test_empty(self):
+        # as minidom wrote it
+        self.assertEquals(self.export([]), '<?xml version="1.0" ?><activities/>')
+
+    def test_facts(self):
+        start = dt.datetime(2013, 3, 4, 9)
+        fact = Fact("work", category = "job", description = "a <b>", tags = ["x"],
+                    start_time = start, end_time = start + dt.timedelta(hours = 1),
+                    delta = dt.timedelta(hours = 1))
+        self.assertEquals(self.export([fact]),
+                          '<?xml version="1.0" ?><activities>'
+                          '<activity category="job" description="a &lt;b&gt;" duration_minutes="60"'
+                          ' end_time="2013-03-04 10:00:00" name="work" start_time="2013-03-04 09:00:00"'
+                          ' tags="x"/></activities>')
+
+if __name__ == '__main__':
+    unittest.main()